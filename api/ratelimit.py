@@ -0,0 +1,249 @@
+import collections
+import logging
+import math
+import time
+
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+# Refills and takes from one bucket atomically on the server. Time comes
+# from the server too, so workers with skewed clocks share buckets fairly.
+# The wait is returned as a string: Lua numbers become integers in replies.
+# A negative cost refunds tokens (up to the burst).
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = math.min(burst, tokens - cost)
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+def _refill(tokens, updated, now, rate, burst, cost):
+    # One token-bucket step: (tokens left, seconds until cost is available)
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= cost:
+        return min(burst, tokens - cost), 0.0
+    return tokens, (cost - tokens) / rate
+
+
+class LocalBuckets:
+    """
+    Token buckets in this worker's memory.
+
+    A step never awaits, so on the event loop it is atomic without a lock.
+    Limits are per worker: with N workers a tenant gets up to N times the rate.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        """
+        Initialize the buckets.
+
+        Args:
+            max_keys: Buckets kept before full (idle) ones are dropped
+        """
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> [tokens, updated, time it is full again]
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        """
+        Take cost tokens; returns 0 if allowed, else seconds until they would be.
+
+        A negative cost refunds tokens, up to the burst.
+        """
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            bucket = self._buckets[key] = [burst, now, now]
+        bucket[0], wait = _refill(bucket[0], bucket[1], now, rate, burst, cost)
+        bucket[1] = now
+        bucket[2] = now + (burst - bucket[0]) / rate
+        return wait
+
+    def _prune(self, now):
+        # A bucket that has refilled completely is the same as no bucket
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+
+    async def close(self):
+        pass
+
+
+class RedisBuckets:
+    """
+    Token buckets shared by every worker through Redis.
+
+    Each take is one EVALSHA of TOKEN_BUCKET_SCRIPT. If Redis is unreachable
+    the buckets fall back to per-worker LocalBuckets rather than failing
+    requests.
+    """
+
+    def __init__(self, client, prefix: str = "lightningmcp:ratelimit:"):
+        """
+        Initialize the buckets.
+
+        Args:
+            client: redis.asyncio client (or core.inmemory.InMemoryRedis)
+            prefix: Prefix of the bucket keys
+        """
+        from redis.exceptions import RedisError  # Loaded only when Redis is in use
+        self.client = client
+        self.prefix = prefix
+        self.fallback = LocalBuckets()
+        self._errors = RedisError
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, key, rate, burst, cost=1):
+        try:
+            return float(await self._script(keys=[self.prefix + key], args=[rate, burst, cost]))
+        except self._errors as exc:
+            logger.warning("Rate limit backend unavailable, using local buckets: %s", exc)
+            return await self.fallback.take(key, rate, burst, cost)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class RateLimiter:
+    """
+    Per-tenant and per-tool token buckets, plus load shedding.
+
+    A tenant is the authenticated user, else the client address. Raw
+    credentials are never used: a key that isn't verified costs nothing to
+    change, so keying on it would give every request a fresh bucket.
+    """
+
+    def __init__(self, rate: float = 50, burst: float = 100, tool_rates: dict = None,
+                 backend=None, max_queue_depth: int = None, shed_retry_after: float = 1,
+                 exempt_paths=("/health", "/metrics")):
+        """
+        Initialize the rate limiter.
+
+        Args:
+            rate: Requests per second each tenant may sustain
+            burst: Requests a tenant may make at once
+            tool_rates: Optional {tool name: (rate, burst)} for calls of each
+                tool by each tenant
+            backend: LocalBuckets (default) or RedisBuckets for cross-worker quotas
+            max_queue_depth: Reject requests with 429 while more calls than
+                this wait for an executor worker
+            shed_retry_after: Retry-After seconds when shedding load
+            exempt_paths: Paths never limited
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tool_rates = tool_rates or {}
+        self.backend = backend if backend is not None else LocalBuckets()
+        self.max_queue_depth = max_queue_depth
+        self.shed_retry_after = shed_retry_after
+        self.exempt_paths = frozenset(exempt_paths)
+
+    @staticmethod
+    def tenant(scope, user: dict = None) -> str:
+        """
+        Tenant id of an ASGI request scope.
+
+        Args:
+            scope: The request's ASGI scope
+            user: The user its credentials were verified as, if any
+        """
+        identity = user.get("user_id", user.get("id")) if user else None
+        if identity is not None:
+            return f"user:{identity}"
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    async def check_tenant(self, tenant: str) -> float:
+        """Count one request; returns 0 if allowed, else seconds to wait."""
+        return await self.backend.take(f"tenant:{tenant}", self.rate, self.burst)
+
+    async def check_tools(self, tenant: str, tool_names):
+        """
+        Count one call per tool name (repeats cost more).
+
+        A rejected request uses no tool quota: tokens already taken for its
+        other tools are refunded.
+
+        Returns:
+            (tool name, seconds to wait) for the first tool over its rate, or None
+        """
+        taken = []
+        for name, count in collections.Counter(tool_names).items():
+            limit = self.tool_rates.get(name)
+            if limit is None:
+                continue
+            key = f"tool:{tenant}:{name}"
+            wait = await self.backend.take(key, *limit, count)
+            if wait:
+                for key, limit, count in taken:
+                    await self.backend.take(key, *limit, -count)
+                return name, wait
+            taken.append((key, limit, count))
+        return None
+
+    def overloaded(self, engine) -> bool:
+        """Whether more calls than max_queue_depth are waiting for a worker."""
+        if self.max_queue_depth is None or engine is None:
+            return False
+        executor = engine.parallel_executor
+        return executor.queue_depth("thread") + executor.queue_depth("process") > self.max_queue_depth
+
+    async def close(self):
+        await self.backend.close()
+
+
+def too_many_requests(detail: str, wait: float) -> JSONResponse:
+    """429 response telling the client when to retry."""
+    return JSONResponse({"detail": detail}, status_code=429,
+                        headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying the runtime's RateLimiter, if any, to every HTTP request."""
+
+    def __init__(self, app, runtime):
+        self.app = app
+        self.runtime = runtime
+
+    async def _tenant(self, scope, limiter):
+        # Bearer tokens count only once the runtime's Authenticator (cached,
+        # including rejections) has verified them
+        user = None
+        authenticator = self.runtime.authenticator
+        if authenticator is not None:
+            headers = dict(scope.get("headers") or ())
+            scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                user = await authenticator.authenticate(token)
+        tenant = limiter.tenant(scope, user)
+        scope.setdefault("state", {})["tenant"] = tenant  # For the per-tool quotas in the routes
+        return tenant
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.runtime.rate_limiter
+        if scope["type"] != "http" or limiter is None or scope["path"] in limiter.exempt_paths:
+            return await self.app(scope, receive, send)
+        if limiter.overloaded(self.runtime.engine):
+            # Fail fast instead of queueing behind work that is already late
+            self.runtime.metrics.increment_counter("rate_limited_total", labels={"reason": "overload"})
+            return await too_many_requests("Server overloaded", limiter.shed_retry_after)(scope, receive, send)
+        wait = await limiter.check_tenant(await self._tenant(scope, limiter))
+        if wait:
+            self.runtime.metrics.increment_counter("rate_limited_total", labels={"reason": "tenant"})
+            return await too_many_requests("Rate limit exceeded", wait)(scope, receive, send)
+        await self.app(scope, receive, send)
@@ -1,12 +1,107 @@
-from fastapi import APIRouter
+import asyncio
+import json
+import math
+import re
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from orchestrator.toolchain import ToolChainOrchestrator  # Import the orchestrator
+from core.resilience import CircuitOpenError
+from core.session import PatchError, SessionConflict
+from core.tools import ToolValidationError
+from data.blobs import MissingBlobError
+from orchestrator.toolchain import PlanError, StepExecutionError  # Import the orchestrator errors
 
 router = APIRouter()
 
+MAX_PAGE = 1000  # Items per page of a list-shaped resource
+
 
 class ToolchainRequest(BaseModel):
     request_data: dict  # Simple model for incoming request data
+    timeout: Optional[float] = None  # Seconds for the whole plan, retries included
+
+
+class ToolCall(BaseModel):
+    tool_name: str
+    parameters: dict = {}
+
+
+class BatchRequest(BaseModel):
+    calls: list[ToolCall]  # Independent tool invocations
+    timeout: Optional[float] = None
+
+
+class SessionPatch(BaseModel):
+    patch: list[dict]  # JSON Patch (RFC 6902) operations
+    version: Optional[int] = None  # Only apply on top of this version
+
+
+def _context(timeout):
+    # Steps and retries read the deadline, in event loop time, from the context
+    if timeout is None:
+        return {}
+    return {"deadline": asyncio.get_running_loop().time() + timeout}
+
+
+async def get_runtime(request: Request):
+    """Dependency returning the app's shared runtime, tracked as in flight."""
+    runtime = request.app.state.runtime
+    if runtime.stopping:
+        # Starting it here would rebuild the services the drain is closing
+        raise HTTPException(status_code=503, detail="Server is shutting down", headers={"Retry-After": "1"})
+    await runtime.startup()  # No-op once the lifespan has started it
+    with runtime.track_request():
+        yield runtime
+
+
+async def get_orchestrator(runtime=Depends(get_runtime)):
+    """Dependency returning the app's long-lived orchestrator."""
+    return runtime.orchestrator
+
+
+async def get_engine(runtime=Depends(get_runtime)):
+    """Dependency returning the app's long-lived SparkEngine."""
+    return runtime.engine
+
+
+async def get_user(request: Request, runtime=Depends(get_runtime)):
+    """Dependency returning the bearer token's user, or None when the app has no permissions."""
+    if runtime.permissions is None:
+        return None
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    user = await runtime.authenticator.authenticate(token if scheme.lower() == "bearer" else None)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid or missing bearer token",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return user
+
+
+def _authorize(runtime, user, tool_names):
+    # Every tool the request would run must be allowed before any of them runs
+    permissions = runtime.permissions
+    if permissions is None:
+        return
+    permissions.refresh()
+    for name in tool_names:
+        if not permissions.check_permission(user, tool=name, action="execute"):
+            raise HTTPException(status_code=403, detail=f"Not allowed to execute tool {name!r}")
+
+
+async def _throttle(runtime, request, tool_names):
+    # Per-tenant quotas on the tools the request would run
+    limiter = runtime.rate_limiter
+    if limiter is None:
+        return
+    # The middleware has identified the tenant (after verifying its credentials)
+    tenant = getattr(request.state, "tenant", None) or limiter.tenant(request.scope)
+    exceeded = await limiter.check_tools(tenant, tool_names)
+    if exceeded is not None:
+        name, wait = exceeded
+        runtime.metrics.increment_counter("rate_limited_total", labels={"reason": "tool"})
+        raise HTTPException(status_code=429, detail=f"Rate limit exceeded for tool {name!r}",
+                            headers={"Retry-After": str(max(1, math.ceil(wait)))})
 
 
 @router.get("/health")
@@ -14,19 +109,283 @@ async def health_check():
     return {"status": "ok"}
 
 
-@router.post("/execute_toolchain")
-async def execute_toolchain(request: ToolchainRequest):
-    orchestrator = ToolChainOrchestrator()  # Instantiate the orchestrator
+@router.get("/metrics")
+async def metrics(request: Request):
+    # Not tracked as in flight: scrapes must not hold up shutdown
+    runtime = request.app.state.runtime
+    return PlainTextResponse(runtime.metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 
+@router.get("/debug/traces")
+async def debug_traces(request: Request, limit: int = 10):
+    # Per-stage latency over the sampled traces, plus the slowest span trees
+    tracer = request.app.state.runtime.tracer
+    return {"stages": tracer.breakdown(), "slowest": tracer.slowest(limit)}
+
+
+@router.get("/tools")
+async def list_tools(runtime=Depends(get_runtime)):
+    # Schemas are compiled once at registration time
+    return {"tools": [tool.describe() for tool in runtime.tools.values()]}
+
+
+def _plan_or_400(orchestrator, request_data):
     # Plan the execution based on the incoming request data
-    plan = orchestrator.plan_execution(request.request_data)
+    try:
+        plan = orchestrator.plan_execution(request_data)
+    except PlanError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
     if not plan:
-        return {"error": "Could not plan execution for the given request."}, 400
+        raise HTTPException(status_code=400, detail="Could not plan execution for the given request.")
+    return plan
 
-    # Execute the planned tool sequence
+
+async def get_plan(request: ToolchainRequest, http_request: Request,
+                   orchestrator=Depends(get_orchestrator), runtime=Depends(get_runtime),
+                   user=Depends(get_user)):
+    """Dependency returning the request's plan once every step is authorized and within quota."""
+    # Large payloads become blob references here, so the plan, plan cache and
+    # result cache carry the reference instead of the payload
+    plan = _plan_or_400(orchestrator, runtime.blobs.externalize(request.request_data))
+    tool_names = [step["tool_name"] for step in plan]
+    _authorize(runtime, user, dict.fromkeys(tool_names))
+    await _throttle(runtime, http_request, tool_names)
+    return plan
+
+
+@router.post("/execute_toolchain")
+async def execute_toolchain(request: ToolchainRequest, plan=Depends(get_plan),
+                            orchestrator=Depends(get_orchestrator)):
+    # Execute the planned tool sequence; independent steps run concurrently
     # A real context object would be more complex, possibly holding session state, user info, etc.
-    context = {}
-    execution_results = await orchestrator.execute_plan(plan, context)
+    context = _context(request.timeout)
+    try:
+        execution_results = await orchestrator.execute_plan(plan, context)
+    except StepExecutionError as exc:
+        if isinstance(exc.error, (ToolValidationError, PlanError)):
+            # Bad parameters, or a $ref that doesn't match the referenced output
+            raise HTTPException(status_code=422, detail=str(exc))
+        if isinstance(exc.error, MissingBlobError):
+            # A parameter references a blob that was pruned: the client must re-upload it
+            raise HTTPException(status_code=410, detail=str(exc))
+        if isinstance(exc.error, TimeoutError):
+            raise HTTPException(status_code=504, detail=str(exc))
+        if isinstance(exc.error, CircuitOpenError):
+            raise HTTPException(status_code=503, detail=str(exc),
+                                headers={"Retry-After": str(max(1, math.ceil(exc.error.retry_after)))})
+        raise
 
     return {"results": execution_results}
+
+
+@router.post("/execute_toolchain/stream")
+async def stream_toolchain(request: ToolchainRequest, format: Literal["sse", "ndjson"] = "sse",
+                           plan=Depends(get_plan), orchestrator=Depends(get_orchestrator)):
+    # Send step results and streaming-tool chunks as soon as they are produced
+    context = _context(request.timeout)
+
+    async def body():
+        async for event in orchestrator.stream_plan(plan, context):
+            data = json.dumps(event, default=str)
+            if format == "sse":
+                yield f"event: {event['event']}\ndata: {data}\n\n"
+            else:
+                yield data + "\n"
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type)
+
+
+@router.post("/execute_batch")
+async def execute_batch(request: BatchRequest, http_request: Request, engine=Depends(get_engine),
+                        runtime=Depends(get_runtime), user=Depends(get_user)):
+    # One cache round trip for all lookups and one for all writes; a failing
+    # call only fails its own entry
+    tool_names = [call.tool_name for call in request.calls]
+    _authorize(runtime, user, dict.fromkeys(tool_names))
+    await _throttle(runtime, http_request, tool_names)
+    calls = [call.model_dump() for call in request.calls]
+    outcomes = await engine.execute_batch(calls, _context(request.timeout))
+    return {"results": [
+        {"error": str(outcome)} if isinstance(outcome, Exception) else {"result": outcome}
+        for outcome in outcomes
+    ]}
+
+
+async def get_session_store(session_id: str, request: Request, runtime=Depends(get_runtime),
+                            user=Depends(get_user)):
+    """Dependency returning the session store once the user may use the session."""
+    if runtime.permissions is not None:
+        runtime.permissions.refresh()
+        action = "read" if request.method == "GET" else "write"
+        if not runtime.permissions.check_permission(user, resource=f"session:{session_id}", action=action):
+            raise HTTPException(status_code=403, detail=f"Not allowed to {action} session {session_id!r}")
+    return runtime.sessions
+
+
+@router.get("/sessions/{session_id}")
+async def get_session(session_id: str, sessions=Depends(get_session_store)):
+    try:
+        return await sessions.get(session_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@router.patch("/sessions/{session_id}")
+async def patch_session(session_id: str, request: SessionPatch, sessions=Depends(get_session_store)):
+    # Only the diff travels; a stale "version" gets 409 with the current one
+    try:
+        version = await sessions.update(session_id, request.patch, request.version)
+    except SessionConflict as exc:
+        raise HTTPException(status_code=409, detail={"error": str(exc), "version": exc.current})
+    except PatchError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {"version": version}
+
+
+@router.get("/sessions/{session_id}/updates")
+async def session_updates(session_id: str, sessions=Depends(get_session_store)):
+    # Server-sent events: the current state, then one diff per update
+    try:
+        subscription = await sessions.subscribe(session_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    async def body():
+        async with subscription:
+            async for update in subscription:
+                event = "patch" if "patch" in update else "state"
+                yield f"event: {event}\ndata: {json.dumps(update, default=str)}\n\n"
+
+    return StreamingResponse(body(), media_type="text/event-stream")
+
+
+@router.get("/resources")
+async def list_resources(runtime=Depends(get_runtime)):
+    return {"resources": [resource.describe() for resource in runtime.resources.values()]}
+
+
+def _etag_matches(if_none_match, tag):
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as for GET revalidation (RFC 9110 13.1.2)
+    return tag in (candidate.strip().removeprefix("W/") for candidate in if_none_match.split(","))
+
+
+def _item_range(header):
+    # "items=10-19" (inclusive) or "items=10-"; None if absent or unparsable
+    match = re.fullmatch(r"\s*items=(\d+)-(\d*)\s*", header or "")
+    if match is None:
+        return None
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else None
+    return (start, None) if end is None else (start, max(0, end - start + 1))
+
+
+@router.get("/resources/read")
+async def read_resource(uri: str, offset: Optional[int] = None, limit: Optional[int] = None,
+                        if_none_match: Optional[str] = Header(None), range_header: Optional[str] = Header(None, alias="range"),
+                        runtime=Depends(get_runtime), user=Depends(get_user)):
+    # Served from the resource cache with an ETag; list-shaped resources can be
+    # read a page at a time (?offset=&limit= or "Range: items=0-99"), so a
+    # poller can ask for just what was appended since its last read. Offsets
+    # are sequence numbers: list indexes, shifted by ItemWindow.first for
+    # histories that drop their oldest items
+    if runtime.permissions is not None:
+        runtime.permissions.refresh()
+        if not runtime.permissions.check_permission(user, resource=uri, action="read"):
+            raise HTTPException(status_code=403, detail=f"Not allowed to read resource {uri!r}")
+    try:
+        entry = await runtime.resource_cache.get(uri)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown resource {uri!r}")
+
+    item_range = _item_range(range_header)
+    headers = {"Cache-Control": "no-cache"}  # Always revalidate; 304s are cheap
+    if isinstance(entry.value, list):
+        headers["Accept-Ranges"] = "items"
+    if item_range is None and offset is None and limit is None:
+        headers["ETag"] = entry.etag
+        if _etag_matches(if_none_match, entry.etag):
+            return Response(status_code=304, headers=headers)
+        body = {"uri": uri, "contents": entry.value}
+        return Response(json.dumps(body, default=str), media_type="application/json", headers=headers)
+
+    if not isinstance(entry.value, list):
+        raise HTTPException(status_code=400, detail=f"Resource {uri!r} is not a list and can't be paged")
+    first = getattr(entry.value, "first", 0)
+    total = first + len(entry.value)  # Sequence number the next item will get
+    start, count = item_range if item_range is not None else (offset or 0, limit)
+    if start < 0 or (count is not None and count < 0):
+        raise HTTPException(status_code=400, detail="offset and limit must not be negative")
+    start = max(start, first)  # Dropped items: resume at the oldest retained one
+    count = min(MAX_PAGE, total - start if count is None else count)
+    count = max(0, min(count, total - start))
+    index = start - first
+    headers["ETag"] = runtime.resource_cache.page_etag(entry, index, count)
+    if _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    body = {"uri": uri, "contents": entry.value[index:index + count], "offset": start, "first": first,
+            "total": total, "next_offset": start + count if start + count < total else None}
+    status = 200
+    if item_range is not None:
+        if count == 0 and start >= total > 0:
+            return Response(status_code=416, headers={"Content-Range": f"items */{total}"})
+        status = 206
+        headers["Content-Range"] = f"items {start}-{start + count - 1}/{total}" if count else f"items */{total}"
+    return Response(json.dumps(body, default=str), status_code=status, media_type="application/json",
+                    headers=headers)
+
+
+def _authorize_blob(runtime, user, resource, action):
+    # Blobs are resources: "blobs" to upload, "blob:<digest>" to read one
+    permissions = runtime.permissions
+    if permissions is None:
+        return
+    permissions.refresh()
+    if not permissions.check_permission(user, resource=resource, action=action):
+        raise HTTPException(status_code=403, detail=f"Not allowed to {action} {resource!r}")
+
+
+@router.put("/blobs")
+async def put_blob(request: Request, kind: Literal["bytes", "str"] = "bytes", runtime=Depends(get_runtime),
+                   user=Depends(get_user)):
+    # Upload a payload once (raw body) and pass the returned reference as a
+    # tool parameter; str blobs must be UTF-8
+    _authorize_blob(runtime, user, "blobs", "write")
+    limit = runtime.blobs.max_blob_bytes
+    too_large = HTTPException(status_code=413, detail=f"Blobs are limited to {limit} bytes")
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > limit:
+        raise too_large
+    # Read chunk by chunk so an oversized upload is cut off at the limit
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise too_large
+    if kind == "str":
+        try:
+            body = body.decode("utf-8")
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="A str blob must be UTF-8")
+    return await asyncio.to_thread(runtime.blobs.put, body)
+
+
+@router.get("/blobs/{digest}")
+async def get_blob(digest: str, runtime=Depends(get_runtime), user=Depends(get_user)):
+    # Served straight from the memory map; blobs never change, so cache freely
+    _authorize_blob(runtime, user, f"blob:{digest}", "read")
+    try:
+        view = runtime.blobs.get(digest)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid blob digest {digest!r}")
+    except MissingBlobError:
+        raise HTTPException(status_code=404, detail=f"Unknown blob {digest!r}")
+    return Response(view, media_type="application/octet-stream",
+                    headers={"ETag": f'"{digest}"', "Cache-Control": "public, max-age=31536000, immutable"})
@@ -0,0 +1,146 @@
+"""
+Startup profile of a LightningMCP app: import time by module and time to
+first request, each measured in a fresh interpreter so nothing is already
+imported. Run from the repository root:
+
+    python -m benchmarks.startup main:mcp
+    python -m benchmarks.startup main:mcp --top 25 --output startup.json
+
+The target is "module:attribute" naming a LightningMCP instance (or any
+ASGI app with a lifespan). The first request is a GET of ``--path`` sent
+in-process once the app's lifespan has started.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def parse_importtime(output: str) -> list:
+    """
+    Parse ``python -X importtime`` output.
+
+    Returns:
+        List of {"module", "self_ms", "cumulative_ms", "depth"} in import order
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # The header line
+        name = fields[2].rstrip()
+        modules.append({"module": name.strip(), "self_ms": int(fields[0]) / 1000,
+                        "cumulative_ms": int(fields[1]) / 1000,
+                        "depth": (len(name) - len(name.lstrip())) // 2})
+    return modules
+
+
+def import_profile(module: str, top: int = 15) -> dict:
+    """
+    Import module in a fresh interpreter and rank what it imported.
+
+    Args:
+        module: Module to import
+        top: Modules to report, slowest (self time) first
+
+    Returns:
+        {"total_ms", "modules_imported", "slowest": [...]}
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               capture_output=True, text=True, check=True)
+    modules = parse_importtime(completed.stderr)
+    # A module's imports are listed (indented) just before it; keep only the
+    # target's, not the interpreter's own startup imports
+    end = max(i for i, entry in enumerate(modules) if entry["module"] == module and entry["depth"] == 0)
+    start = end
+    while start > 0 and modules[start - 1]["depth"] > 0:
+        start -= 1
+    modules = modules[start:end + 1]
+    slowest = sorted(modules, key=lambda entry: entry["self_ms"], reverse=True)[:top]
+    return {"total_ms": round(modules[-1]["cumulative_ms"], 3), "modules_imported": len(modules),
+            "slowest": [{key: entry[key] for key in ("module", "self_ms", "cumulative_ms")} for entry in slowest]}
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+async def _first_request(target, path):
+    # Runs in the child interpreter
+    clock = time.perf_counter
+    start = clock()
+    module, _, attribute = target.partition(":")
+    app = importlib.import_module(module)
+    imported = clock()
+    for part in (attribute or "app").split("."):
+        app = getattr(app, part)
+    app = getattr(app, "app", app)  # A LightningMCP builds its ASGI app on first access
+    built = clock()
+    async with app.router.lifespan_context(app):
+        started = clock()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            response = await client.get(path)
+        answered = clock()
+    return {"import_ms": _ms(imported - start), "build_app_ms": _ms(built - imported),
+            "startup_ms": _ms(started - built), "first_request_ms": _ms(answered - started),
+            "total_ms": _ms(answered - start), "status": response.status_code,
+            "modules_loaded": len(sys.modules)}
+
+
+def first_request_profile(target: str, path: str = "/health") -> dict:
+    """
+    Time from a fresh interpreter to the app's first response.
+
+    Args:
+        target: "module:attribute" of a LightningMCP instance or ASGI app
+        path: Path to GET
+
+    Returns:
+        Milliseconds spent importing, building the app, running the startup
+        hooks and answering, plus "process_ms" including interpreter startup
+    """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-m", "benchmarks.startup", "--child", target, "--path", path],
+                               capture_output=True, text=True, check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_ms"] = _ms(time.perf_counter() - start)
+    return result
+
+
+def profile(target: str, path: str = "/health", top: int = 15) -> dict:
+    """Import profile of the target's module plus its time to first request."""
+    return {"target": target, "python": sys.version.split()[0],
+            "import": import_profile(target.partition(":")[0], top),
+            "first_request": first_request_profile(target, path)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile a LightningMCP app's startup")
+    parser.add_argument("target", help='"module:attribute" of the app, e.g. main:mcp')
+    parser.add_argument("--path", default="/health", help="path of the first request")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--output", help="write the profile to this JSON file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(asyncio.run(_first_request(args.target, args.path))))
+        return 0
+    output = json.dumps(profile(args.target, args.path, args.top), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Benchmark suite: hot-path micro-benchmarks and in-process load against the
+HTTP API, reported as JSON (p50/p95/p99 latency, throughput, allocations).
+
+Everything runs against an in-memory Redis stand-in by default, so no
+server is needed; pass ``--backend redis://host`` to measure a real one.
+Run from the repository root:
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --compare results.json   # exit 1 on regressions
+
+Use ``--quick`` for a fast smoke run and ``--only NAME`` to select
+benchmarks by substring.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import sys
+import uuid
+
+import httpx
+
+from core.cache import InMemoryInvalidationBus, LRUCache, VectorCache
+from core.engine import SparkEngine
+from core.inmemory import InMemoryRedis
+from core.keys import derive_cache_key
+from core.security import PermissionSystem
+from core.tools import ToolSpec
+from lightningmcp import LightningMCP
+from monitoring.metrics import MetricsCollector
+
+from .harness import abench, bench, compare, load
+
+
+def calculate(a: float, operation: str, b: float) -> float:
+    """Perform basic math operations"""
+    if operation == "+":
+        return a + b
+    return a * b
+
+
+PARAMS = {"a": 2.0, "operation": "+", "b": 3.5}
+
+
+def make_backend(spec: str):
+    """In-memory stand-in for "memory", else a redis.asyncio client for a URL."""
+    if spec == "memory":
+        return InMemoryRedis()
+    import redis.asyncio as redis
+    return redis.from_url(spec)
+
+
+def make_cache(backend):
+    return VectorCache(client=backend, l1=LRUCache(), bus=InMemoryInvalidationBus())
+
+
+async def micro_benchmarks(backend, number, repeat, selected):
+    """Yield (name, result) for each selected micro-benchmark."""
+    spec = ToolSpec(calculate)
+    if selected("cache_key"):
+        yield "cache_key", bench(lambda: derive_cache_key("calculate", PARAMS, spec.cache_version), number, repeat)
+    if selected("tool_invoke"):
+        yield "tool_invoke", bench(lambda: spec.invoke(PARAMS), number, repeat)
+
+    if selected("check_permission"):
+        permissions = PermissionSystem()
+        user = {"user_id": "bench", "role": "user"}
+        yield "check_permission", bench(
+            lambda: permissions.check_permission(user, tool="calculate", action="execute"), number, repeat)
+
+    if selected("metrics_record"):
+        metrics = MetricsCollector()
+        labels = {"tool": "calculate"}
+        yield "metrics_record", bench(lambda: metrics.record("bench_seconds", 0.01, labels), number, repeat)
+
+    cache = make_cache(backend)
+    key = f"bench:{uuid.uuid4().hex}"
+    await cache.set(key, {"result": 5.5, "values": list(range(10))}, expire=60)
+    if selected("cache_set"):
+        value = {"result": 5.5, "values": list(range(10))}
+        yield "cache_set", await abench(lambda: cache.set(key, value, expire=60), number, repeat)
+    if selected("cache_get_l1"):
+        yield "cache_get_l1", await abench(lambda: cache.get(key), number, repeat)
+
+    async def get_from_backend():
+        cache.l1.clear()
+        return await cache.get(key)
+    if selected("cache_get_l2"):
+        yield "cache_get_l2", await abench(get_from_backend, number, repeat)
+
+    if selected("engine_execute_cached"):
+        engine = SparkEngine(tools={"calculate": spec}, cache=cache)
+        try:
+            yield "engine_execute_cached", await abench(
+                lambda: engine.execute_tool("calculate", PARAMS, {}), number, repeat)
+        finally:
+            engine.shutdown()
+    await cache.client.delete(key)
+
+
+def make_app(backend):
+    mcp = LightningMCP(cache=make_cache(backend))
+    mcp.tool()(calculate)
+    return mcp
+
+
+async def load_benchmarks(backend, total, concurrency, selected):
+    """Yield (name, result) for each selected load scenario against /execute_toolchain."""
+    mcp = make_app(backend)
+    run = uuid.uuid4().int % 10 ** 6  # Fresh values each run, so "uncached" misses a shared backend
+    async with mcp.app.router.lifespan_context(mcp.app):
+        transport = httpx.ASGITransport(app=mcp.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def post(body):
+                response = await client.post("/execute_toolchain", json={"request_data": body})
+                response.raise_for_status()
+
+            async def cached(i):
+                await post({"tool_name": "calculate", "parameters": PARAMS})
+
+            async def uncached(i):
+                await post({"tool_name": "calculate", "parameters": {"a": run, "operation": "+", "b": i}})
+
+            async def plan(i):
+                await post({"steps": [
+                    {"id": "x", "tool_name": "calculate", "parameters": {"a": run, "operation": "+", "b": i}},
+                    {"id": "y", "tool_name": "calculate", "parameters": {"a": i, "operation": "*", "b": 2}},
+                    {"id": "sum", "tool_name": "calculate",
+                     "parameters": {"a": {"$ref": "x"}, "operation": "+", "b": {"$ref": "y"}}},
+                ]})
+
+            for name, scenario in (("http_cached", cached), ("http_uncached", uncached), ("http_plan", plan)):
+                if selected(name):
+                    yield name, await load(scenario, total, concurrency)
+
+
+async def run_suite(backend: str = "memory", quick: bool = False, only: str = None,
+                    concurrency: int = 16) -> dict:
+    """
+    Run the benchmarks.
+
+    Args:
+        backend: "memory" or a Redis URL
+        quick: Fewer iterations (a smoke run; numbers are noisy)
+        only: Optional substring selecting benchmarks by name
+        concurrency: Concurrent clients in the load scenarios
+
+    Returns:
+        {"meta": {...}, "benchmarks": {name: result}}
+    """
+    number, repeat, total = (200, 2, 100) if quick else (5000, 5, 2000)
+    client = make_backend(backend)
+
+    def selected(name):
+        return only is None or only in name
+
+    results = {}
+    try:
+        for suite in (micro_benchmarks(client, number, repeat, selected),
+                      load_benchmarks(client, total, concurrency, selected)):
+            async for name, result in suite:
+                results[name] = result
+    finally:
+        await client.aclose()
+    meta = {"python": platform.python_version(), "platform": platform.platform(),
+            "backend": "memory" if backend == "memory" else "redis", "quick": quick,
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")}
+    return {"meta": meta, "benchmarks": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the LightningMCP benchmark suite")
+    parser.add_argument("--backend", default="memory", help='"memory" (default) or a Redis URL')
+    parser.add_argument("--quick", action="store_true", help="few iterations, for smoke runs")
+    parser.add_argument("--only", help="run benchmarks whose name contains this")
+    parser.add_argument("--concurrency", type=int, default=16, help="clients in the load scenarios")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slowdown allowed before flagging (default 0.25)")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run_suite(args.backend, args.quick, args.only, args.concurrency))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("quick") != args.quick:
+            print("warning: comparing a --quick run with a full one", file=sys.stderr)
+        results["regressions"] = compare(results, baseline, args.tolerance)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
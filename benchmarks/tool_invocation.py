@@ -0,0 +1,37 @@
+"""
+Micro-benchmark: per-call overhead of the compiled ToolSpec path compared
+with calling the raw tool function.
+
+Run from the repository root:
+
+    python -m benchmarks.tool_invocation
+"""
+import timeit
+
+from core.tools import ToolSpec
+
+
+def calculate(a: float, operation: str, b: float) -> float:
+    """Perform basic math operations"""
+    if operation == "+":
+        return a + b
+    return a * b
+
+
+def main(number: int = 200_000, repeat: int = 5):
+    spec = ToolSpec(calculate)
+    params = {"a": 2.0, "operation": "+", "b": 3.5}
+
+    def per_call(stmt):
+        return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number * 1e9
+
+    raw = per_call(lambda: calculate(**params))
+    validate = per_call(lambda: spec.validate(params))
+    invoke = per_call(lambda: spec.invoke(params))
+    print(f"{'raw function(**params)':<26}{raw:>8.0f} ns/call")
+    print(f"{'spec.validate(params)':<26}{validate:>8.0f} ns/call")
+    print(f"{'spec.invoke(params)':<26}{invoke:>8.0f} ns/call  (+{invoke - raw:.0f} ns over raw)")
+
+
+if __name__ == "__main__":
+    main()
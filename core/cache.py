@@ -1,12 +1,394 @@
-import redis.asyncio as redis
+import asyncio
+import logging
+import sys
+import time
+import uuid
+from collections import OrderedDict
+
+from .resilience import INFRASTRUCTURE_ERRORS
+from .serialization import ResultCodec, SerializationError
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def _backend_errors():
+    # redis-py's errors aren't OSErrors; they can only come from a client
+    # once redis is imported, so it isn't imported here
+    redis = sys.modules.get("redis.exceptions")
+    return INFRASTRUCTURE_ERRORS + ((redis.RedisError,) if redis is not None else ())
+
+
+def _sizeof(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    In-process cache bounded by entry count and total bytes, with LRU
+    eviction and a per-entry TTL.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 60):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of entries kept
+            max_bytes: Maximum estimated size of all values
+            ttl: Default time to live in seconds (None for no expiry)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        value, _, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.delete(key)
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float = None, size: int = None):
+        if size is None:
+            size = _sizeof(value)
+        self.delete(key)
+        if size > self.max_bytes:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl or ttl)
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._entries[key] = (value, size, expires_at)
+        self.nbytes += size
+        while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.nbytes -= evicted_size
+
+    def delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self.nbytes -= entry[1]
+        return True
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+
+class RedisInvalidationBus:
+    """Broadcasts cache invalidations to every worker over Redis pub/sub."""
+
+    def __init__(self, client, channel: str = "lightningmcp:cache:invalidate", reconnect_delay: float = 1.0):
+        self.client = client
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._task = None
+
+    async def publish(self, message: str):
+        await self.client.publish(self.channel, message)
+
+    def subscribe(self, callback, on_reconnect=None):
+        """
+        Start delivering messages to callback in a background task.
+
+        on_reconnect is called whenever the subscription is (re)established,
+        since messages published while disconnected are lost.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen(callback, on_reconnect))
+
+    async def _listen(self, callback, on_reconnect):
+        while True:
+            try:
+                async with self.client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    if on_reconnect is not None:
+                        on_reconnect()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            data = message["data"]
+                            callback(data.decode() if isinstance(data, bytes) else data)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class InMemoryInvalidationBus:
+    """In-process stand-in for RedisInvalidationBus, shared between caches in tests."""
+
+    def __init__(self):
+        self._subscribers = []
+
+    async def publish(self, message: str):
+        for callback in list(self._subscribers):
+            callback(message)
+
+    def subscribe(self, callback, on_reconnect=None):
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    async def close(self):
+        self._subscribers.clear()
 
 
 class VectorCache:
-    def __init__(self, url="redis://localhost"):
-        self.client = redis.from_url(url)
+    """
+    Two-tier cache: a bounded in-process LRU (L1) in front of Redis (L2).
+
+    Values are encoded with a ResultCodec before they reach Redis; L1 holds
+    the decoded objects, so callers must treat cached results as read-only.
+    Stored values are decoded back from their encoding, so both tiers (and
+    the caller that computed a value) see the same shapes, e.g. lists where
+    a tool returned tuples.
+    Concurrent misses for the same key are coalesced so the value is only
+    computed once, and invalidations are broadcast so every worker's L1
+    stays coherent.
+    """
+
+    def __init__(self, url="redis://localhost", client=None, l1=None, bus=None, codec=None):
+        """
+        Initialize the cache.
+
+        Args:
+            url: Redis URL used when no client is given
+            client: Optional Redis-compatible async client
+            l1: Optional LRUCache used as the in-process tier
+            bus: Optional invalidation bus (defaults to Redis pub/sub)
+            codec: Optional ResultCodec for L2 values (defaults to JSON)
+        """
+        if client is None:
+            import redis.asyncio as redis  # Only loaded when the cache makes its own client
+            client = redis.from_url(url)
+        self.client = client
+        self.l1 = l1 if l1 is not None else LRUCache()
+        self.bus = bus if bus is not None else RedisInvalidationBus(self.client)
+        self.codec = codec if codec is not None else ResultCodec()
+        self.stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "coalesced": 0}
+        self._origin = uuid.uuid4().hex
+        self._inflight = {}  # key -> asyncio.Future shared by coalesced callers
+        self._subscribed = False
+
+    def _ensure_subscribed(self):
+        if not self._subscribed:
+            self._subscribed = True
+            self.bus.subscribe(self._on_invalidate, on_reconnect=self.l1.clear)
+
+    def _on_invalidate(self, message):
+        origin, _, key = message.partition(":")
+        if origin != self._origin:
+            self.l1.delete(key)
+
+    async def _lookup(self, key):
+        self._ensure_subscribed()
+        value = self.l1.get(key, _MISSING)
+        if value is not _MISSING:
+            self.stats["l1_hits"] += 1
+            return value
+
+        raw = await self.client.get(key)
+        if raw is None:
+            self.stats["misses"] += 1
+            return _MISSING
+        self.stats["l2_hits"] += 1
+        value = self.codec.decode(raw)
+        self.l1.set(key, value, size=len(raw))
+        return value
 
     async def get(self, key):
-        return await self.client.get(key)
+        value = await self._lookup(key)
+        return None if value is _MISSING else value
 
     async def set(self, key, value, expire=None):
-        await self.client.set(key, value, ex=expire)
+        """Store value in both tiers; returns it as later lookups will."""
+        raw = self.codec.encode(value)
+        await self.client.set(key, raw, ex=expire)
+        value = self.codec.decode(raw)
+        self.l1.set(key, value, ttl=expire, size=len(raw))
+        return value
+
+    async def get_many(self, keys):
+        """
+        Look up several keys: L1 first, then one MGET for the rest.
+
+        Returns:
+            Dict of the keys that were found and their values
+        """
+        self._ensure_subscribed()
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.l1.get(key, _MISSING)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                self.stats["l1_hits"] += 1
+                found[key] = value
+        if missing:
+            for key, raw in zip(missing, await self.client.mget(missing)):
+                if raw is None:
+                    self.stats["misses"] += 1
+                    continue
+                self.stats["l2_hits"] += 1
+                found[key] = value = self.codec.decode(raw)
+                self.l1.set(key, value, size=len(raw))
+        return found
+
+    async def set_many(self, items, expire=None):
+        """
+        Store several values in one pipelined round trip.
+
+        MSET cannot attach TTLs, so this pipelines one SET ... EX per key.
+        Values the codec cannot encode are skipped.
+
+        Returns:
+            Dict of the stored keys and their values as lookups will return them
+        """
+        encoded = {}
+        for key, value in items.items():
+            try:
+                encoded[key] = self.codec.encode(value)
+            except SerializationError:
+                continue
+        if not encoded:
+            return {}
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, raw in encoded.items():
+                pipe.set(key, raw, ex=expire)
+            await pipe.execute()
+        stored = {}
+        for key, raw in encoded.items():
+            stored[key] = value = self.codec.decode(raw)
+            self.l1.set(key, value, ttl=expire, size=len(raw))
+        return stored
+
+    async def invalidate(self, key):
+        """Drop a key from both tiers and from every other worker's L1."""
+        self._ensure_subscribed()
+        self.l1.delete(key)
+        await self.client.delete(key)
+        await self.bus.publish(f"{self._origin}:{key}")
+
+    async def get_or_compute(self, key, compute, expire=None):
+        """
+        Return the cached value for key, or await compute() to produce it.
+
+        Only one compute() runs per key at a time; concurrent callers wait for
+        its result (or exception) instead of running the tool again. A value
+        that can't be written back (Redis down) is still returned, uncached.
+        """
+        value = await self._lookup(key)
+        if value is not _MISSING:
+            return value
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            try:
+                value = await self.set(key, value, expire=expire)
+            except SerializationError:
+                pass  # Uncacheable result: still return it to every waiter
+            except _backend_errors() as exc:
+                logger.warning("Could not cache %s: %r", key, exc)
+        except BaseException as exc:
+            if isinstance(exc, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(exc)
+                future.exception()  # Mark retrieved when nobody is waiting
+            raise
+        finally:
+            del self._inflight[key]
+        future.set_result(value)
+        return value
+
+    async def get_or_compute_many(self, computations, expire=None):
+        """
+        Batched get_or_compute: one MGET for every key, the misses computed
+        concurrently and written back in one pipeline.
+
+        Args:
+            computations: Dict mapping each key to its async compute callable
+            expire: TTL in seconds for newly computed values
+
+        Returns:
+            Dict mapping each key to its value, or to the exception its
+            compute raised
+        """
+        results = await self.get_many(list(computations))
+        loop = asyncio.get_running_loop()
+        owned = {}    # Misses this call computes
+        waiting = {}  # Misses another caller is already computing
+        for key in computations:
+            if key in results:
+                continue
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                waiting[key] = future
+            else:
+                owned[key] = self._inflight[key] = loop.create_future()
+
+        try:
+            outcomes = await asyncio.gather(*(computations[key]() for key in owned), return_exceptions=True)
+            results.update(zip(owned, outcomes))
+            try:
+                results.update(await self.set_many(
+                    {key: value for key, value in zip(owned, outcomes) if not isinstance(value, BaseException)},
+                    expire=expire))
+            except _backend_errors() as exc:
+                logger.warning("Could not cache %d computed values: %r", len(owned), exc)
+        finally:
+            for key, future in owned.items():
+                del self._inflight[key]
+                outcome = results.get(key, _MISSING)
+                if outcome is _MISSING or isinstance(outcome, asyncio.CancelledError):
+                    future.cancel()
+                elif isinstance(outcome, BaseException):
+                    future.set_exception(outcome)
+                    future.exception()  # Mark retrieved when nobody is waiting
+                else:
+                    future.set_result(outcome)
+
+        for key, future in waiting.items():
+            try:
+                results[key] = await asyncio.shield(future)
+            except Exception as exc:
+                results[key] = exc
+        return results
+
+    async def close(self):
+        await self.bus.close()
+        await self.client.aclose()
@@ -1,62 +1,594 @@
-import sys  # Needed for sys.getsizeof in tracing (later)
+import sys  # sys.getsizeof sizes results for the tool statistics
 from .cache import VectorCache  # Import the cache
+from .keys import derive_cache_key
+from .resilience import AdaptiveLimiter, CircuitBreaker, CircuitOpenError
+from .serialization import SerializationError
+from .toolstats import ToolStatistics
 import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-# Placeholder for parallel executor (will be implemented in Rust/FFI later)
+from monitoring.metrics import MetricsCollector
+from monitoring.tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+
+def _call_timed(func, params):
+    # Runs in the worker; reports when the call actually started so the
+    # caller can tell queue wait from execution time. Module-level so it can
+    # be pickled into the process pool.
+    return time.monotonic_ns(), func(**params)
+
+
+def _call_with_blobs(func, params, directory, threshold):
+    # Runs in a pool process: blob references are mapped from the shared blob
+    # directory rather than pickled across, and a large result goes back the
+    # same way
+    from data.blobs import BlobStore
+    blobs = BlobStore.attach(directory, threshold)
+    started, result = _call_timed(func, blobs.resolve(params))
+    return started, blobs.externalize(result)
 
 
 class ParallelExecutor:
-    async def submit(self, tool_name, params, context):
-        print(f"Executing tool {tool_name} in parallel...")
-        # Simulate execution
-        await asyncio.sleep(0.1)
-        return {"result": "parallel_executed"}
+    """
+    Dispatches tool calls by kind: coroutine tools run inline on the event
+    loop, sync tools run in a bounded thread pool and CPU-bound tools run in
+    a process pool. Pools are created lazily on first use.
+
+    Before a call runs it passes the tool's circuit breaker, takes the locks
+    of its conflict groups and waits for a slot under its concurrency limit
+    (fixed or adaptive).
+    """
+
+    def __init__(self, max_workers: int = None, max_processes: int = None, metrics=None,
+                 stream_buffer: int = 16, tracer=None, blobs=None):
+        """
+        Initialize the executor.
+
+        Args:
+            max_workers: Size of the thread pool for sync tools
+            max_processes: Size of the process pool for CPU-bound tools
+            metrics: MetricsCollector for queue depth and queue wait
+            tracer: Tracer receiving queue-wait spans
+            stream_buffer: Chunks a sync generator may run ahead of its consumer
+            blobs: Optional data.blobs.BlobStore; blob references in a call's
+                parameters are resolved (to memoryviews or str) before the tool runs
+        """
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.max_processes = max_processes or os.cpu_count() or 1
+        self.metrics = metrics if metrics is not None else MetricsCollector()
+        self.tracer = tracer if tracer is not None else Tracer(enabled=False)
+        self.stream_buffer = stream_buffer
+        self.blobs = blobs
+        self._thread_pool = None
+        self._process_pool = None
+        self._limits = {}  # tool name -> asyncio.Semaphore or AdaptiveLimiter
+        self._breakers = {}  # tool name -> CircuitBreaker
+        self._groups = {}  # conflict group -> asyncio.Lock
+        self._waiting = {}  # tool name -> calls waiting for a concurrency slot
+        self._running = {}  # tool name -> calls currently executing
+        self._in_flight = {"thread": 0, "process": 0}
+
+    def _get_pool(self, kind):
+        if kind == "process":
+            if self._process_pool is None:
+                from concurrent.futures import ProcessPoolExecutor  # Pulls in multiprocessing
+                self._process_pool = ProcessPoolExecutor(max_workers=self.max_processes)
+            return self._process_pool
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="lightningmcp-tool")
+        return self._thread_pool
+
+    def _get_limit(self, tool):
+        limit = tool.max_concurrency
+        if not limit:
+            return None
+        limiter = self._limits.get(tool.name)
+        if limiter is None:
+            limiter = AdaptiveLimiter() if limit == "adaptive" else asyncio.Semaphore(limit)
+            self._limits[tool.name] = limiter
+        return limiter
+
+    def _get_breaker(self, tool):
+        if not tool.circuit_breaker:
+            return None
+        breaker = self._breakers.get(tool.name)
+        if breaker is None:
+            breaker = self._breakers[tool.name] = CircuitBreaker(failure_on=tool.failure_on)
+        return breaker
+
+    def _check_breaker(self, tool, breaker):
+        try:
+            return breaker.before_call(tool.name)
+        except CircuitOpenError:
+            self.metrics.increment_counter("circuit_breaker_rejections_total", labels={"tool": tool.name})
+            raise
+
+    def _pool_capacity(self, kind):
+        return self.max_processes if kind == "process" else self.max_workers
+
+    def queue_depth(self, kind="thread"):
+        """Number of calls submitted to a pool but still waiting for a worker."""
+        return max(0, self._in_flight[kind] - self._pool_capacity(kind))
 
-# Placeholder for sequential executor
+    def stats(self):
+        """Snapshot of per-tool and per-pool queue depths."""
+        return {
+            "tools": {
+                name: {"waiting": self._waiting.get(name, 0), "running": self._running.get(name, 0)}
+                for name in set(self._waiting) | set(self._running)
+            },
+            "pools": {
+                kind: {
+                    "in_flight": self._in_flight[kind],
+                    "workers": self._pool_capacity(kind),
+                    "queue_depth": self.queue_depth(kind),
+                }
+                for kind in self._in_flight
+            },
+        }
 
+    @contextlib.asynccontextmanager
+    async def _slot(self, tool):
+        # Pass the breaker, then wait for the conflict groups and a
+        # concurrency slot, and count the call as running
+        name = tool.name
+        breaker = self._get_breaker(tool)
+        probe = self._check_breaker(tool, breaker) if breaker is not None else False
+        limiter = self._get_limit(tool)
+        failed = None  # Cancelled calls say nothing about the tool's health
+        error = None
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                self._waiting[name] = self._waiting.get(name, 0) + 1
+                try:
+                    for group in tool.conflicts:
+                        await stack.enter_async_context(self._groups.setdefault(group, asyncio.Lock()))
+                    if limiter is not None:
+                        await limiter.acquire()
+                finally:
+                    self._waiting[name] -= 1
 
-class SequentialExecutor:
-    async def execute(self, tool_name, params, context):
-        print(f"Executing tool {tool_name} sequentially...")
-        # Simulate execution
-        await asyncio.sleep(0.1)
-        return {"result": "sequential_executed"}
+                self._running[name] = self._running.get(name, 0) + 1
+                started = time.monotonic()
+                try:
+                    yield
+                    failed = False
+                except Exception as exc:
+                    failed = True
+                    error = exc
+                    raise
+                finally:
+                    self._running[name] -= 1
+                    if isinstance(limiter, AdaptiveLimiter):
+                        limiter.release(started, failed)
+                        self.metrics.set_gauge("tool_concurrency_limit", limiter.limit, {"tool": name})
+                    elif limiter is not None:
+                        limiter.release()
+        finally:
+            if breaker is not None:
+                state = breaker.state
+                breaker.record(failed and breaker.counts(error), probe)
+                if breaker.state != state:
+                    self.metrics.set_gauge("circuit_breaker_open", int(breaker.state == breaker.OPEN), {"tool": name})
 
-# Placeholder function to determine if a tool can be executed in parallel
+    async def submit(self, tool, params, context):
+        submitted = time.monotonic_ns()
+        async with self._slot(tool):
+            return await self._dispatch(tool, params, submitted)
 
+    async def stream(self, tool, params, context):
+        """
+        Yield the chunks of a streaming tool as they are produced.
 
-def can_execute_parallel(tool_name, active_tools):
-    # Simple example: don't run 'sensitive_tool' in parallel
-    if tool_name == "sensitive_tool":
-        return False
-    # More complex logic based on dependencies and active tools would go here
-    return True
+        Async generators are iterated on the event loop. Sync generators run
+        in the thread pool and hand chunks over through a bounded queue, so a
+        slow consumer pauses the generator instead of buffering its output.
+        """
+        if self.blobs is not None:
+            params = self.blobs.resolve(params)
+        async with self._slot(tool):
+            if tool.is_async:
+                chunks = tool.function(**params)
+                try:
+                    async for chunk in chunks:
+                        yield chunk
+                finally:
+                    await chunks.aclose()
+            else:
+                async for chunk in self._iterate_in_thread(tool.function, params):
+                    yield chunk
+
+    async def _iterate_in_thread(self, func, params):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(self.stream_buffer)
+        stop = threading.Event()
+
+        def produce():
+            chunks = func(**params)
+            outcome = None
+            try:
+                for chunk in chunks:
+                    # Blocks this worker thread while the queue is full
+                    asyncio.run_coroutine_threadsafe(queue.put((False, chunk)), loop).result()
+                    if stop.is_set():
+                        return
+            except BaseException as exc:
+                outcome = exc
+            finally:
+                chunks.close()
+            if not stop.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put((True, outcome)), loop).result()
+
+        self._in_flight["thread"] += 1
+        producer = loop.run_in_executor(self._get_pool("thread"), produce)
+        try:
+            while True:
+                finished, value = await queue.get()
+                if finished:
+                    if value is not None:
+                        raise value
+                    return
+                yield value
+        finally:
+            # Stop the generator and free a producer blocked on a full queue
+            stop.set()
+            while not queue.empty():
+                queue.get_nowait()
+            await producer
+            self._in_flight["thread"] -= 1
+
+    async def _dispatch(self, tool, params, submitted):
+        func = tool.function
+        labels = {"tool": tool.name}
+        blobs = self.blobs
+        if tool.is_async:
+            self._record_wait(labels, submitted, time.monotonic_ns(), "loop")
+            return await func(**(params if blobs is None else blobs.resolve(params)))
+
+        kind = "process" if tool.cpu_bound else "thread"
+        pool = self._get_pool(kind)
+        depth = self.metrics.gauge("executor_queue_depth", {"pool": kind})
+        self._in_flight[kind] += 1
+        depth.set(self.queue_depth(kind))
+        try:
+            loop = asyncio.get_running_loop()
+            if blobs is None:
+                started, result = await loop.run_in_executor(pool, _call_timed, func, params)
+            elif kind == "process":
+                # Only the references cross the process boundary
+                started, result = await loop.run_in_executor(
+                    pool, _call_with_blobs, func, params, blobs.directory, blobs.threshold)
+            else:
+                started, result = await loop.run_in_executor(pool, _call_timed, func, blobs.resolve(params))
+            self._record_wait(labels, submitted, max(started, submitted), kind)
+            return result
+        finally:
+            self._in_flight[kind] -= 1
+            depth.set(self.queue_depth(kind))
+
+    def _record_wait(self, labels, submitted, started, pool):
+        self.metrics.record("executor_queue_wait_seconds", (started - submitted) / 1e9, labels)
+        self.tracer.add_span("executor.queue_wait", submitted, started, pool=pool)
+
+    def shutdown(self, wait: bool = True):
+        """Shut down the worker pools."""
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=wait, cancel_futures=not wait)
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=wait, cancel_futures=not wait)
+            self._process_pool = None
+
+
+def assemble_chunks(chunks):
+    """Combine streamed chunks into one result: joined text, or the chunk list."""
+    if chunks and all(isinstance(chunk, str) for chunk in chunks):
+        return "".join(chunks)
+    return chunks
+
+
+def _default_registry():
+    # Imported lazily: lightningmcp pulls in the API layer, which imports us
+    from lightningmcp import app
+    return app.tools
 
 
 class SparkEngine:
-    def __init__(self):
+    RESULT_TTL = 3600  # Seconds a tool result stays cached
+    HEDGE_QUANTILE = 0.95  # Hedged tools start a second attempt past this latency
+    HEDGE_MIN_SAMPLES = 20  # ... once this many calls have been timed
+
+    def __init__(self, tools=None, cache=None, max_workers=None, max_processes=None, metrics=None,
+                 tracer=None, semantic=None, stats=None, resource_cache=None, blobs=None):
         # Initialize executors, cache, etc.
-        self.cache = VectorCache()  # Initialize the cache
-        self.parallel_executor = ParallelExecutor()
-        self.sequential_executor = SequentialExecutor()
+        self.tools = tools if tools is not None else _default_registry()
+        self.cache = cache if cache is not None else VectorCache()  # Initialize the cache
+        self._semantic = semantic  # Built on first use by a tool with semantic_threshold
+        self.metrics = metrics if metrics is not None else MetricsCollector()
+        self.tracer = tracer if tracer is not None else Tracer(enabled=False)
+        # Latency, hit rate and failure rate per tool, for the plan optimizer
+        self.stats = stats if stats is not None else ToolStatistics()
+        self.resource_cache = resource_cache  # Told when a tool changes resources (ToolSpec.invalidates)
+        # Large payloads in parameters and results become blob references (data.blobs)
+        self.blobs = blobs
+        self.parallel_executor = ParallelExecutor(max_workers, max_processes, metrics=self.metrics,
+                                                  tracer=self.tracer, blobs=blobs)
+
+    def resolve_tool(self, tool_name):
+        tool = self.tools.get(tool_name)
+        if tool is None:
+            raise ValueError(f"Unknown tool: {tool_name}")
+        return tool
+
+    def _validate(self, tool, params):
+        if self.blobs is not None:
+            # Before keying, so a large payload is hashed into its reference once
+            params = self.blobs.externalize(params)
+        return tool.validate(params)
+
+    def cache_key(self, tool, params):
+        # Stable across processes, so every worker shares the Redis entries
+        return derive_cache_key(tool.name, params, tool.cache_version)
+
+    async def _run(self, tool, params, context):
+        if tool.cache:
+            logger.debug("Cache miss for %s. Executing...", tool.name)
+            self.metrics.increment_counter("cache_misses_total", labels={"tool": tool.name})
+        # context["deadline"] (event loop time) bounds every attempt and backoff
+        deadline = context.get("deadline")
+        start = time.perf_counter()
+        try:
+            with self.tracer.span("tool.call", tool=tool.name):
+                if deadline is None:
+                    result = await self._run_attempts(tool, params, context, None)
+                else:
+                    async with asyncio.timeout_at(deadline):
+                        result = await self._run_attempts(tool, params, context, deadline)
+        except Exception:
+            self.stats.observe_call(tool.name, time.perf_counter() - start, failed=True)
+            raise
+        if self.blobs is not None:
+            # Cache entries and responses carry the reference, not the payload
+            result = self.blobs.externalize(result)
+        self.stats.observe_call(tool.name, time.perf_counter() - start, result_size=sys.getsizeof(result))
+        self._invalidate_resources(tool)
+        return result
+
+    def _invalidate_resources(self, tool):
+        if tool.invalidates and self.resource_cache is not None:
+            for resource_id in tool.invalidates:
+                self.resource_cache.invalidate(resource_id)
+
+    async def _run_attempts(self, tool, params, context, deadline):
+        policy = tool.retry
+        attempt = 1
+        while True:
+            try:
+                if tool.hedge:
+                    return await self._run_hedged(tool, params, context)
+                return await self._run_once(tool, params, context)
+            except Exception as exc:
+                if policy is None or attempt >= policy.attempts or not policy.retryable(exc):
+                    raise
+                delay = policy.backoff(attempt)
+                if deadline is not None and asyncio.get_running_loop().time() + delay >= deadline:
+                    raise
+                logger.debug("Retrying %s in %.3fs after %r", tool.name, delay, exc)
+                self.metrics.increment_counter("tool_retries_total", labels={"tool": tool.name})
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _run_once(self, tool, params, context):
+        histogram = self.metrics.histogram("tool_latency_seconds", {"tool": tool.name})
+        start = time.perf_counter()
+        cancelled = False
+        try:
+            return await self.parallel_executor.submit(tool, params, context)
+        except asyncio.CancelledError:
+            cancelled = True  # A cut-short attempt (e.g. a hedging loser) says nothing about latency
+            raise
+        finally:
+            if not cancelled:
+                histogram.observe(time.perf_counter() - start)
+
+    async def _run_hedged(self, tool, params, context):
+        # Give the first attempt until the tool's p95, then race a second one
+        # against it. The loser is cancelled (a thread-pool call still runs to
+        # completion in its worker, but its result is dropped).
+        histogram = self.metrics.histogram("tool_latency_seconds", {"tool": tool.name})
+        if histogram.snapshot()[0] < self.HEDGE_MIN_SAMPLES:
+            return await self._run_once(tool, params, context)
+        attempts = [asyncio.ensure_future(self._run_once(tool, params, context))]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=histogram.quantile(self.HEDGE_QUANTILE))
+            if done:
+                return attempts[0].result()
+            self.metrics.increment_counter("tool_hedges_total", labels={"tool": tool.name})
+            attempts.append(asyncio.ensure_future(self._run_once(tool, params, context)))
+            pending = set(attempts)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in attempts:
+                if task.done():
+                    if not task.cancelled():
+                        task.exception()  # Retrieved, so a failed loser isn't logged
+                else:
+                    task.cancel()
+
+    @property
+    def semantic(self):
+        if self._semantic is None:
+            from .semantic import SemanticCache  # NumPy is only needed once a tool opts in
+            self._semantic = SemanticCache()
+        return self._semantic
+
+    async def _execute_semantic(self, tool, params, cache_key, context):
+        # Exact hit, else the result of a similar enough earlier call, else run.
+        # Near hits are also stored under this call's key, so repeats are exact.
+        outcome = "exact"
+        start = time.perf_counter()
+
+        async def compute():
+            nonlocal outcome
+            match = self.semantic.search(tool, params, tool.semantic_threshold)
+            if match is not None:
+                result = await self.cache.get(match)
+                if result is not None:
+                    outcome = "near"
+                    return result
+                self.semantic.discard(match)  # Expired or invalidated
+            outcome = "miss"
+            return await self._run(tool, params, context)
+
+        with self.tracer.span("cache.lookup", tool=tool.name, semantic=True):
+            result = await self.cache.get_or_compute(cache_key, compute, expire=self.RESULT_TTL)
+        self.semantic.add(tool, params, cache_key)
+        self.stats.observe_lookup(tool.name, outcome != "miss", time.perf_counter() - start)
+        self.metrics.increment_counter("semantic_cache_total", labels={"tool": tool.name, "result": outcome})
+        return result
+
+    def is_streaming(self, tool_name):
+        return self.resolve_tool(tool_name).streaming
+
+    async def stream_tool(self, tool_name, params, context):
+        """
+        Yield a tool's output as it is produced.
+
+        Non-streaming tools yield their single result. Streaming tools
+        registered with ``cache_stream`` replay cached chunks on a hit and
+        cache the full chunk list once the stream completes.
+        """
+        tool = self.resolve_tool(tool_name)
+        if not tool.streaming:
+            yield await self.execute_tool(tool_name, params, context)
+            return
+
+        params = self._validate(tool, params)
+        cache_key = self.cache_key(tool, params) if tool.cache_stream else None
+        if cache_key is not None:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                for chunk in cached:
+                    yield chunk
+                return
+
+        chunks = []
+        async for chunk in self.parallel_executor.stream(tool, params, context):
+            if cache_key is not None:
+                chunks.append(chunk)
+            yield chunk
+        self._invalidate_resources(tool)
+
+        if cache_key is not None:
+            try:
+                await self.cache.set(cache_key, chunks, expire=self.RESULT_TTL)
+            except SerializationError:
+                pass
 
     async def execute_tool(self, tool_name, params, context):
-        # Check cache first
-        cache_key = f"{tool_name}:{hash(frozenset(params.items()))}"
-        cached_result = await self.cache.get(cache_key)
-        if cached_result:
-            print(f"Cache hit for {tool_name}")
-            return cached_result
-
-        print(f"Cache miss for {tool_name}. Executing...")
-        # Parallel execution logic
-        if can_execute_parallel(tool_name, context.get("active_tools", [])):
-            result = await self.parallel_executor.submit(tool_name, params, context)
-        else:
-            result = await self.sequential_executor.execute(tool_name, params, context)
-
-        # Cache the result (simple example)
-        # Cache for 1 hour
-        await self.cache.set(cache_key, result, expire=3600)
+        tool = self.resolve_tool(tool_name)
+        if tool.streaming:
+            # Callers that need a single value get the assembled stream
+            return assemble_chunks([chunk async for chunk in self.stream_tool(tool_name, params, context)])
+        # Coerce before keying so equivalent calls (1 vs 1.0 for a float) share an entry
+        params = self._validate(tool, params)
+        if not tool.cache:
+            return await self._run(tool, params, context)
+        cache_key = self.cache_key(tool, params)
+        # Hit ratio = 1 - cache_misses_total / cache_lookups_total
+        self.metrics.increment_counter("cache_lookups_total", labels={"tool": tool_name})
+        if tool.semantic_threshold is not None:
+            return await self._execute_semantic(tool, params, cache_key, context)
 
+        start = time.perf_counter()
+        ran = False
+
+        async def compute():
+            nonlocal ran
+            ran = True
+            return await self._run(tool, params, context)
+
+        # Check the cache first; concurrent misses for the same key share one
+        # execution.
+        with self.tracer.span("cache.lookup", tool=tool_name):
+            result = await self.cache.get_or_compute(cache_key, compute, expire=self.RESULT_TTL)
+        self.stats.observe_lookup(tool_name, not ran, time.perf_counter() - start)
         return result
+
+    async def execute_batch(self, calls, context):
+        """
+        Execute many independent tool calls with batched cache round trips.
+
+        All cache keys are looked up with one MGET, only the misses run
+        (concurrently, identical calls once) and their results are written
+        back in one pipeline. Streaming, uncached and semantically cached
+        tools run through execute_tool alongside the batch.
+
+        Args:
+            calls: List of {"tool_name": ..., "parameters": {...}} dicts
+            context: Shared execution context
+
+        Returns:
+            List with each call's result, or the exception it raised, in order
+        """
+        outcomes = [None] * len(calls)
+        keys = [None] * len(calls)
+        computations = {}
+        ran = set()
+        direct = {}  # Calls the batch lookup can't serve, run through execute_tool
+        for i, call in enumerate(calls):
+            params = call.get("parameters", {})
+            try:
+                tool = self.resolve_tool(call["tool_name"])
+                if tool.streaming or not tool.cache or tool.semantic_threshold is not None:
+                    direct[i] = (tool.name, params)
+                    continue
+                params = self._validate(tool, params)
+                keys[i] = key = self.cache_key(tool, params)
+                self.metrics.increment_counter("cache_lookups_total", labels={"tool": tool.name})
+            except (ValueError, TypeError) as exc:
+                outcomes[i] = exc
+                continue
+            if key not in computations:
+                computations[key] = partial(self._run_batched, ran, key, tool, params, context)
+
+        # Coroutines are only created once the whole batch is keyed, so an
+        # error above can't leave any of them un-awaited
+        with self.tracer.span("cache.lookup_many", calls=len(calls)):
+            results, *ran_directly = await asyncio.gather(
+                self.cache.get_or_compute_many(computations, expire=self.RESULT_TTL),
+                *(self.execute_tool(name, params, context) for name, params in direct.values()),
+                return_exceptions=True)
+        if isinstance(results, BaseException):
+            raise results
+        for i, outcome in zip(direct, ran_directly):
+            outcomes[i] = outcome
+        for i, key in enumerate(keys):
+            if key is not None:
+                outcomes[i] = results[key]
+                self.stats.observe_lookup(calls[i]["tool_name"], key not in ran)
+        return outcomes
+
+    async def _run_batched(self, ran, key, tool, params, context):
+        ran.add(key)  # Lets execute_batch tell hits from misses
+        return await self._run(tool, params, context)
+
+    def shutdown(self, wait: bool = True):
+        """Release executor pools."""
+        self.parallel_executor.shutdown(wait=wait)
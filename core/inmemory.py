@@ -0,0 +1,120 @@
+import time
+
+
+def _encode(value):
+    # Mirror redis-py: only bytes, str and numbers can be stored
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value).encode()
+    from redis.exceptions import DataError  # Error path only: redis is slow to import
+    raise DataError(f"Invalid input of type: '{type(value).__name__}'. "
+                    "Convert to a bytes, string, int or float first.")
+
+
+class InMemoryRedis:
+    """
+    Minimal in-process stand-in for the redis.asyncio client.
+
+    Implements the subset of commands LightningMCP uses so the cache can run
+    in tests and single-process setups without a Redis server. Values are
+    stored and returned as bytes, like a real server.
+    """
+
+    _scripts = {}  # Lua source -> Python twin (see emulates)
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at)
+
+    @classmethod
+    def emulates(cls, script):
+        """
+        Decorator registering a Python twin of a Lua script.
+
+        The twin is called as ``func(client, keys, args)`` and must return
+        what the script would, so register_script works here as on a server.
+        """
+        def decorator(func):
+            cls._scripts[script] = func
+            return func
+        return decorator
+
+    def register_script(self, script):
+        func = self._scripts.get(script)
+        if func is None:
+            raise NotImplementedError("No in-memory twin registered for this script")
+
+        async def run(keys=None, args=None, client=None):
+            return func(self, list(keys or ()), list(args or ()))
+        return run
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    async def get(self, key):
+        entry = self._live(key)
+        return None if entry is None else entry[0]
+
+    async def set(self, key, value, ex=None):
+        expires_at = time.monotonic() + ex if ex else None
+        self._data[key] = (_encode(value), expires_at)
+        return True
+
+    async def mget(self, keys, *args):
+        keys = list(keys) + list(args) if isinstance(keys, (list, tuple)) else [keys, *args]
+        return [None if entry is None else entry[0] for entry in map(self._live, keys)]
+
+    def pipeline(self, transaction=True):
+        return InMemoryPipeline(self)
+
+    async def delete(self, *keys):
+        return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    async def exists(self, *keys):
+        return sum(1 for key in keys if self._live(key) is not None)
+
+    async def publish(self, channel, message):
+        return 0
+
+    async def flushall(self):
+        self._data.clear()
+
+    async def aclose(self):
+        pass
+
+
+class InMemoryPipeline:
+    """Buffers commands and runs them on execute(), like a redis-py pipeline."""
+
+    def __init__(self, client):
+        self.client = client
+        self._commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._commands.clear()
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        commands, self._commands = self._commands, []
+        return [await command(*args, **kwargs) for command, args, kwargs in commands]
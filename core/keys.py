@@ -0,0 +1,95 @@
+import hashlib
+import inspect
+import struct
+
+KEY_PREFIX = "lmcp"
+
+
+def _encode(value, out: bytearray):
+    # Every value is written as a type tag followed by a length-prefixed or
+    # fixed-size payload, so distinct inputs can never share an encoding
+    # (1, 1.0, True and "1" all differ) and nested containers are unambiguous.
+    if value is None:
+        out += b"N"
+    elif value is True:
+        out += b"T"
+    elif value is False:
+        out += b"F"
+    elif isinstance(value, int):
+        data = str(value).encode()
+        out += b"i" + struct.pack(">I", len(data)) + data
+    elif isinstance(value, float):
+        out += b"f" + struct.pack(">d", value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out += b"s" + struct.pack(">I", len(data)) + data
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        data = bytes(value)
+        out += b"b" + struct.pack(">I", len(data)) + data
+    elif isinstance(value, (list, tuple)):
+        out += b"l" + struct.pack(">I", len(value))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, dict):
+        # Order-independent: items are sorted by the encoding of their keys
+        items = sorted((canonical_encode(k), v) for k, v in value.items())
+        out += b"d" + struct.pack(">I", len(items))
+        for encoded_key, item in items:
+            out += encoded_key
+            _encode(item, out)
+    elif isinstance(value, (set, frozenset)):
+        members = sorted(canonical_encode(item) for item in value)
+        out += b"S" + struct.pack(">I", len(members))
+        for member in members:
+            out += member
+    else:
+        raise TypeError(f"Cannot derive a cache key from {type(value).__name__} values")
+
+
+def canonical_encode(value) -> bytes:
+    """
+    Encode a parameter structure into canonical, type-tagged bytes.
+
+    Args:
+        value: JSON-like value (dicts, lists, tuples, sets, scalars, bytes)
+
+    Returns:
+        Bytes that are identical for equal inputs in every process
+    """
+    out = bytearray()
+    _encode(value, out)
+    return bytes(out)
+
+
+def digest(data: bytes) -> str:
+    """128-bit BLAKE2b hex digest (stable across processes, unlike hash())."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def tool_version(func, version: str = None) -> str:
+    """
+    Short fingerprint of a tool's signature and optional explicit version.
+
+    Changing a tool's parameters or bumping its version changes the
+    fingerprint, so results cached for the old signature are never reused.
+    """
+    try:
+        signature = str(inspect.signature(func))
+    except (TypeError, ValueError):
+        signature = ""
+    return digest(f"{func.__module__}.{func.__qualname__}{signature}|{version or ''}".encode())[:8]
+
+
+def derive_cache_key(tool_name: str, params: dict, version: str = "") -> str:
+    """
+    Build the cache key for a tool call.
+
+    Args:
+        tool_name: Name of the tool
+        params: Call parameters (may be nested)
+        version: Tool version fingerprint from tool_version()
+
+    Returns:
+        Key of the form ``lmcp:<tool>:<version>:<digest>``
+    """
+    return f"{KEY_PREFIX}:{tool_name}:{version}:{digest(canonical_encode(params))}"
@@ -0,0 +1,248 @@
+import asyncio
+import collections
+import random
+import time
+
+
+# Failures that say a tool's downstream is unhealthy (ConnectionError and,
+# since Python 3.10, TimeoutError are OSErrors)
+INFRASTRUCTURE_ERRORS = (OSError, TimeoutError)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a tool whose circuit breaker is open."""
+
+    def __init__(self, tool_name, retry_after):
+        super().__init__(f"Circuit open for tool {tool_name!r}; retry in {retry_after:.1f}s")
+        self.tool_name = tool_name
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that adapts to a tool's latency (AIMD).
+
+    The limit grows by about one per ``limit`` successful calls while it is
+    in use, and is multiplied by ``backoff`` when a call fails or takes more
+    than ``tolerance`` times the baseline (the decaying minimum latency).
+    Like TCP, it backs off at most once per round: calls that started before
+    the last decrease can't trigger another one.
+    """
+
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 64,
+                 backoff: float = 0.75, tolerance: float = 2.0, drift: float = 0.01):
+        """
+        Initialize the limiter.
+
+        Args:
+            initial: Starting limit
+            min_limit: The limit never drops below this
+            max_limit: The limit never grows above this
+            backoff: Factor applied to the limit on congestion
+            tolerance: Latency over baseline counted as congestion
+            drift: How fast the baseline follows latencies above it
+        """
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.drift = drift
+        self.baseline = None
+        self.in_flight = 0
+        self._waiters = collections.deque()
+        self._last_decrease = 0.0
+
+    async def acquire(self):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1  # Granted a slot just as we were cancelled
+                self._wake()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, started: float, failed: bool = False):
+        """
+        Free a slot and adapt the limit.
+
+        Args:
+            started: time.monotonic() when the call started
+            failed: Whether the call raised (None if it was cancelled)
+        """
+        now = time.monotonic()
+        self.in_flight -= 1
+        if failed is not None:
+            self._adapt(started, now - started, failed)
+        self._wake()
+
+    def _adapt(self, started, latency, failed):
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline += (latency - self.baseline) * self.drift
+        if failed or latency > self.tolerance * self.baseline:
+            if started >= self._last_decrease:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = time.monotonic()
+        elif self.in_flight + 1 >= self.limit / 2:  # Only grow a limit that is actually used
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while a tool's recent error rate is too high.
+
+    Closed: calls run and outcomes are counted over a rolling ``window``.
+    Once at least ``min_calls`` calls saw ``failure_ratio`` failures, the
+    breaker opens and calls are rejected for ``cooldown`` seconds. Then it is
+    half-open: a single probe call runs, and closes the breaker if it
+    succeeds or re-opens it if it fails.
+
+    Only exceptions in ``failure_on`` count as failures. Rejected input
+    (ValueError, including ToolValidationError) never does: a caller sending
+    bad arguments must not open the circuit for everyone else.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failure_ratio: float = 0.5, min_calls: int = 20, window: float = 10.0,
+                 cooldown: float = 5.0, buckets: int = 10, failure_on=INFRASTRUCTURE_ERRORS):
+        """
+        Initialize the breaker.
+
+        Args:
+            failure_ratio: Share of failed calls that opens the breaker
+            min_calls: Calls needed in the window before it can open
+            window: Seconds of history considered
+            cooldown: Seconds the breaker stays open before probing
+            buckets: Resolution of the rolling window
+            failure_on: Exception types counted as failures
+        """
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self.failure_on = tuple(failure_on)
+        self._bucket_width = window / buckets
+        self._buckets = collections.deque()  # [start, calls, failures]
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+
+    def counts(self, exc: BaseException) -> bool:
+        """Whether exc is a failure of the tool rather than of its input."""
+        return isinstance(exc, self.failure_on) and not isinstance(exc, ValueError)
+
+    def before_call(self, tool_name: str) -> bool:
+        """
+        Admit or reject a call.
+
+        Returns:
+            True if the call is the half-open probe
+
+        Raises:
+            CircuitOpenError: If the call must not run
+        """
+        if self.state == self.CLOSED:
+            return False
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            retry_after = self._opened_at + self.cooldown - now
+            if retry_after > 0:
+                raise CircuitOpenError(tool_name, retry_after)
+            self.state = self.HALF_OPEN
+        if self._probing:
+            raise CircuitOpenError(tool_name, self.cooldown)
+        self._probing = True
+        return True
+
+    def record(self, failed, probe: bool = False):
+        """
+        Count a call's outcome.
+
+        Args:
+            failed: Whether the call failed (see counts; None if it was cancelled)
+            probe: Whether it was the half-open probe
+        """
+        if probe:
+            self._probing = False
+            if failed is None:
+                return  # Let the next call probe instead
+            if failed:
+                self._open()
+            else:
+                self.state = self.CLOSED
+                self._buckets.clear()
+            return
+        if self.state != self.CLOSED or failed is None:
+            return  # Outcomes of calls admitted before the breaker opened
+        now = time.monotonic()
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        if not self._buckets or self._buckets[-1][0] + self._bucket_width <= now:
+            self._buckets.append([now, 0, 0])
+        bucket = self._buckets[-1]
+        bucket[1] += 1
+        bucket[2] += bool(failed)
+        if failed:
+            calls = sum(bucket[1] for bucket in self._buckets)
+            failures = sum(bucket[2] for bucket in self._buckets)
+            if calls >= self.min_calls and failures >= self.failure_ratio * calls:
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._buckets.clear()
+
+
+class RetryPolicy:
+    """
+    How often and how patiently to retry a failing tool call.
+
+    Delays grow exponentially with "full jitter" (uniform between zero and
+    the exponential bound), which spreads retries from many callers instead
+    of having them hit a recovering downstream in lockstep. Retries never
+    sleep past the request's deadline.
+    """
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.1, max_delay: float = 2.0,
+                 multiplier: float = 2.0, retry_on=(Exception,)):
+        """
+        Initialize the policy.
+
+        Args:
+            attempts: Total tries, including the first
+            base_delay: Upper bound of the first backoff in seconds
+            max_delay: Upper bound of any backoff in seconds
+            multiplier: Growth of the bound per retry
+            retry_on: Exception types worth retrying
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.retry_on = tuple(retry_on)
+
+    def retryable(self, exc: BaseException) -> bool:
+        # An open circuit or a blown deadline won't get better by retrying now
+        return isinstance(exc, self.retry_on) and not isinstance(exc, (CircuitOpenError, TimeoutError))
+
+    def backoff(self, retry: int) -> float:
+        """Seconds to wait before retry number ``retry`` (1-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * self.multiplier ** (retry - 1)))
@@ -0,0 +1,215 @@
+import asyncio
+import inspect
+import json
+import logging
+import time
+import uuid
+
+from .keys import canonical_encode, digest
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceSpec:
+    """A registered resource: its handler and how long a computed value may be served."""
+
+    __slots__ = ("id", "function", "description", "is_async", "takes_context", "ttl")
+
+    def __init__(self, resource_id: str, function, description: str = None, ttl: float = None):
+        """
+        Compile a resource specification from a handler.
+
+        Args:
+            resource_id: Unique identifier (e.g. "resource://calculation_history")
+            function: Handler returning the resource's contents; it may take
+                one argument, a context dict shared by every reader
+            description: Resource description (defaults to the docstring)
+            ttl: Seconds a computed value is served; None keeps it until the
+                resource is invalidated
+        """
+        self.id = resource_id
+        self.function = function
+        self.description = description or function.__doc__
+        self.is_async = inspect.iscoroutinefunction(function)
+        self.takes_context = len(inspect.signature(function).parameters) > 0
+        self.ttl = ttl
+
+    async def read(self, context):
+        args = (context,) if self.takes_context else ()
+        if self.is_async:
+            return await self.function(*args)
+        return await asyncio.to_thread(self.function, *args)  # Keep the event loop free
+
+    def describe(self):
+        return {"uri": self.id, "description": self.description}
+
+    def __repr__(self):
+        return f"ResourceSpec(id={self.id!r})"
+
+
+class ItemWindow(list):
+    """
+    The retained tail of an append-only sequence whose oldest items are dropped.
+
+    Return one from a resource (e.g. over a bounded deque) so it is paged by
+    sequence number rather than list index: ``first`` is the sequence number
+    of the first retained item, counting every item ever appended, so a
+    client's offset keeps pointing at the same item as older ones go.
+    """
+
+    __slots__ = ("first",)
+
+    def __init__(self, items=(), first: int = 0):
+        """
+        Initialize the window.
+
+        Args:
+            items: The retained items, oldest first
+            first: Sequence number of the first of them (items dropped so far)
+        """
+        super().__init__(items)
+        self.first = first
+
+
+def etag(value) -> str:
+    """Strong ETag of a value: equal contents give equal tags on every worker."""
+    if isinstance(value, ItemWindow):
+        value = [value.first, list(value)]  # The same items at another position differ
+    try:
+        data = canonical_encode(value)
+    except TypeError:
+        data = json.dumps(value, sort_keys=True, default=str).encode()
+    return f'"{digest(data)}"'
+
+
+class _Entry:
+    __slots__ = ("version", "value", "etag", "expires", "pages")
+
+    def __init__(self, version, value, expires):
+        self.version = version
+        self.value = value
+        self.etag = etag(value)
+        self.expires = expires
+        self.pages = {}  # (offset, limit) -> ETag of that slice
+
+
+class ResourceCache:
+    """
+    Computed resource contents, keyed by resource id and version.
+
+    A resource is computed on its first read and served from memory until
+    it is invalidated (or its ttl passes); concurrent reads of a stale
+    resource share one computation. Invalidation bumps the resource's
+    version, so a computation that was already running when the resource
+    changed is not kept. With a bus, invalidations reach every worker.
+
+    ETags are content hashes, so a recomputation that yields the same
+    contents still revalidates, and pages of a list-shaped resource have
+    their own tags: the unchanged pages of an append-only history keep
+    answering 304. Lists are paged by index, which only stays valid while
+    nothing is dropped from their front; a bounded history returns an
+    ItemWindow to be paged by sequence number.
+    """
+
+    def __init__(self, resources: dict, context: dict = None, bus=None):
+        """
+        Initialize the cache.
+
+        Args:
+            resources: The app's resource registry, id -> ResourceSpec (shared, not copied)
+            context: Dict passed to handlers that take a context
+            bus: Optional invalidation bus (such as core.cache.RedisInvalidationBus)
+        """
+        self.resources = resources
+        self.context = context if context is not None else {}
+        self.bus = bus
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._entries = {}
+        self._versions = {}  # resource id -> local change counter
+        self._inflight = {}  # resource id -> Future of the running computation
+        self._origin = uuid.uuid4().hex
+        self._subscribed = False
+        self._background = set()
+
+    def _ensure_subscribed(self):
+        if self.bus is not None and not self._subscribed:
+            self._subscribed = True
+            self.bus.subscribe(self._on_message, on_reconnect=self._entries.clear)
+
+    def version(self, resource_id: str) -> int:
+        """Local change counter of a resource (bumped by every invalidation)."""
+        return self._versions.get(resource_id, 0)
+
+    async def get(self, resource_id: str):
+        """
+        The resource's current contents, computing them if needed.
+
+        Returns:
+            Entry with .value, .etag and .version
+
+        Raises:
+            KeyError: If no such resource is registered
+        """
+        spec = self.resources[resource_id]
+        self._ensure_subscribed()
+        entry = self._entries.get(resource_id)
+        if entry is not None and (entry.expires is None or entry.expires > time.monotonic()):
+            self.stats["hits"] += 1
+            return entry
+        future = self._inflight.get(resource_id)
+        if future is None:
+            self.stats["misses"] += 1
+            future = self._inflight[resource_id] = asyncio.ensure_future(self._compute(spec))
+            future.add_done_callback(lambda _: self._inflight.pop(resource_id, None))
+        return await asyncio.shield(future)
+
+    async def _compute(self, spec):
+        version = self.version(spec.id)
+        value = await spec.read(self.context)
+        entry = _Entry(version, value, None if spec.ttl is None else time.monotonic() + spec.ttl)
+        if self.version(spec.id) == version:  # Not invalidated while computing
+            self._entries[spec.id] = entry
+        return entry
+
+    def page_etag(self, entry, offset: int, limit: int) -> str:
+        """ETag of one slice of a list-shaped resource."""
+        tag = entry.pages.get((offset, limit))
+        if tag is None:
+            tag = etag(entry.value[offset:offset + limit])
+            if len(entry.pages) < 256:  # Clients pick the ranges, so bound what's kept
+                entry.pages[(offset, limit)] = tag
+        return tag
+
+    def invalidate(self, resource_id: str, broadcast: bool = True):
+        """
+        Mark a resource as changed: the next read recomputes it.
+
+        Call it from code that mutates what a resource shows, or declare the
+        resources a tool changes with the tool's ``invalidates`` option.
+        Must be called on the event loop.
+        """
+        self._versions[resource_id] = self.version(resource_id) + 1
+        self._entries.pop(resource_id, None)
+        self.stats["invalidations"] += 1
+        if broadcast and self.bus is not None:
+            message = json.dumps({"origin": self._origin, "resource": resource_id})
+            task = asyncio.ensure_future(self.bus.publish(message))
+            self._background.add(task)
+            task.add_done_callback(self._published)
+
+    def _published(self, task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Could not broadcast a resource invalidation: %r", task.exception())
+
+    def _on_message(self, message):
+        try:
+            update = json.loads(message)
+        except ValueError:
+            return
+        if update.get("origin") != self._origin and "resource" in update:
+            self.invalidate(update["resource"], broadcast=False)
+
+    async def close(self):
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
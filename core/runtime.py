@@ -0,0 +1,181 @@
+import asyncio
+import contextlib
+
+from data.async_storage import MemoryStorage
+from data.blobs import BlobStore
+from monitoring.metrics import MetricsCollector
+from monitoring.tracing import Tracer
+from orchestrator.toolchain import ToolChainOrchestrator
+
+from .cache import RedisInvalidationBus, VectorCache
+from .engine import SparkEngine
+from .resources import ResourceCache
+from .security import Authenticator
+from .session import SessionStore
+from .toolstats import ToolStatistics
+
+
+class Runtime:
+    """
+    Long-lived services shared by every request of a LightningMCP app: one
+    Redis connection pool, one cache, one SparkEngine (with its executor
+    pools), one orchestrator, one session store, one resource cache and one
+    blob store.
+
+    Built on startup, drained and closed on shutdown.
+    """
+
+    def __init__(self, tools: dict, redis_url: str = "redis://localhost", cache=None, resources: dict = None,
+                 max_connections: int = 64, max_workers: int = None, max_processes: int = None,
+                 max_fan_out: int = 8, drain_timeout: float = 30, tracer: Tracer = None, storage=None,
+                 permissions=None, authenticator=None, rate_limiter=None, request_timeout: float = None,
+                 blobs: BlobStore = None):
+        """
+        Initialize the runtime.
+
+        Args:
+            tools: The app's tool registry (shared, not copied)
+            redis_url: Redis URL for the cache
+            cache: Optional pre-built cache (replaces the Redis-backed one);
+                it is closed on shutdown, so a restarted runtime builds its
+                own from redis_url
+            resources: The app's resource registry, id -> ResourceSpec (shared)
+            max_connections: Size of the Redis connection pool
+            max_workers: Thread pool size for sync tools
+            max_processes: Process pool size for CPU-bound tools
+            max_fan_out: Max concurrent steps per plan
+            drain_timeout: Seconds to wait for in-flight requests on shutdown
+            tracer: Optional Tracer (defaults to 1% head sampling plus slow
+                and failed requests)
+            storage: Optional data.async_storage.AsyncStorage for tools,
+                resources and sessions, closed on shutdown (sessions are kept
+                in this worker's memory, data.async_storage.MemoryStorage,
+                without it)
+            permissions: Optional core.security.PermissionSystem; when set,
+                every tool a request would run is checked before it runs
+            authenticator: Optional core.security.Authenticator for bearer
+                tokens (required by permissions)
+            rate_limiter: Optional api.ratelimit.RateLimiter applied to every
+                request and to the tools each request would run
+            request_timeout: Default deadline in seconds for a plan's steps,
+                retries included (requests may set a shorter "timeout")
+            blobs: Optional data.blobs.BlobStore for large tool parameters and
+                results (defaults to one in shared memory, 64 KiB threshold)
+        """
+        self.tools = tools
+        self.resources = resources if resources is not None else {}
+        self.redis_url = redis_url
+        self.max_connections = max_connections
+        self.max_workers = max_workers
+        self.max_processes = max_processes
+        self.max_fan_out = max_fan_out
+        self.drain_timeout = drain_timeout
+        self.redis_pool = None
+        self.cache = cache
+        self.engine = None
+        self.orchestrator = None
+        self.sessions = None
+        self.resource_cache = None
+        self._session_bus = None
+        self._resource_bus = None
+        self.metrics = MetricsCollector()  # Outlives restarts so counters stay monotonic
+        self.stats = ToolStatistics()  # Likewise, so plans stay optimized across restarts
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.storage = storage
+        self.permissions = permissions
+        self.authenticator = authenticator
+        self.rate_limiter = rate_limiter
+        self.request_timeout = request_timeout
+        self.blobs = blobs
+        if permissions is not None and authenticator is None:
+            self.authenticator = Authenticator()
+        self.started = False
+        self.stopping = False  # Draining in-flight requests; no new ones are taken
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def startup(self):
+        """
+        Build the shared services. Safe to call more than once.
+
+        Raises:
+            RuntimeError: If the runtime is shutting down
+        """
+        if self.stopping:
+            raise RuntimeError("The runtime is shutting down")
+        if self.started:
+            return
+        if self.cache is None:
+            import redis.asyncio as redis  # Not needed (nor loaded) when a cache is passed in
+            self.redis_pool = redis.ConnectionPool.from_url(self.redis_url, max_connections=self.max_connections)
+            self.cache = VectorCache(client=redis.Redis(connection_pool=self.redis_pool))
+            # Workers share session diffs and resource invalidations over the same Redis
+            self._session_bus = RedisInvalidationBus(redis.Redis(connection_pool=self.redis_pool),
+                                                     channel="lightningmcp:sessions")
+            self._resource_bus = RedisInvalidationBus(redis.Redis(connection_pool=self.redis_pool),
+                                                      channel="lightningmcp:resources")
+        if self.blobs is None:
+            self.blobs = BlobStore()
+        self.resource_cache = ResourceCache(self.resources, context={"runtime": self}, bus=self._resource_bus)
+        self.engine = SparkEngine(tools=self.tools, cache=self.cache,
+                                  max_workers=self.max_workers, max_processes=self.max_processes,
+                                  metrics=self.metrics, tracer=self.tracer, stats=self.stats,
+                                  resource_cache=self.resource_cache, blobs=self.blobs)
+        self.orchestrator = ToolChainOrchestrator(engine=self.engine, max_fan_out=self.max_fan_out,
+                                                  tool_registry=self.tools, metrics=self.metrics,
+                                                  tracer=self.tracer, default_timeout=self.request_timeout)
+        storage = self.storage if self.storage is not None else MemoryStorage()  # One worker only
+        self.sessions = SessionStore(storage, bus=self._session_bus)
+        self.started = True
+
+    @contextlib.contextmanager
+    def track_request(self):
+        """Count a request as in flight so shutdown can wait for it."""
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.set()
+
+    async def shutdown(self):
+        """Wait for in-flight requests, then release pools and connections."""
+        if not self.started or self.stopping:
+            return
+        self.stopping = True
+        try:
+            await self._stop()
+        finally:
+            self.started = self.stopping = False
+
+    async def _stop(self):
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        # Joining the worker pools blocks, so do it off the event loop
+        await asyncio.to_thread(self.engine.shutdown, True)
+        await asyncio.to_thread(self.tracer.shutdown)  # Flushes pending spans
+        await self.sessions.close()
+        await self.resource_cache.close()
+        for bus in (self._session_bus, self._resource_bus):
+            if bus is not None:
+                await bus.close()
+        self._session_bus = self._resource_bus = None
+        await self.cache.close()
+        self.cache = None  # Closed, so a restart must not reuse it (even if it was passed in)
+        self.blobs.close()  # Unmaps; the blobs stay for other workers
+        if self.storage is not None:
+            await self.storage.close()
+        if self.rate_limiter is not None:
+            await self.rate_limiter.close()
+        if self.redis_pool is not None:
+            await self.redis_pool.disconnect()
+            self.redis_pool = None
+        self.engine = None
+        self.orchestrator = None
+        self.sessions = None
+        self.resource_cache = None
@@ -1,3 +1,14 @@
+import asyncio
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
 # Placeholder for an authentication function (e.g., validating a token)
 def authenticate_user(token):
     # In a real application, this would validate a JWT, API key, etc.
@@ -8,53 +19,217 @@ def authenticate_user(token):
     return None
 
 
+# Rules map a role to the "kind:name:action" patterns it may (or may not)
+# use, plus the roles it inherits from. Patterns take shell-style wildcards.
+DEFAULT_RULES = {
+    "user": {"allow": ["tool:*:execute", "resource:*:read"]},  # Users cannot register new tools
+    "admin": {"inherits": ["user"], "allow": ["tool:*:*", "resource:*:*"]},
+}
+
+
+class RuleError(ValueError):
+    """Raised when RBAC rules are malformed."""
+
+
+def _compile_pattern(pattern):
+    if pattern.count(":") < 2:
+        raise RuleError(f"Rule {pattern!r} must look like 'kind:name:action'")
+    # Names can contain ':' (e.g. resource://x), so kind is the first field
+    # and action the last; everything in between is the name.
+    kind, rest = pattern.split(":", 1)
+    name, action = rest.rsplit(":", 1)
+    return tuple(re.compile(fnmatch.translate(part)).match for part in (kind, name, action))
+
+
+def _resolve(rules, role, seen=()):
+    # A role's allow/deny patterns, including everything it inherits
+    if role in seen:
+        raise RuleError(f"Role inheritance cycle: {' -> '.join(seen + (role,))}")
+    if role not in rules:
+        raise RuleError(f"Unknown role {role!r}")
+    allow = list(rules[role].get("allow", ()))
+    deny = list(rules[role].get("deny", ()))
+    for parent in rules[role].get("inherits", ()):
+        parent_allow, parent_deny = _resolve(rules, parent, seen + (role,))
+        allow += parent_allow
+        deny += parent_deny
+    return allow, deny
+
+
+class _DecisionTable:
+    """
+    Compiled rules: each role is one bit, and each (kind, name, action) maps
+    to the bitmask of roles allowed to perform it. Masks are computed once
+    per key and memoized, so a check is a dict lookup and an AND. Names come
+    from requests (resource URIs, session ids), so the memo is an LRU of at
+    most ``max_masks`` keys.
+    """
+
+    def __init__(self, rules, max_masks: int = 4096):
+        self.role_bits = {role: 1 << i for i, role in enumerate(rules)}
+        self._matchers = []  # (bit, allow matchers, deny matchers)
+        for role, bit in self.role_bits.items():
+            allow, deny = _resolve(rules, role)
+            self._matchers.append((bit, [_compile_pattern(p) for p in allow], [_compile_pattern(p) for p in deny]))
+        self.max_masks = max_masks
+        self._masks = OrderedDict()
+
+    @staticmethod
+    def _matches(matchers, key):
+        return any(kind(key[0]) and name(key[1]) and action(key[2]) for kind, name, action in matchers)
+
+    def mask(self, key):
+        masks = self._masks
+        mask = masks.get(key)
+        if mask is not None:
+            masks.move_to_end(key)
+            return mask
+        mask = 0
+        for bit, allow, deny in self._matchers:
+            if self._matches(allow, key) and not self._matches(deny, key):  # Deny wins
+                mask |= bit
+        masks[key] = mask
+        if len(masks) > self.max_masks:
+            masks.popitem(last=False)
+        return mask
+
+
 class PermissionSystem:
-    def __init__(self):
-        # Load RBAC matrix or rules
-        # Example RBAC structure: role -> resource -> action -> allowed (boolean)
-        self.rbac_rules = {
-            "admin": {
-                "tool": {
-                    "execute": True,
-                    "register": True
-                },
-                "resource": {
-                    "read": True,
-                    "write": True,
-                    "delete": True
-                }
-            },
-            "user": {
-                "tool": {
-                    "execute": True,
-                    "register": False  # Users cannot register new tools in this example
-                },
-                "resource": {
-                    "read": True,
-                    "write": False,
-                    "delete": False
-                }
-            }
-        }
+    """
+    Role-based access control over named tools and resources.
+
+    Rules are compiled into a decision table when loaded. With a ``path``,
+    ``refresh()`` reloads them when the file changes, swapping the table in
+    one assignment so in-flight checks never see half-loaded rules.
+    """
+
+    def __init__(self, rules: dict = None, path: str = None, reload_interval: float = 5.0,
+                 max_cached_decisions: int = 4096):
+        """
+        Initialize the permission system.
+
+        Args:
+            rules: Role rules (defaults to DEFAULT_RULES); see load_rules
+            path: Optional JSON file of rules, reloaded by refresh() when it changes
+            reload_interval: Min seconds between checks of the file
+            max_cached_decisions: Max (kind, name, action) decisions memoized
+                (least recently used are evicted)
+        """
+        self.path = path
+        self.max_cached_decisions = max_cached_decisions
+        self.reload_interval = reload_interval
+        self._mtime = None
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()
+        if path is not None:
+            self._load_file()
+        else:
+            self.load_rules(rules if rules is not None else DEFAULT_RULES)
+
+    def load_rules(self, rules: dict):
+        """
+        Compile and install a new rule set.
+
+        Args:
+            rules: {role: {"allow": [patterns], "deny": [patterns], "inherits": [roles]}}
+                where patterns look like "tool:calculate:execute" or "resource:*:read"
+        """
+        table = _DecisionTable(rules, self.max_cached_decisions)  # Raises RuleError before anything is replaced
+        self.rbac_rules = rules
+        self._table = table
+
+    def _load_file(self):
+        with open(self.path) as f:
+            rules = json.load(f)
+        self._mtime = os.stat(self.path).st_mtime_ns
+        self.load_rules(rules)
+
+    def refresh(self):
+        """Reload the rules file if it changed (checked at most every reload_interval)."""
+        if self.path is None or time.monotonic() < self._next_check:
+            return
+        with self._reload_lock:
+            self._next_check = time.monotonic() + self.reload_interval
+            try:
+                if os.stat(self.path).st_mtime_ns != self._mtime:
+                    self._load_file()
+            except (OSError, ValueError):
+                pass  # Keep serving the last good rules
+
+    def user_mask(self, user):
+        """Bitmask of the user's roles ("role" or "roles" key)."""
+        if not user:
+            return 0
+        bits = self._table.role_bits
+        roles = user.get("roles")
+        if roles is None:
+            return bits.get(user.get("role"), 0)
+        mask = 0
+        for role in roles:
+            mask |= bits.get(role, 0)
+        return mask
 
     def check_permission(self, user, tool=None, action=None, resource=None):
-        # Implement RBAC logic
-        if not user or "role" not in user:
-            return False  # No user or role, deny access
+        """
+        Whether the user may perform action on the named tool or resource.
+
+        Unknown users, roles, tools and resources are denied.
+        """
+        if action is None or (tool is None and resource is None):
+            return False
+        key = ("tool", tool, action) if tool is not None else ("resource", resource, action)
+        return bool(self._table.mask(key) & self.user_mask(user))
+
+
+class Authenticator:
+    """
+    Memoizes token verification for ``ttl`` seconds.
+
+    Entries are keyed by a digest of the token, so raw tokens are never kept
+    in memory. Rejections are cached for a shorter ``negative_ttl`` so a
+    flood of bad tokens doesn't hit the verifier either.
+    """
 
-        role = user["role"]
+    def __init__(self, verify=authenticate_user, ttl: float = 60, negative_ttl: float = 5,
+                 max_entries: int = 10000):
+        """
+        Initialize the authenticator.
 
-        if role not in self.rbac_rules:
-            return False  # Unknown role, deny access
+        Args:
+            verify: Function (sync or async) returning the user for a token, or None
+            ttl: Seconds a verified user is cached
+            negative_ttl: Seconds a rejected token is cached
+            max_entries: Max cached tokens (least recently used are evicted)
+        """
+        self.verify = verify
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # digest -> (user, expires_at)
 
-        # Check permissions based on the provided tool, action, or resource
-        # This is a simplified check; real-world RBAC can be more complex.
-        if tool and action:
-            return self.rbac_rules[role].get("tool", {}).get(action, False)
+    @staticmethod
+    def _digest(token):
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
 
-        if resource and action:
-            return self.rbac_rules[role].get("resource", {}).get(action, False)
+    async def authenticate(self, token: str):
+        """Return the user for token, or None if it's missing or invalid."""
+        if not token:
+            return None
+        key = self._digest(token)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and entry[1] > now:
+            self._entries.move_to_end(key)
+            return entry[0]
+        user = self.verify(token)
+        if asyncio.iscoroutine(user):
+            user = await user
+        self._entries[key] = (user, now + (self.ttl if user is not None else self.negative_ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return user
 
-        # If no specific tool/action/resource is provided, perhaps a default permission is needed
-        # For now, deny if no specific check is requested
-        return False
+    def revoke(self, token: str):
+        """Drop a cached token (e.g. on logout)."""
+        self._entries.pop(self._digest(token), None)
@@ -0,0 +1,248 @@
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from .keys import canonical_encode, digest
+
+_WORD = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """
+    Offline text embedder: word and character n-gram features hashed into a
+    fixed-size vector (the "hashing trick"), L2-normalized.
+
+    Case, whitespace, punctuation and word order barely move the vector, so
+    reworded-but-equivalent arguments land close together. Anything with an
+    ``embed(text) -> np.ndarray`` method and a ``dim`` can replace it, e.g. a
+    local sentence-embedding model when synonyms matter.
+    """
+
+    def __init__(self, dim: int = 512, ngram: int = 3):
+        """
+        Initialize the embedder.
+
+        Args:
+            dim: Vector size
+            ngram: Character n-gram length (0 for words only)
+        """
+        self.dim = dim
+        self.ngram = ngram
+
+    def _features(self, text):
+        for word in _WORD.findall(text.lower()):
+            yield word
+            if self.ngram and len(word) > self.ngram:
+                padded = f"<{word}>"
+                for i in range(len(padded) - self.ngram + 1):
+                    yield "#" + padded[i:i + self.ngram]
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            # crc32 is stable across processes, unlike hash()
+            h = zlib.crc32(feature.encode())
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class IVFIndex:
+    """
+    Approximate nearest-neighbor index (inverted file) over unit vectors.
+
+    Vectors live in one contiguous NumPy matrix. Until there are enough of
+    them, search is a brute-force matrix product; after that, k-means splits
+    the space into ``nlist`` cells and a search only scores the vectors in
+    the ``nprobe`` cells closest to the query. Every vector also carries a
+    partition id, and searches only match their own partition.
+    """
+
+    def __init__(self, dim: int, nlist: int = 64, nprobe: int = 4, min_train: int = 1024):
+        """
+        Initialize the index.
+
+        Args:
+            dim: Vector size
+            nlist: Number of k-means cells
+            nprobe: Cells scored per search
+            min_train: Vectors needed before the cells are trained
+        """
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = max(min_train, nlist)
+        self._vectors = np.zeros((64, dim), dtype=np.float32)
+        self._partitions = np.zeros(64, dtype=np.int64)
+        self._cells = np.full(64, -1, dtype=np.int32)
+        self._keys = []  # Row -> key
+        self._rows = {}  # Key -> row
+        self._centroids = None
+        self._trained_at = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def _grow(self):
+        capacity = len(self._vectors) * 2
+        for name in ("_vectors", "_partitions", "_cells"):
+            old = getattr(self, name)
+            new = np.zeros((capacity, *old.shape[1:]), dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add(self, key, vector, partition: int):
+        if key in self._rows:
+            self.remove(key)
+        row = len(self._keys)
+        if row == len(self._vectors):
+            self._grow()
+        self._vectors[row] = vector
+        self._partitions[row] = partition
+        self._cells[row] = self._nearest_cell(vector) if self._centroids is not None else -1
+        self._keys.append(key)
+        self._rows[key] = row
+        if len(self._keys) >= self.min_train and len(self._keys) >= 2 * self._trained_at:
+            self.train()
+
+    def remove(self, key):
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        last = len(self._keys) - 1
+        if row != last:
+            # Move the last row into the hole so the matrix stays dense
+            moved = self._keys[last]
+            self._vectors[row] = self._vectors[last]
+            self._partitions[row] = self._partitions[last]
+            self._cells[row] = self._cells[last]
+            self._keys[row] = moved
+            self._rows[moved] = row
+        self._keys.pop()
+
+    def _nearest_cell(self, vector):
+        return int(np.argmax(self._centroids @ vector))
+
+    def train(self, iterations: int = 8, seed: int = 0):
+        """Cluster the current vectors into cells (spherical k-means)."""
+        count = len(self._keys)
+        if count < self.nlist:
+            return
+        vectors = self._vectors[:count]
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(count, size=min(count, 64 * self.nlist), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for cell in range(self.nlist):
+                members = sample[assignment == cell]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    norm = np.linalg.norm(centroid)
+                    if norm:
+                        centroids[cell] = centroid / norm
+        self._centroids = centroids
+        self._cells[:count] = np.argmax(vectors @ centroids.T, axis=1)
+        self._trained_at = count
+
+    def search(self, vector, partition: int):
+        """
+        Find the most similar vector in the same partition.
+
+        Returns:
+            Tuple of (key, cosine similarity), or None if the partition is empty
+        """
+        count = len(self._keys)
+        if not count:
+            return None
+        mask = self._partitions[:count] == partition
+        if self._centroids is not None:
+            probes = np.argsort(self._centroids @ vector)[-self.nprobe:]
+            mask &= np.isin(self._cells[:count], probes)
+        rows = np.flatnonzero(mask)
+        if not rows.size:
+            return None
+        scores = self._vectors[rows] @ vector
+        best = int(np.argmax(scores))
+        return self._keys[rows[best]], float(scores[best])
+
+
+class SemanticCache:
+    """
+    Maps tool calls to the cache keys of similar earlier calls.
+
+    Only string parameters are embedded; every other parameter (numbers,
+    flags, lists, ...) must match exactly, because ``add(a=1)`` answering
+    ``add(a=2)`` is never acceptable. Results themselves stay in the exact
+    cache under their own keys; this index only stores vectors and keys, so
+    expiry and invalidation there apply here too. Least recently matched
+    entries are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, embedder=None, max_entries: int = 10000, nlist: int = 64, nprobe: int = 4):
+        """
+        Initialize the semantic cache.
+
+        Args:
+            embedder: Object with ``dim`` and ``embed(text)`` (defaults to HashingEmbedder)
+            max_entries: Max calls indexed
+            nlist: IVF cells (see IVFIndex)
+            nprobe: IVF cells searched per lookup
+        """
+        self.embedder = embedder if embedder is not None else HashingEmbedder()
+        self.max_entries = max_entries
+        self.index = IVFIndex(self.embedder.dim, nlist=nlist, nprobe=nprobe)
+        self._recent = OrderedDict()  # Cache key -> None, least recently used first
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _split(tool, params):
+        text = "\n".join(f"{name}: {value}" for name, value in sorted(params.items()) if isinstance(value, str))
+        exact = {name: value for name, value in params.items() if not isinstance(value, str)}
+        signature = digest(canonical_encode([tool.name, tool.cache_version, sorted(params), exact]))
+        return int(signature[:16], 16) - (1 << 63), text  # Fits the int64 partition column
+
+    def search(self, tool, params, threshold: float):
+        """Cache key of the most similar indexed call above threshold, or None."""
+        partition, text = self._split(tool, params)
+        if not text:
+            return None
+        vector = self.embedder.embed(text)
+        with self._lock:
+            match = self.index.search(vector, partition)
+            if match is None or match[1] < threshold:
+                return None
+            self._recent.move_to_end(match[0])
+            return match[0]
+
+    def add(self, tool, params, cache_key):
+        """Index a call whose result is cached under cache_key."""
+        with self._lock:
+            if cache_key in self._recent:
+                self._recent.move_to_end(cache_key)
+                return
+        partition, text = self._split(tool, params)
+        if not text:
+            return
+        vector = self.embedder.embed(text)
+        with self._lock:
+            self.index.add(cache_key, vector, partition)
+            self._recent[cache_key] = None
+            while len(self._recent) > self.max_entries:
+                evicted, _ = self._recent.popitem(last=False)
+                self.index.remove(evicted)
+
+    def discard(self, cache_key):
+        """Forget a key whose result is no longer cached."""
+        with self._lock:
+            self._recent.pop(cache_key, None)
+            self.index.remove(cache_key)
+
+    def __len__(self):
+        return len(self._recent)
@@ -0,0 +1,153 @@
+import json
+import pickle
+import struct
+import zlib
+
+
+class SerializationError(ValueError):
+    """Raised when a value cannot be encoded or decoded by a serializer."""
+
+
+class JSONSerializer:
+    """Compact JSON; safe default for results shared through Redis."""
+
+    name = "json"
+    codec_id = 1
+
+    def dumps(self, value) -> bytes:
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(bytes(data))
+
+
+class MsgpackSerializer:
+    """MessagePack; smaller and faster than JSON for numeric payloads. Requires msgpack."""
+
+    name = "msgpack"
+    codec_id = 2
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def dumps(self, value) -> bytes:
+        return self._msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        return self._msgpack.unpackb(data, raw=False)
+
+
+class PickleSerializer:
+    """
+    Pickle protocol 5 with out-of-band buffers.
+
+    Large buffers (bytes, NumPy arrays, ...) are written after the pickle
+    stream instead of being copied into it, and on load they are handed back
+    as memoryview slices of the input. Only use with trusted caches.
+    """
+
+    name = "pickle"
+    codec_id = 3
+    _header = struct.Struct(">IQ")
+    _length = struct.Struct(">Q")
+
+    def dumps(self, value) -> bytes:
+        buffers = []
+        payload = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+        raws = [buffer.raw() for buffer in buffers]
+        parts = [self._header.pack(len(raws), len(payload))]
+        parts.extend(self._length.pack(raw.nbytes) for raw in raws)
+        parts.append(payload)
+        parts.extend(raws)
+        return b"".join(parts)
+
+    def loads(self, data):
+        view = memoryview(data)
+        count, payload_len = self._header.unpack_from(view)
+        offset = self._header.size
+        lengths = []
+        for _ in range(count):
+            lengths.append(self._length.unpack_from(view, offset)[0])
+            offset += self._length.size
+        payload = view[offset:offset + payload_len]
+        offset += payload_len
+        buffers = []
+        for length in lengths:
+            buffers.append(view[offset:offset + length])
+            offset += length
+        return pickle.loads(payload, buffers=buffers)
+
+
+_SERIALIZERS = {cls.codec_id: cls for cls in (JSONSerializer, MsgpackSerializer, PickleSerializer)}
+_COMPRESSED = 0x80
+
+
+def get_serializer(name: str):
+    """
+    Look up a serializer by name.
+
+    Args:
+        name: One of "json", "msgpack" or "pickle"
+
+    Returns:
+        A serializer instance
+    """
+    for cls in _SERIALIZERS.values():
+        if cls.name == name:
+            return cls()
+    raise ValueError(f"Unsupported serializer: {name}")
+
+
+class ResultCodec:
+    """
+    Encodes cached results as ``<header byte><body>``.
+
+    The header records which serializer produced the body and whether it is
+    zlib-compressed, so workers configured with different serializers can
+    still read each other's entries. Pickled entries are only decoded by
+    codecs that are themselves configured for pickle.
+    """
+
+    def __init__(self, serializer=None, compress_threshold: int = 16 * 1024, compress_level: int = 1):
+        """
+        Initialize the codec.
+
+        Args:
+            serializer: Serializer instance or name (defaults to JSON)
+            compress_threshold: Compress bodies at least this many bytes (None to disable)
+            compress_level: zlib compression level
+        """
+        if serializer is None or isinstance(serializer, str):
+            serializer = get_serializer(serializer or "json")
+        self.serializer = serializer
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self._decoders = {serializer.codec_id: serializer}
+
+    def encode(self, value) -> bytes:
+        try:
+            body = self.serializer.dumps(value)
+        except (TypeError, ValueError, pickle.PicklingError) as exc:
+            raise SerializationError(f"Cannot serialize {type(value).__name__} with {self.serializer.name}") from exc
+        header = self.serializer.codec_id
+        if self.compress_threshold is not None and len(body) >= self.compress_threshold:
+            body = zlib.compress(body, self.compress_level)
+            header |= _COMPRESSED
+        return bytes([header]) + body
+
+    def decode(self, data):
+        view = memoryview(data)
+        header = view[0]
+        body = view[1:]
+        if header & _COMPRESSED:
+            body = zlib.decompress(body)
+        codec_id = header & ~_COMPRESSED
+        serializer = self._decoders.get(codec_id)
+        if serializer is None:
+            if codec_id not in _SERIALIZERS:
+                raise SerializationError(f"Unknown serializer id in cached value: {codec_id}")
+            if codec_id == PickleSerializer.codec_id:
+                raise SerializationError("Refusing to unpickle a cached value; configure the pickle serializer to accept it")
+            serializer = self._decoders[codec_id] = _SERIALIZERS[codec_id]()
+        return serializer.loads(body)
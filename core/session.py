@@ -0,0 +1,482 @@
+import asyncio
+import json
+import logging
+import re
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_SESSION_ID = re.compile(r"[A-Za-z0-9_.-]{1,128}")
+
+
+class PatchError(ValueError):
+    """Raised when a patch is malformed or doesn't apply (including a failed "test")."""
+
+
+class SessionConflict(RuntimeError):
+    """Raised when an update's expected version is not the session's current one."""
+
+    def __init__(self, session_id, expected, current):
+        super().__init__(f"Session {session_id!r} is at version {current}, not {expected}")
+        self.session_id = session_id
+        self.expected = expected
+        self.current = current
+
+
+def _pointer(path):
+    # JSON Pointer (RFC 6901): "/a/b~1c" -> ["a", "b/c"]
+    if not isinstance(path, str) or (path and not path.startswith("/")):
+        raise PatchError(f"Invalid path {path!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in path.split("/")[1:]]
+
+
+def _index(container, token, path, append=False):
+    if token == "-" and append:
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token[0] == "0"):
+        raise PatchError(f"Invalid list index in {path!r}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not append):
+        raise PatchError(f"List index out of range in {path!r}")
+    return index
+
+
+def _child(container, token, path):
+    try:
+        if isinstance(container, list):
+            return container[_index(container, token, path)]
+        return container[token]
+    except (KeyError, TypeError):
+        raise PatchError(f"Path {path!r} does not exist") from None
+
+
+def apply_patch(document, patch):
+    """
+    Apply a JSON Patch (RFC 6902 add, remove, replace and test operations).
+
+    The document is not modified: containers along each changed path are
+    copied and everything else is shared with the original, so applying a
+    small patch to a large document is cheap and earlier versions stay valid.
+
+    Args:
+        document: JSON-compatible value
+        patch: List of {"op", "path", ["value"]} operations
+
+    Returns:
+        The patched document
+
+    Raises:
+        PatchError: If an operation is malformed, a path doesn't exist or a
+            "test" fails
+    """
+    if not isinstance(patch, list):
+        raise PatchError("A patch is a list of operations")
+    copied = set()  # Containers already copied by this patch, safe to change in place
+
+    def writable(container):
+        if id(container) in copied:
+            return container
+        container = list(container) if isinstance(container, list) else dict(container)
+        copied.add(id(container))
+        return container
+
+    for operation in patch:
+        if not isinstance(operation, dict) or "op" not in operation or "path" not in operation:
+            raise PatchError(f"Invalid operation {operation!r}")
+        op, path = operation["op"], operation["path"]
+        tokens = _pointer(path)
+        if op == "test":
+            current = document
+            for token in tokens:
+                current = _child(current, token, path)
+            if current != operation.get("value"):
+                raise PatchError(f"Test failed at {path!r}")
+            continue
+        if op not in ("add", "remove", "replace"):
+            raise PatchError(f"Unsupported operation {op!r}")
+        if op != "remove" and "value" not in operation:
+            raise PatchError(f"Operation {op!r} needs a value")
+        if not tokens:
+            if op == "remove":
+                raise PatchError("Cannot remove the whole document")
+            document = operation["value"]
+            continue
+
+        # Copy the containers down to the parent of the target
+        root = parent = writable(document) if isinstance(document, (dict, list)) else None
+        if parent is None:
+            raise PatchError(f"Path {path!r} does not exist")
+        for token in tokens[:-1]:
+            child = _child(parent, token, path)
+            if not isinstance(child, (dict, list)):
+                raise PatchError(f"Path {path!r} does not exist")
+            child = writable(child)
+            if isinstance(parent, list):
+                parent[int(token)] = child
+            else:
+                parent[token] = child
+            parent = child
+
+        last = tokens[-1]
+        if isinstance(parent, list):
+            index = _index(parent, last, path, append=op == "add")
+            if op == "add":
+                parent.insert(index, operation["value"])
+            elif op == "remove":
+                del parent[index]
+            else:
+                parent[index] = operation["value"]
+        else:
+            if op != "add" and last not in parent:
+                raise PatchError(f"Path {path!r} does not exist")
+            if op == "remove":
+                del parent[last]
+            else:
+                parent[last] = operation["value"]
+        document = root
+    return document
+
+
+def _escape(token):
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def make_patch(old, new, path=""):
+    """
+    Compute a JSON Patch turning old into new.
+
+    Dicts are compared key by key and lists that only grew become appends;
+    anything else that differs is replaced whole.
+
+    Returns:
+        List of operations (empty if the documents are equal)
+    """
+    if old == new:
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        patch = [{"op": "remove", "path": f"{path}/{_escape(key)}"} for key in old if key not in new]
+        for key, value in new.items():
+            if key not in old:
+                patch.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+            else:
+                patch += make_patch(old[key], value, f"{path}/{_escape(key)}")
+        return patch
+    if isinstance(old, list) and isinstance(new, list) and len(new) > len(old) and new[:len(old)] == old:
+        return [{"op": "add", "path": f"{path}/-", "value": value} for value in new[len(old):]]
+    return [{"op": "replace", "path": path, "value": new}]
+
+
+class Subscription:
+    """
+    Updates of one session: first ``{"version", "state"}``, then one
+    ``{"version", "patch"}`` per update. A subscriber that falls more than
+    ``max_queue`` updates behind gets a fresh ``{"version", "state"}``
+    instead of the diffs it missed.
+    """
+
+    def __init__(self, store, session, max_queue):
+        self._store = store
+        self._session = session
+        self._queue = asyncio.Queue(max_queue)
+        self._queue.put_nowait({"version": session.version, "state": session.state})
+        self.closed = False
+
+    def _push(self, update):
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait({"version": self._session.version, "state": self._session.state})
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed and self._queue.empty():
+            raise StopAsyncIteration
+        update = await self._queue.get()
+        if update is None:
+            raise StopAsyncIteration
+        return update
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._session.subscribers.discard(self)
+            if not self._queue.full():
+                self._queue.put_nowait(None)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+class _Session:
+    __slots__ = ("session_id", "version", "state", "subscribers", "lock")
+
+    def __init__(self, session_id, version, state):
+        self.session_id = session_id
+        self.version = version
+        self.state = state
+        self.subscribers = set()
+        self.lock = asyncio.Lock()  # Serializes catch-up reads, not updates
+
+
+class SessionStore:
+    """
+    Shared session state kept as versioned documents.
+
+    Each update is a JSON Patch written as its own log entry under the next
+    version number with an atomic ``add``, so writers coordinate through the
+    storage (compare-and-swap) rather than a lock, and only the diff is
+    stored and sent. The add is only atomic across workers when the storage
+    is ``shared`` (MongoStorage); MemoryStorage and ThreadedStorage serve
+    one process, so with several workers sessions need a shared storage. A writer that loses the race
+    catches up on the winner's diffs and re-applies its patch on top (or
+    raises SessionConflict if it asked for a specific version). Every
+    ``snapshot_every`` versions the full state is written so loading a
+    session replays a bounded number of diffs.
+
+    Recently used sessions stay decoded in memory (the hot tier); other
+    workers' updates reach it through ``bus``, or on the next read.
+    """
+
+    def __init__(self, storage, bus=None, prefix: str = "session:", snapshot_every: int = 100,
+                 max_sessions: int = 10000, max_retries: int = 16):
+        """
+        Initialize the store.
+
+        Args:
+            storage: data.async_storage.AsyncStorage holding the log and snapshots
+            bus: Optional invalidation bus (publish/subscribe of strings, such as
+                core.cache.RedisInvalidationBus) carrying diffs between workers
+            prefix: Prefix of the storage keys
+            snapshot_every: Versions between full snapshots
+            max_sessions: Sessions kept in the hot tier (least recently used
+                ones without subscribers are dropped)
+            max_retries: Times an update is re-applied after losing a race
+        """
+        self.storage = storage
+        self.bus = bus
+        self.prefix = prefix
+        self.snapshot_every = snapshot_every
+        self.max_sessions = max_sessions
+        self.max_retries = max_retries
+        self._sessions = OrderedDict()
+        self._loading = {}  # session id -> Future of a load in progress
+        self._origin = uuid.uuid4().hex
+        self._subscribed = False
+        self._background = set()
+
+    def _key(self, session_id, kind, version):
+        return f"{self.prefix}{session_id}:{kind}{version:012d}"
+
+    async def _session(self, session_id):
+        if not isinstance(session_id, str) or not _SESSION_ID.fullmatch(session_id):
+            raise ValueError(f"Invalid session id {session_id!r}")
+        if self.bus is not None and not self._subscribed:
+            self._subscribed = True
+            self.bus.subscribe(self._on_message, on_reconnect=self._resync)
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            return session
+        loading = self._loading.get(session_id)
+        if loading is None:  # Concurrent first reads share one load
+            loading = self._loading[session_id] = asyncio.ensure_future(self._load(session_id))
+            loading.add_done_callback(lambda _: self._loading.pop(session_id, None))
+        session = await asyncio.shield(loading)
+        return self._sessions.setdefault(session_id, session)
+
+    async def _load(self, session_id):
+        for _ in range(self.max_retries):
+            version, state = 0, {}
+            async for key, snapshot in self.storage.scan(f"{self.prefix}{session_id}:s"):
+                version, state = int(key.rsplit(":s", 1)[1]), snapshot["state"]
+            session = _Session(session_id, version, state)
+            gap = False
+            async for key, entry in self.storage.scan(f"{self.prefix}{session_id}:v"):
+                entry_version = int(key.rsplit(":v", 1)[1])
+                if entry_version <= session.version:
+                    continue  # Covered by the snapshot, not pruned yet
+                if entry_version != session.version + 1:
+                    gap = True  # Pruned under us after a newer snapshot was written
+                    break
+                session.state = apply_patch(session.state, entry["patch"])
+                session.version = entry_version
+            if not gap:
+                self._evict()
+                return session
+        raise RuntimeError(f"Could not load session {session_id!r}: its log keeps changing")
+
+    def _evict(self):
+        if len(self._sessions) < self.max_sessions:
+            return
+        for session_id, session in list(self._sessions.items()):
+            if not session.subscribers:
+                del self._sessions[session_id]
+                if len(self._sessions) < self.max_sessions:
+                    return
+
+    async def _catch_up(self, session, batch: int = 16):
+        # Apply diffs other workers wrote after our version
+        async with session.lock:
+            first = session.version
+            while True:
+                keys = [self._key(session.session_id, "v", session.version + i) for i in range(1, batch + 1)]
+                entries = await self.storage.get_many(keys)
+                for key in keys:
+                    if key not in entries:
+                        return session.version > first
+                    self._install(session, session.version + 1, entries[key]["patch"])
+                if len(entries) < batch:
+                    return session.version > first
+
+    async def _reload(self, session):
+        # The log was pruned past a session that fell far behind: start over
+        # from the latest snapshot, keeping the subscribers
+        fresh = await self._load(session.session_id)
+        async with session.lock:
+            if fresh.version > session.version:
+                session.version, session.state = fresh.version, fresh.state
+                for subscription in list(session.subscribers):
+                    subscription._push({"version": session.version, "state": session.state})
+
+    def _resync(self):
+        # Messages sent while the bus was disconnected are lost
+        for session in list(self._sessions.values()):
+            self._spawn(self._catch_up(session))
+
+    def _install(self, session, version, patch, state=None):
+        if version != session.version + 1:
+            return False  # Already applied (or a gap: a catch-up will fill it)
+        session.state = state if state is not None else apply_patch(session.state, patch)
+        session.version = version
+        for subscription in list(session.subscribers):
+            subscription._push({"version": version, "patch": patch})
+        return True
+
+    async def get(self, session_id: str) -> dict:
+        """
+        Current state of a session (empty at version 0 if it never existed).
+
+        With a bus, sessions in the hot tier are kept current by other
+        workers' messages and served from memory; without one, the log is
+        checked for newer versions on every read.
+
+        Returns:
+            {"version": int, "state": dict}; treat the state as read-only
+        """
+        session = await self._session(session_id)
+        if self.bus is None:
+            await self._catch_up(session)
+        return {"version": session.version, "state": session.state}
+
+    async def update(self, session_id: str, patch: list, expected_version: int = None) -> int:
+        """
+        Apply a JSON Patch to a session.
+
+        Args:
+            session_id: Session to change
+            patch: List of RFC 6902 operations (add, remove, replace, test)
+            expected_version: Only apply on top of this version; without it
+                the patch is re-applied to whatever the latest version is
+
+        Returns:
+            The session's new version
+
+        Raises:
+            PatchError: If the patch doesn't apply
+            SessionConflict: If the session is not at expected_version
+        """
+        session = await self._session(session_id)
+        for _ in range(self.max_retries):
+            if expected_version is not None and session.version != expected_version:
+                await self._catch_up(session)
+                if session.version != expected_version:
+                    raise SessionConflict(session_id, expected_version, session.version)
+            base = session.version
+            state = apply_patch(session.state, patch)
+            version = base + 1
+            if await self.storage.add(self._key(session_id, "v", version), {"patch": patch}):
+                if not self._install(session, version, patch, state):
+                    await self._catch_up(session)  # Our diff is in the log; read it back in order
+                self._announce(session_id, version, patch)
+                if version % self.snapshot_every == 0:
+                    self._spawn(self._snapshot(session_id, version, state))
+                return version
+            # Lost the race: rebase on the winner's diffs
+            if not await self._catch_up(session):
+                await self._reload(session)
+        raise SessionConflict(session_id, expected_version, session.version)
+
+    async def subscribe(self, session_id: str, max_queue: int = 256) -> Subscription:
+        """
+        Follow a session's updates (see Subscription).
+
+        Args:
+            session_id: Session to follow
+            max_queue: Updates buffered before the subscriber is resynced
+        """
+        session = await self._session(session_id)
+        await self._catch_up(session)
+        subscription = Subscription(self, session, max_queue)
+        session.subscribers.add(subscription)
+        return subscription
+
+    async def _snapshot(self, session_id, version, state):
+        # Loads start from the newest snapshot. Older snapshots go, and so do
+        # diffs more than a snapshot interval old, which leaves workers that
+        # are slightly behind able to catch up from the log
+        await self.storage.add(self._key(session_id, "s", version), {"state": state})
+        stale = []
+        async for key, _ in self.storage.scan(f"{self.prefix}{session_id}:"):
+            kind, number = key.rsplit(":", 1)[1][0], int(key.rsplit(":", 1)[1][1:])
+            if number < version and (kind == "s" or number <= version - self.snapshot_every):
+                stale.append(key)
+        for key in stale:
+            await self.storage.delete(key)
+
+    def _announce(self, session_id, version, patch):
+        if self.bus is not None:
+            message = json.dumps({"origin": self._origin, "session": session_id, "version": version,
+                                  "patch": patch}, separators=(",", ":"))
+            self._spawn(self.bus.publish(message))
+
+    def _on_message(self, message):
+        try:
+            update = json.loads(message)
+        except ValueError:
+            return
+        if update.get("origin") == self._origin:
+            return
+        session = self._sessions.get(update.get("session"))
+        if session is None:
+            return  # Not hot here; it will be loaded from storage when needed
+        try:
+            if not self._install(session, update["version"], update["patch"]) and update["version"] > session.version:
+                self._spawn(self._catch_up(session))  # Missed a message: read the log
+        except (KeyError, PatchError):
+            self._sessions.pop(session.session_id, None)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Session background task failed: %r", task.exception())
+
+    async def close(self):
+        """Finish snapshots and announcements, and end every subscription."""
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        for session in self._sessions.values():
+            for subscription in list(session.subscribers):
+                subscription.close()
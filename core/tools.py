@@ -0,0 +1,441 @@
+import collections.abc
+import importlib
+import inspect
+import types
+import typing
+from typing import Any, Literal, Union, get_args, get_origin
+
+from .keys import tool_version
+from .resilience import INFRASTRUCTURE_ERRORS, RetryPolicy
+
+_EMPTY = inspect.Parameter.empty
+
+
+class ToolValidationError(ValueError):
+    """Raised when call parameters don't match a tool's signature."""
+
+
+def _fail(path, expected, value):
+    raise ToolValidationError(f"{path}: expected {expected}, got {type(value).__name__}")
+
+
+def _identity(value, path):
+    return value
+
+
+def _coerce_int(value, path):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    _fail(path, "integer", value)
+
+
+def _coerce_float(value, path):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    _fail(path, "number", value)
+
+
+# Annotations a blob reference ({"$blob": ..., "kind": ...}, see data.blobs) may stand in for
+_BLOB_KINDS = {str: "str", bytes: "bytes", bytearray: "bytes", memoryview: "bytes"}
+
+
+def _exact(expected_type, label):
+    blob_kind = _BLOB_KINDS.get(expected_type)
+
+    def check(value, path):
+        if isinstance(value, expected_type):
+            return value
+        if blob_kind is not None and type(value) is dict and value.get("kind") == blob_kind and "$blob" in value:
+            return value  # Resolved when the tool is called
+        _fail(path, label, value)
+    check.exact_type = expected_type
+    return check
+
+
+def _compile_type(annotation):
+    """Return (coercer, json_schema) for a type annotation."""
+    if annotation is _EMPTY or annotation is Any:
+        return _identity, {}
+    if annotation is None or annotation is type(None):
+        return _exact(type(None), "null"), {"type": "null"}
+    if annotation is bool:
+        return _exact(bool, "boolean"), {"type": "boolean"}
+    if annotation is int:
+        return _coerce_int, {"type": "integer"}
+    if annotation is float:
+        return _coerce_float, {"type": "number"}
+    if annotation is str:
+        return _exact(str, "string"), {"type": "string"}
+
+    origin = get_origin(annotation)
+    args = get_args(annotation)
+
+    if origin in (Union, types.UnionType):
+        nullable = type(None) in args
+        compiled = [_compile_type(arg) for arg in args if arg is not type(None)]
+        schemas = [schema for _, schema in compiled] + ([{"type": "null"}] if nullable else [])
+        if len(compiled) == 1:
+            inner = compiled[0][0]
+
+            def optional(value, path):
+                return None if value is None else inner(value, path)
+            return optional, {"anyOf": schemas}
+
+        coercers = [coercer for coercer, _ in compiled]
+        label = " or ".join(str(schema.get("type", "value")) for schema in schemas)
+
+        def union(value, path):
+            if value is None and nullable:
+                return None
+            for coercer in coercers:
+                try:
+                    return coercer(value, path)
+                except ToolValidationError:
+                    continue
+            _fail(path, label, value)
+        return union, {"anyOf": schemas}
+
+    if origin is Literal:
+        def literal(value, path):
+            if value in args:
+                return value
+            raise ToolValidationError(f"{path}: expected one of {sorted(map(repr, args))}, got {value!r}")
+        return literal, {"enum": list(args)}
+
+    if origin is tuple and args and args[-1] is not Ellipsis:
+        # Fixed-length tuple: one type per position
+        positions = [_compile_type(arg) for arg in args]
+        coercers = [coercer for coercer, _ in positions]
+
+        def fixed(value, path):
+            if not isinstance(value, (list, tuple)):
+                _fail(path, "array", value)
+            if len(value) != len(coercers):
+                raise ToolValidationError(f"{path}: expected {len(coercers)} items, got {len(value)}")
+            return tuple(coercer(element, f"{path}[{i}]")
+                         for i, (coercer, element) in enumerate(zip(coercers, value)))
+        return fixed, {"type": "array", "prefixItems": [schema for _, schema in positions],
+                       "minItems": len(args), "maxItems": len(args)}
+
+    # get_origin() of typing.Sequence[...] and typing.Mapping[...] is the collections.abc class
+    if annotation in (list, tuple, set, collections.abc.Sequence) or \
+            origin in (list, tuple, set, collections.abc.Sequence):
+        # list[X], set[X], Sequence[X] and variadic tuple[X, ...]
+        item, item_schema = _compile_type(args[0]) if args else (_identity, {})
+        container = origin or annotation
+        if container is collections.abc.Sequence:
+            container = list
+
+        def sequence(value, path):
+            if not isinstance(value, (list, tuple)):
+                _fail(path, "array", value)
+            if item is _identity:
+                return value if type(value) is container else container(value)
+            return container(item(element, f"{path}[{i}]") for i, element in enumerate(value))
+        schema = {"type": "array"}
+        if item_schema:
+            schema["items"] = item_schema
+        return sequence, schema
+
+    if annotation in (dict, collections.abc.Mapping) or origin in (dict, collections.abc.Mapping):
+        value_coercer, value_schema = _compile_type(args[1]) if len(args) == 2 else (_identity, {})
+
+        def mapping(value, path):
+            if not isinstance(value, dict):
+                _fail(path, "object", value)
+            if value_coercer is _identity:
+                return value
+            return {key: value_coercer(item, f"{path}.{key}") for key, item in value.items()}
+        schema = {"type": "object"}
+        if value_schema:
+            schema["additionalProperties"] = value_schema
+        return mapping, schema
+
+    if isinstance(annotation, type):
+        return _exact(annotation, annotation.__name__), {}
+    return _identity, {}
+
+
+def compile_signature(func):
+    """
+    Introspect a function once and build its validator and JSON schema.
+
+    Args:
+        func: The tool function
+
+    Returns:
+        Tuple of (validate, schema) where validate(params) returns the
+        coerced keyword arguments or raises ToolValidationError
+    """
+    try:
+        hints = typing.get_type_hints(func)
+    except Exception:
+        hints = {}
+    signature = inspect.signature(func)
+
+    fields = []  # (name, coercer, required)
+    properties = {}
+    required = []
+    accepts_extra = False
+    for name, parameter in signature.parameters.items():
+        if parameter.kind is inspect.Parameter.VAR_KEYWORD:
+            accepts_extra = True
+            continue
+        if parameter.kind in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.POSITIONAL_ONLY):
+            continue
+        coercer, schema = _compile_type(hints.get(name, parameter.annotation))
+        if parameter.default is not _EMPTY:
+            schema = dict(schema, default=parameter.default)
+        else:
+            required.append(name)
+        properties[name] = schema
+        fields.append((name, coercer, parameter.default is _EMPTY))
+
+    schema = {"type": "object", "properties": properties, "required": required,
+              "additionalProperties": accepts_extra}
+    return _generate_validator(fields, accepts_extra), schema
+
+
+# Scalar types whose exact-type check is inlined into generated validators
+_FAST_TYPES = {_coerce_int: int, _coerce_float: float}
+
+
+def _generate_validator(fields, accepts_extra):
+    # Emit straight-line Python for this exact signature: no loops over
+    # parameters, no reflection, and an inline type() check before falling
+    # back to the coercer, so well-typed calls stay on the fast path.
+    namespace = {"known": frozenset(name for name, _, _ in fields),
+                 "_unexpected": _unexpected, "_missing": _missing}
+    lines = ["def validate(params):"]
+    if not accepts_extra:
+        lines.append("    if not params.keys() <= known: _unexpected(params, known)")
+        lines.append("    out = {}")
+    else:
+        lines.append("    out = dict(params)")
+    for i, (name, coercer, is_required) in enumerate(fields):
+        fast_type = _FAST_TYPES.get(coercer) or getattr(coercer, "exact_type", None)
+        namespace[f"_c{i}"] = coercer
+        namespace[f"_t{i}"] = fast_type
+        lines.append(f"    if {name!r} in params:")
+        if coercer is _identity:
+            lines.append(f"        out[{name!r}] = params[{name!r}]")
+        else:
+            lines.append(f"        v = params[{name!r}]")
+            if fast_type is not None:
+                lines.append(f"        out[{name!r}] = v if type(v) is _t{i} else _c{i}(v, {name!r})")
+            else:
+                lines.append(f"        out[{name!r}] = _c{i}(v, {name!r})")
+        if is_required:
+            lines.append(f"    else: _missing({name!r})")
+    lines.append("    return out")
+    exec("\n".join(lines), namespace)
+    return namespace["validate"]
+
+
+def _unexpected(params, known):
+    name = next(name for name in params if name not in known)
+    raise ToolValidationError(f"{name}: unexpected parameter")
+
+
+def _missing(name):
+    raise ToolValidationError(f"{name}: missing required parameter")
+
+
+class ToolSpec:
+    """
+    A registered tool with everything the hot path needs precomputed:
+    dispatch flags, cache version, argument validator and JSON schema.
+    """
+
+    __slots__ = ("name", "description", "function", "is_async", "streaming", "cpu_bound",
+                 "max_concurrency", "conflicts", "circuit_breaker", "failure_on", "retry", "hedge", "equivalent",
+                 "invalidates", "cache", "cache_stream", "semantic_threshold", "cache_version", "validate", "schema")
+
+    def __init__(self, function, name: str = None, description: str = None, cpu_bound: bool = False,
+                 max_concurrency: Union[int, str] = None, version: str = None, cache_stream: bool = False,
+                 semantic_threshold: float = None, conflicts=(), circuit_breaker: bool = True,
+                 failure_on=INFRASTRUCTURE_ERRORS, retry=None, hedge: bool = False, equivalent: str = None,
+                 invalidates=(), cache: bool = True):
+        """
+        Compile a tool specification from a function.
+
+        Args:
+            function: The tool function
+            name: Tool name (defaults to the function name)
+            description: Tool description (defaults to the docstring)
+            cpu_bound: Run the tool in the process pool
+            max_concurrency: Optional cap on concurrent calls, or "adaptive" for
+                a cap that follows the tool's latency
+            version: Optional version string mixed into cache keys
+            cache_stream: Cache a streaming tool's chunks
+            semantic_threshold: Reuse results of calls whose string arguments
+                are at least this similar (cosine, 0-1); None for exact only
+            conflicts: Names of groups whose tools never run at the same time
+            circuit_breaker: Fail calls fast while the tool's error rate is high
+            failure_on: Exception types the circuit breaker counts as failures
+            retry: Optional core.resilience.RetryPolicy, or a number of attempts
+            hedge: Start a second attempt when the first runs past the tool's
+                p95 latency (only for idempotent tools)
+            equivalent: Optional name of a group of interchangeable tools
+                (same parameters, same results) the plan optimizer picks from
+            invalidates: Ids of resources the tool changes; their cached
+                contents are dropped after every successful call
+            cache: Cache results; False for tools with side effects, which
+                must run on every call
+        """
+        if isinstance(max_concurrency, str) and max_concurrency != "adaptive":
+            raise ValueError(f"max_concurrency must be an int or 'adaptive', got {max_concurrency!r}")
+        self.name = name or function.__name__
+        self.description = description or function.__doc__
+        self.function = function
+        self.is_async = inspect.iscoroutinefunction(function) or inspect.isasyncgenfunction(function)
+        self.streaming = inspect.isgeneratorfunction(function) or inspect.isasyncgenfunction(function)
+        self.cpu_bound = cpu_bound
+        self.max_concurrency = max_concurrency
+        self.conflicts = tuple(sorted(set(conflicts)))  # Sorted: locks are always taken in order
+        self.circuit_breaker = circuit_breaker
+        self.failure_on = tuple(failure_on)
+        self.retry = RetryPolicy(attempts=retry) if isinstance(retry, int) else retry
+        self.hedge = hedge
+        self.equivalent = equivalent
+        self.invalidates = tuple(invalidates)
+        self.cache = cache
+        self.cache_stream = cache_stream and cache
+        self.semantic_threshold = semantic_threshold
+        self.cache_version = tool_version(function, version)
+        self.validate, self.schema = compile_signature(function)
+
+    def invoke(self, params):
+        """Validate params and call the function (returns a coroutine for async tools)."""
+        return self.function(**self.validate(params))
+
+    def describe(self):
+        """Public description of the tool for listings and documentation."""
+        return {"name": self.name, "description": self.description,
+                "streaming": self.streaming, "parameters": self.schema}
+
+    def __repr__(self):
+        return f"ToolSpec(name={self.name!r})"
+
+
+class LazyTool:
+    """
+    A declared tool whose module has not been imported yet.
+
+    Holds the import path and ToolSpec options; ToolRegistry swaps it for
+    the real ToolSpec the first time the tool is looked up.
+    """
+
+    __slots__ = ("name", "target", "options")
+
+    def __init__(self, name: str, target: str, options: dict):
+        module, _, attribute = target.partition(":")
+        if not module or not attribute:
+            raise ValueError(f"Tool target must look like 'package.module:function', got {target!r}")
+        self.name = name
+        self.target = target
+        self.options = options
+
+    @property
+    def equivalent(self):
+        return self.options.get("equivalent")  # Read by the plan optimizer without loading
+
+    def load(self):
+        """Import the function and build its ToolSpec."""
+        module, _, attribute = self.target.partition(":")
+        function = importlib.import_module(module)
+        for part in attribute.split("."):
+            function = getattr(function, part)
+        return ToolSpec(function, name=self.name, **self.options)
+
+    def __repr__(self):
+        return f"LazyTool(name={self.name!r}, target={self.target!r})"
+
+
+class ToolRegistry(dict):
+    """
+    Name -> ToolSpec mapping that counts its changes.
+
+    ``version`` goes up on every registration, replacement or removal, so
+    caches derived from the registry (such as compiled plans) can tell when
+    they are stale without comparing contents.
+
+    Tools can also be declared by import path (see declare); their modules
+    are only imported when the tool is first looked up, through indexing,
+    get, values or items. Copying the dict directly copies the placeholders.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def declare(self, name: str, target: str, **options):
+        """
+        Register a tool without importing it.
+
+        Args:
+            name: Tool name
+            target: Import path of the function, "package.module:function"
+            options: ToolSpec options (cpu_bound, version, retry, ...)
+        """
+        self[name] = LazyTool(name, target, options)
+
+    def _load(self, name, tool):
+        if isinstance(tool, LazyTool):
+            tool = tool.load()
+            super().__setitem__(name, tool)  # The same tool, so the version stays
+        return tool
+
+    def __getitem__(self, name):
+        return self._load(name, super().__getitem__(name))
+
+    def get(self, name, default=None):
+        tool = super().get(name, default)
+        return self._load(name, tool) if tool is not default else tool
+
+    def peek(self, name, default=None):
+        """The ToolSpec, or the LazyTool of a declared tool not loaded yet."""
+        return super().get(name, default)
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+    def __setitem__(self, name, tool):
+        super().__setitem__(name, tool)
+        self.version += 1
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self.version += 1
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self.version += 1
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self.version += 1
+        return result
+
+    def setdefault(self, name, tool=None):
+        if name not in self:
+            self.version += 1
+        return super().setdefault(name, tool)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.version += 1
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        super().clear()
+        self.version += 1
@@ -0,0 +1,141 @@
+from monitoring.metrics import Histogram
+
+
+def _blend(average, value, count, alpha):
+    # Exponentially weighted average that is an exact mean for the first
+    # 1/alpha samples, so a handful of calls isn't dominated by a prior
+    return value if count == 1 else average + (value - average) * max(alpha, 1 / count)
+
+
+class ToolStats:
+    """Decaying statistics of one tool's calls."""
+
+    __slots__ = ("lookups", "hits", "calls", "hit_rate", "hit_latency", "latency", "failure_rate",
+                 "result_size", "histogram", "version", "basis")
+
+    def __init__(self):
+        self.lookups = 0  # Cache lookups
+        self.hits = 0  # Timed lookups answered without running the tool
+        self.calls = 0  # Executions (cache misses)
+        self.hit_rate = 0.0
+        self.hit_latency = 0.0  # Seconds for a call answered from the cache
+        self.latency = 0.0  # Seconds for an execution, retries included
+        self.failure_rate = 0.0
+        self.result_size = 0.0  # Bytes (shallow sys.getsizeof of results)
+        self.histogram = Histogram()  # Execution latencies, for quantiles
+        self.version = 0  # Bumped when the expected cost or hit rate moves materially
+        self.basis = None  # (expected cost, hit rate) as of the last bump
+
+    def as_dict(self):
+        return {"lookups": self.lookups, "calls": self.calls, "hit_rate": self.hit_rate,
+                "hit_latency": self.hit_latency, "latency": self.latency,
+                "p95": self.histogram.quantile(0.95) if self.calls else None,
+                "failure_rate": self.failure_rate, "result_size": self.result_size}
+
+
+class ToolStatistics:
+    """
+    Per-tool cost model fed by the engine: cache hit probability, latency of
+    hits and executions, failure rate and result size, all exponentially
+    weighted so they follow a tool whose behaviour changes.
+
+    A tool's ``version(name)`` goes up only when its expected cost moves by
+    more than ``tolerance`` (relative) or its hit rate by more than
+    ``tolerance`` (absolute) since the last bump, so plans optimized against
+    it are recompiled when their choices may change, not on every sample.
+    """
+
+    def __init__(self, alpha: float = 0.05, default_latency: float = 0.05, tolerance: float = 0.2):
+        """
+        Initialize the statistics.
+
+        Args:
+            alpha: Weight of each new observation in the averages
+            default_latency: Expected seconds per call of a tool never seen
+            tolerance: Change of a tool's expected cost (relative) or hit rate
+                (absolute) that bumps its version
+        """
+        self.alpha = alpha
+        self.default_latency = default_latency
+        self.tolerance = tolerance
+        self._tools = {}
+
+    def _stats(self, tool_name):
+        stats = self._tools.get(tool_name)
+        if stats is None:
+            stats = self._tools[tool_name] = ToolStats()
+            stats.basis = (self.default_latency, 0.0)  # What plans assumed before it was seen
+        return stats
+
+    def _settle(self, stats):
+        cost, hit_rate = self._cost(stats), stats.hit_rate
+        basis_cost, basis_hit_rate = stats.basis
+        if abs(cost - basis_cost) > self.tolerance * basis_cost or abs(hit_rate - basis_hit_rate) > self.tolerance:
+            stats.basis = (cost, hit_rate)
+            stats.version += 1
+
+    def observe_lookup(self, tool_name: str, hit: bool, latency: float = None):
+        """
+        Record a cache lookup.
+
+        Args:
+            tool_name: Tool looked up
+            hit: Whether the result came from the cache
+            latency: Seconds the call took, if known (only used for hits)
+        """
+        stats = self._stats(tool_name)
+        stats.lookups += 1
+        stats.hit_rate = _blend(stats.hit_rate, float(hit), stats.lookups, self.alpha)
+        if hit and latency is not None:
+            stats.hits += 1
+            stats.hit_latency = _blend(stats.hit_latency, latency, stats.hits, self.alpha)
+        self._settle(stats)
+
+    def observe_call(self, tool_name: str, latency: float, failed: bool = False, result_size: int = None):
+        """
+        Record an execution of a tool.
+
+        Args:
+            tool_name: Tool executed
+            latency: Seconds it took
+            failed: Whether it raised
+            result_size: Size of its result in bytes, if it returned one
+        """
+        stats = self._stats(tool_name)
+        stats.calls += 1
+        stats.latency = _blend(stats.latency, latency, stats.calls, self.alpha)
+        stats.failure_rate = _blend(stats.failure_rate, float(failed), stats.calls, self.alpha)
+        stats.histogram.observe(latency)
+        if result_size is not None:
+            stats.result_size = _blend(stats.result_size, result_size, stats.calls, self.alpha)
+        self._settle(stats)
+
+    def get(self, tool_name: str):
+        """The tool's ToolStats, or None if it was never observed."""
+        return self._tools.get(tool_name)
+
+    def version(self, tool_name: str) -> int:
+        """Counter that changes whenever the tool's costs change materially."""
+        stats = self._tools.get(tool_name)
+        return stats.version if stats is not None else 0
+
+    def _latency(self, stats):
+        latency = stats.latency if stats.calls else self.default_latency
+        return stats.hit_rate * stats.hit_latency + (1 - stats.hit_rate) * latency
+
+    def _cost(self, stats):
+        return self._latency(stats) / max(0.01, 1 - stats.failure_rate)
+
+    def expected_latency(self, tool_name: str) -> float:
+        """Expected seconds for one call, weighing cache hits against executions."""
+        stats = self._tools.get(tool_name)
+        return self._latency(stats) if stats is not None else self.default_latency
+
+    def expected_cost(self, tool_name: str) -> float:
+        """Expected seconds until a call succeeds, counting failed calls as retried."""
+        stats = self._tools.get(tool_name)
+        return self._cost(stats) if stats is not None else self.default_latency
+
+    def snapshot(self) -> dict:
+        """{tool name: statistics dict} for inspection and offline replay."""
+        return {name: stats.as_dict() for name, stats in self._tools.items()}
@@ -0,0 +1,227 @@
+import asyncio
+import bisect
+import json
+import re
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Protocol, Tuple, runtime_checkable
+
+from .storage import DataStorage
+
+
+@runtime_checkable
+class AsyncStorage(Protocol):
+    """
+    Async key-value storage for use on the event loop.
+
+    Bulk operations are one round trip to the backend, so reading or writing
+    many keys costs about as much as one.
+    """
+
+    shared: bool  # Whether every worker process sees the same data, with add atomic across them
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Return the value stored under key, or None."""
+
+    async def put(self, key: str, value: Any) -> None:
+        """Store value under key."""
+
+    async def add(self, key: str, value: Any) -> bool:
+        """Store value under key unless it exists, atomically; returns whether it was stored."""
+
+    async def delete(self, key: str) -> bool:
+        """Remove key; returns False if it wasn't present."""
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Return {key: value} for the keys that are present."""
+
+    async def put_many(self, items: Dict[str, Any]) -> None:
+        """Store every key/value pair."""
+
+    def scan(self, prefix: str = "") -> AsyncIterator[Tuple[str, Any]]:
+        """Iterate (key, value) pairs whose key starts with prefix, in key order."""
+
+    async def close(self) -> None:
+        """Release connections and files."""
+
+
+class MemoryStorage:
+    """
+    AsyncStorage in this process's memory, for single-worker apps and tests.
+
+    Values are kept JSON-encoded, so callers get copies and the same values
+    round-trip as through the file and MongoDB backends. Nothing is shared
+    with other workers or survives a restart.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self._values = {}  # key -> JSON text
+        self._keys = []  # Sorted, for prefix scans
+
+    async def get(self, key):
+        text = self._values.get(key)
+        return None if text is None else json.loads(text)
+
+    async def put(self, key, value):
+        if key not in self._values:
+            bisect.insort(self._keys, key)
+        self._values[key] = json.dumps(value, separators=(",", ":"))
+
+    async def add(self, key, value):
+        if key in self._values:
+            return False  # Check and store never await, so this is atomic
+        await self.put(key, value)
+        return True
+
+    async def delete(self, key):
+        if self._values.pop(key, None) is None:
+            return False
+        del self._keys[bisect.bisect_left(self._keys, key)]
+        return True
+
+    async def get_many(self, keys):
+        return {key: json.loads(self._values[key]) for key in keys if key in self._values}
+
+    async def put_many(self, items):
+        for key, value in items.items():
+            await self.put(key, value)
+
+    async def scan(self, prefix=""):
+        index = bisect.bisect_left(self._keys, prefix)
+        while index < len(self._keys) and self._keys[index].startswith(prefix):
+            key = self._keys[index]
+            yield key, json.loads(self._values[key])
+            # Keys may be added or deleted while the caller awaits
+            index = bisect.bisect_right(self._keys, key)
+
+    async def close(self):
+        pass
+
+
+class ThreadedStorage:
+    """
+    AsyncStorage over a blocking DataStorage.
+
+    Every call runs in a worker thread so disk I/O and fsync never stall the
+    event loop; bulk calls make a single thread hop. The store's directory
+    is opened by one process at a time, so it isn't shared between workers.
+    """
+
+    shared = False
+
+    def __init__(self, storage: DataStorage = None, scan_batch: int = 500):
+        """
+        Initialize the wrapper.
+
+        Args:
+            storage: The DataStorage to wrap (defaults to DataStorage())
+            scan_batch: Values loaded per thread hop while scanning
+        """
+        self.storage = storage if storage is not None else DataStorage()
+        self.scan_batch = scan_batch
+
+    async def get(self, key):
+        return await asyncio.to_thread(self.storage.load, key)
+
+    async def put(self, key, value):
+        await asyncio.to_thread(self.storage.save, key, value)
+
+    async def add(self, key, value):
+        return await asyncio.to_thread(self.storage.add, key, value)
+
+    async def delete(self, key):
+        return await asyncio.to_thread(self.storage.delete, key)
+
+    async def get_many(self, keys):
+        return await asyncio.to_thread(self.storage.load_many, list(keys))
+
+    async def put_many(self, items):
+        await asyncio.to_thread(self.storage.save_many, dict(items))
+
+    async def scan(self, prefix=""):
+        keys = await asyncio.to_thread(
+            lambda: sorted(key for key in self.storage.list_keys() if key.startswith(prefix)))
+        for start in range(0, len(keys), self.scan_batch):
+            batch = keys[start:start + self.scan_batch]
+            values = await self.get_many(batch)
+            for key in batch:
+                if key in values:  # Deleted since the key listing
+                    yield key, values[key]
+
+    async def close(self):
+        await asyncio.to_thread(self.storage.close)
+
+
+class MongoStorage:
+    """
+    AsyncStorage backed by MongoDB through motor's pooled async client.
+
+    Each key is one document ``{"_id": key, "value": value}``. get_many is a
+    single ``$in`` query, put_many a single unordered bulk write, and scan an
+    anchored ``_id`` regex, which MongoDB serves from the _id index.
+    """
+
+    shared = True
+
+    def __init__(self, uri: str = "mongodb://localhost:27017", database: str = "lightningmcp",
+                 collection: str = "storage", max_pool_size: int = 100, scan_batch: int = 500,
+                 client=None):
+        """
+        Initialize the backend.
+
+        Args:
+            uri: MongoDB connection string
+            database: Database name
+            collection: Collection name
+            max_pool_size: Max connections in the client's pool
+            scan_batch: Documents fetched per round trip while scanning
+            client: Optional pre-built client with motor's interface (e.g. a test double)
+        """
+        if client is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            client = AsyncIOMotorClient(uri, maxPoolSize=max_pool_size)
+        self.client = client
+        self.collection = client[database][collection]
+        self.scan_batch = scan_batch
+
+    async def get(self, key):
+        document = await self.collection.find_one({"_id": key})
+        return None if document is None else document["value"]
+
+    async def put(self, key, value):
+        await self.collection.replace_one({"_id": key}, {"_id": key, "value": value}, upsert=True)
+
+    async def add(self, key, value):
+        from pymongo.errors import DuplicateKeyError
+        try:
+            await self.collection.insert_one({"_id": key, "value": value})
+        except DuplicateKeyError:
+            return False  # The unique _id index makes this a server-side CAS
+        return True
+
+    async def delete(self, key):
+        result = await self.collection.delete_one({"_id": key})
+        return result.deleted_count > 0
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        cursor = self.collection.find({"_id": {"$in": keys}})
+        return {document["_id"]: document["value"] async for document in cursor}
+
+    async def put_many(self, items):
+        if not items:
+            return
+        from pymongo import ReplaceOne
+        await self.collection.bulk_write(
+            [ReplaceOne({"_id": key}, {"_id": key, "value": value}, upsert=True) for key, value in items.items()],
+            ordered=False)
+
+    async def scan(self, prefix=""):
+        cursor = self.collection.find({"_id": {"$regex": f"^{re.escape(prefix)}"}})
+        async for document in cursor.sort("_id", 1).batch_size(self.scan_batch):
+            yield document["_id"], document["value"]
+
+    async def close(self):
+        self.client.close()
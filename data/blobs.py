@@ -0,0 +1,263 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Kinds of payload a reference can stand for, and the Python types they come from
+_KINDS = {bytes: "bytes", bytearray: "bytes", memoryview: "bytes", str: "str"}
+_INCOMING = ".incoming-"  # Prefix of blobs being written
+
+
+class MissingBlobError(KeyError):
+    """Raised when a referenced blob isn't stored (never uploaded, or pruned)."""
+
+    def __init__(self, digest):
+        super().__init__(digest)
+        self.digest = digest
+
+    def __str__(self):
+        return f"Blob {self.digest!r} is not stored (it may have expired); upload it again"
+
+
+def blob_ref(digest: str, size: int, kind: str = "bytes") -> dict:
+    """A reference to a stored blob; plain JSON, so it travels through plans, caches and responses."""
+    return {"$blob": digest, "size": size, "kind": kind}
+
+
+def is_blob_ref(value) -> bool:
+    return isinstance(value, dict) and "$blob" in value
+
+
+def default_directory() -> str:
+    """tmpfs (shared memory) when the platform has one, else the temp directory."""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"lightningmcp-blobs-{os.getuid() if hasattr(os, 'getuid') else 0}")
+
+
+class BlobStore:
+    """
+    Content-addressed store for large payloads.
+
+    A blob is written once, under the digest of its contents, to a directory
+    that every worker and pool process on the machine shares (tmpfs by
+    default, so it lives in shared memory). Values at least ``threshold``
+    bytes are swapped for small references (see externalize), so plans,
+    cache entries and results carry the reference instead of the payload.
+    Readers get a memoryview of a read-only memory map: the pages are
+    shared with every other process that maps the same blob, and nothing is
+    copied. Text blobs decode to str, which copies once.
+
+    Blobs not written or read for ``max_age`` seconds are pruned every
+    ``prune_every`` writes (reads refresh a blob's age at most every
+    ``max_age / 10`` seconds per process, so a blob in use is never pruned).
+    """
+
+    _attached = {}  # directory -> BlobStore, for pool processes (see attach)
+
+    def __init__(self, directory: str = None, threshold: int = 64 * 1024, max_open: int = 128,
+                 max_age: float = 24 * 3600, prune_every: int = 1000, max_blob_bytes: int = 256 * 1024 * 1024):
+        """
+        Initialize the store.
+
+        Args:
+            directory: Where blobs are kept (default: see default_directory)
+            threshold: Payloads at least this many bytes are stored as blobs
+            max_open: Memory maps kept open for reuse
+            max_age: Seconds an unused blob is kept
+            prune_every: Writes between prunes (None to never prune)
+            max_blob_bytes: Largest payload accepted by PUT /blobs
+        """
+        self.directory = directory or default_directory()
+        self.threshold = threshold
+        self.max_open = max_open
+        self.max_age = max_age
+        self.prune_every = prune_every
+        self.max_blob_bytes = max_blob_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._maps = OrderedDict()  # digest -> [mmap, time its age was last refreshed]
+        self._lock = threading.Lock()  # Tools in the thread pool read blobs too
+        self._writes = 0
+
+    @classmethod
+    def attach(cls, directory: str, threshold: int):
+        """The process's store for directory, created on first use (used in pool workers)."""
+        store = cls._attached.get(directory)
+        if store is None:
+            store = cls._attached[directory] = cls(directory, threshold, prune_every=None)
+        return store
+
+    def _path(self, digest):
+        if len(digest) != 32 or not all(c in "0123456789abcdef" for c in digest):
+            raise ValueError(f"Invalid blob digest {digest!r}")
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, data) -> dict:
+        """
+        Store a payload (bytes-like or str) and return its reference.
+
+        Writing a payload that is already stored only refreshes its age.
+        """
+        kind = _KINDS.get(type(data))
+        if kind is None:
+            raise TypeError(f"Cannot store {type(data).__name__} as a blob")
+        if kind == "str":
+            data = data.encode("utf-8")
+        view = memoryview(data).cast("B")
+        digest = hashlib.blake2b(view, digest_size=16).hexdigest()
+        path = self._path(digest)
+        try:
+            os.utime(path)  # Already stored (by us or another process)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temporary = tempfile.mkstemp(dir=self.directory, prefix=_INCOMING)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(view)
+                os.chmod(temporary, 0o444)
+                os.replace(temporary, path)  # Atomic: readers never see a partial blob
+            except BaseException:
+                os.unlink(temporary)
+                raise
+            self._writes += 1
+            if self.prune_every and self._writes % self.prune_every == 0:
+                self.prune()
+        return blob_ref(digest, view.nbytes, kind)
+
+    def get(self, ref) -> memoryview:
+        """
+        Read-only view of a blob's bytes.
+
+        Args:
+            ref: A blob reference, or its digest
+
+        Raises:
+            MissingBlobError: If the blob isn't stored (e.g. pruned)
+        """
+        digest = ref["$blob"] if isinstance(ref, dict) else ref
+        path = self._path(digest)
+        now = time.time()
+        with self._lock:
+            entry = self._maps.get(digest)
+            if entry is not None:
+                self._maps.move_to_end(digest)
+                if now - entry[1] > self.max_age / 10:
+                    entry[1] = now
+                    self._touch(path)
+                return memoryview(entry[0])
+            try:
+                with open(path, "rb") as f:
+                    if os.fstat(f.fileno()).st_size == 0:
+                        mapped = b""
+                    else:
+                        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                raise MissingBlobError(digest) from None
+            self._touch(path)
+            if mapped:
+                self._maps[digest] = [mapped, now]
+                if len(self._maps) > self.max_open:
+                    # Views still in use keep their map alive; it unmaps once they're gone
+                    self._maps.popitem(last=False)
+            return memoryview(mapped)
+
+    @staticmethod
+    def _touch(path):
+        # Refresh the blob's age so prune keeps it while it is being read
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # Pruned meanwhile (the map stays valid), or not ours to touch
+
+    def __contains__(self, ref):
+        digest = ref["$blob"] if isinstance(ref, dict) else ref
+        return os.path.exists(self._path(digest))
+
+    def externalize(self, value):
+        """
+        Replace large payloads in a value with blob references.
+
+        Dicts and lists are walked; containers without large payloads are
+        returned as they are, so small values cost nothing but the walk.
+        """
+        kind = _KINDS.get(type(value))
+        if kind is not None:
+            size = len(value) if kind == "str" else memoryview(value).nbytes
+            # A str takes at least len() bytes encoded, so this never under-counts
+            return self.put(value) if size >= self.threshold else value
+        if isinstance(value, dict):
+            if "$blob" in value:
+                return value
+            changed = None
+            for key, item in value.items():
+                new = self.externalize(item)
+                if new is not item:
+                    if changed is None:
+                        changed = dict(value)
+                    changed[key] = new
+            return value if changed is None else changed
+        if isinstance(value, list):
+            items = [self.externalize(item) for item in value]
+            return value if all(new is old for new, old in zip(items, value)) else items
+        return value
+
+    def resolve(self, value):
+        """
+        Replace blob references in a value with their contents: a memoryview
+        for bytes, a str for text. Values without references are returned
+        as they are.
+        """
+        if isinstance(value, dict):
+            if "$blob" in value:
+                view = self.get(value)
+                return str(view, "utf-8") if value.get("kind") == "str" else view
+            changed = None
+            for key, item in value.items():
+                new = self.resolve(item)
+                if new is not item:
+                    if changed is None:
+                        changed = dict(value)
+                    changed[key] = new
+            return value if changed is None else changed
+        if isinstance(value, list):
+            items = [self.resolve(item) for item in value]
+            return value if all(new is old for new, old in zip(items, value)) else items
+        return value
+
+    def prune(self, max_age: float = None) -> int:
+        """
+        Delete blobs not written or read for max_age seconds (default: the
+        store's), and files left behind by writers that died mid-write.
+
+        Processes that still map a pruned blob keep reading it; new readers
+        get MissingBlobError.
+
+        Returns:
+            Number of blobs deleted
+        """
+        cutoff = time.time() - (self.max_age if max_age is None else max_age)
+        removed = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(_INCOMING):
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass  # Renamed into place or cleaned up meanwhile
+                continue
+            if not entry.is_dir():
+                continue
+            for blob in os.scandir(entry.path):
+                try:
+                    if blob.stat().st_mtime < cutoff:
+                        os.unlink(blob.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass  # Pruned by another process
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._maps.clear()
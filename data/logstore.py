@@ -0,0 +1,608 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import weakref
+import zlib
+
+# Log record: <u32 crc><u8 flags><u32 key length><u32 value length><key><value>
+# The CRC covers everything after itself, so a torn write at the tail of the
+# active segment is detected and cut off on startup.
+_RECORD = struct.Struct("<IBII")
+# Hint file: magic, then entries of
+#   <u8 flags><u32 key length><u64 value offset><u64 value length><key>
+# Hints without the magic (32-bit offsets) are rebuilt from their log.
+_HINT_MAGIC = b"LMHINT2\n"
+_HINT = struct.Struct("<BIQQ")
+
+_LOCK_FILE = "LOCK"
+
+_PUT = 0
+_DELETE = 1
+_MERGED = 2  # First record of a compacted segment; the value is the lowest id it replaces
+
+
+class StoreLockedError(RuntimeError):
+    """Raised when a store's directory is already open in another LogStore."""
+
+
+def _lock_directory(directory):
+    # The index lives in memory, so two stores (e.g. two workers) appending
+    # to one directory would corrupt each other: only one may open it
+    fd = os.open(os.path.join(directory, _LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        raise StoreLockedError(f"{directory!r} is already open in another LogStore (one process per "
+                               f"directory; share it through MongoDB instead)") from None
+    return fd
+
+
+def _encode_record(flags, key, value):
+    body = _RECORD.pack(0, flags, len(key), len(value))[4:] + key + value
+    return struct.pack("<I", zlib.crc32(body)) + body
+
+
+class Segment:
+    """
+    One append-only log file.
+
+    The active segment is written with os.write (no user-space buffer, so
+    appended records are immediately readable with pread). Once sealed, it
+    is immutable and read through a memory map.
+
+    A segment replaced by compaction is never closed explicitly: readers
+    that looked up a location before the swap may still read it, so its
+    descriptor and map are released when the last reference goes away.
+    """
+
+    def __init__(self, directory, segment_id, writable=False):
+        self.id = segment_id
+        self.first = segment_id  # Lowest id this segment replaces (compacted segments replace a run)
+        self.path = os.path.join(directory, f"{segment_id:010d}.log")
+        self.hint_path = os.path.join(directory, f"{segment_id:010d}.hint")
+        self._write_fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644) if writable else None
+        self._read_fd = os.open(self.path, os.O_RDONLY)
+        self._close_read_fd = weakref.finalize(self, os.close, self._read_fd)
+        self.size = os.fstat(self._read_fd).st_size
+        self.dead = 0  # Bytes of overwritten or deleted values
+        self._map = None
+        if not writable:
+            self._mmap()
+
+    def _mmap(self):
+        if self.size:
+            self._map = mmap.mmap(self._read_fd, 0, access=mmap.ACCESS_READ)
+
+    def append(self, data):
+        offset = self.size
+        view = memoryview(data)
+        while view:
+            written = os.write(self._write_fd, view)
+            view = view[written:]
+        self.size += len(data)
+        return offset
+
+    def read(self, offset, length):
+        data = self._map
+        if data is not None:
+            return data[offset:offset + length]
+        return os.pread(self._read_fd, length, offset)
+
+    def truncate(self, size):
+        os.ftruncate(self._write_fd, size)
+        self.size = size
+
+    def sync(self):
+        if self._write_fd is not None:
+            os.fsync(self._write_fd)
+
+    def seal(self):
+        """Stop accepting writes and switch reads to a memory map (sync first)."""
+        if self._write_fd is not None:
+            os.close(self._write_fd)
+            self._write_fd = None
+        self._mmap()
+
+    def close(self):
+        if self._write_fd is not None:
+            os.fsync(self._write_fd)
+            os.close(self._write_fd)
+            self._write_fd = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._close_read_fd()
+
+    def scan(self):
+        """
+        Read the log from disk.
+
+        Returns:
+            Tuple of (entries, end) where entries are (flags, key,
+            value_offset, value_length) for every valid record and end is
+            the offset where valid data stops
+        """
+        with open(self.path, "rb") as handle:
+            data = handle.read()
+        entries = []
+        offset = 0
+        while offset + _RECORD.size <= len(data):
+            crc, flags, key_length, value_length = _RECORD.unpack_from(data, offset)
+            end = offset + _RECORD.size + key_length + value_length
+            if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc:
+                break
+            key = data[offset + _RECORD.size:offset + _RECORD.size + key_length]
+            entries.append((flags, key, offset + _RECORD.size + key_length, value_length))
+            offset = end
+        return entries, offset
+
+
+def _merged_from(path):
+    # Lowest segment id a compacted segment replaces, or None
+    with open(path, "rb") as handle:
+        header = handle.read(_RECORD.size)
+        if len(header) < _RECORD.size:
+            return None
+        _, flags, key_length, value_length = _RECORD.unpack(header)
+        if flags != _MERGED:
+            return None
+        handle.seek(key_length, os.SEEK_CUR)
+        return int(handle.read(value_length))
+
+
+def _record_size(key, value_length):
+    return _RECORD.size + len(key) + value_length
+
+
+def _read_hint(path):
+    # [(flags, key, value offset, value length)], or None if missing or in the old format
+    try:
+        with open(path, "rb") as handle:
+            data = handle.read()
+    except FileNotFoundError:
+        return None
+    if not data.startswith(_HINT_MAGIC):
+        return None
+    entries = []
+    offset = len(_HINT_MAGIC)
+    while offset < len(data):
+        flags, key_length, value_offset, value_length = _HINT.unpack_from(data, offset)
+        offset += _HINT.size
+        entries.append((flags, data[offset:offset + key_length], value_offset, value_length))
+        offset += key_length
+    return entries
+
+
+class LogStore:
+    """
+    Log-structured key-value store (Bitcask-style).
+
+    Every write appends a checksummed record to the active segment file and
+    updates an in-memory hash index of key -> (segment, offset, length), so
+    a read is one dict lookup plus one mmap slice or pread. Sealed segments
+    get a hint file holding just their index entries, which makes startup
+    proportional to the number of keys rather than the size of the data.
+    Sealing (fsync, hint file) runs on a background thread, so writers only
+    wait for the switch to a new active segment.
+    Background compaction rewrites a bounded run of sealed segments with
+    only their live records (see compact), so the work per compaction
+    doesn't grow with the size of the store.
+
+    With ``sync`` on, writes return once their record is fsynced; concurrent
+    writers share one fsync (group commit).
+
+    A directory belongs to one LogStore at a time: opening it again, from
+    this or another process, raises StoreLockedError until it is closed.
+    """
+
+    def __init__(self, directory: str, sync: bool = True, max_segment_size: int = 64 << 20,
+                 compact_ratio: float = 0.5, min_compact_segments: int = 2, max_compact_bytes: int = None):
+        """
+        Open (or create) a store.
+
+        Args:
+            directory: Directory holding the segment files
+            sync: fsync before a write returns
+            max_segment_size: Size at which the active segment is sealed
+            compact_ratio: Fraction of dead bytes in a run of sealed segments
+                that makes it worth compacting
+            min_compact_segments: Sealed segments needed before compacting
+            max_compact_bytes: Most bytes one compaction reads (default: four
+                segments)
+        """
+        self.directory = directory
+        self.sync = sync
+        self.max_segment_size = max_segment_size
+        self.compact_ratio = compact_ratio
+        self.min_compact_segments = min_compact_segments
+        self.max_compact_bytes = max_compact_bytes or 4 * max_segment_size
+        os.makedirs(directory, exist_ok=True)
+        lock_fd = _lock_directory(directory)
+        self._unlock = weakref.finalize(self, os.close, lock_fd)  # Also if never closed
+
+        self._index = {}
+        self._sealed = []
+        self._sealing = []  # Full segments waiting for their fsync and hint file
+        self._lock = threading.Lock()
+        self._sync = threading.Condition(threading.Lock())
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+        self._compact_lock = threading.Lock()
+        self._compactor = None
+        self._closed = False
+        try:
+            self._open()
+        except BaseException:
+            self._unlock()
+            raise
+
+    def _segment_ids(self):
+        ids = []
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext == ".log" and stem.isdigit():
+                ids.append(int(stem))
+            elif ext == ".tmp":
+                os.remove(os.path.join(self.directory, name))  # Interrupted compaction or hint write
+        return sorted(ids)
+
+    def _open(self):
+        ids = self._segment_ids()
+        # A compaction that crashed before deleting its inputs leaves them
+        # behind; the compacted segment says which ones it replaced.
+        covered = set()
+        firsts = {}
+        for segment_id in ids:
+            first = _merged_from(os.path.join(self.directory, f"{segment_id:010d}.log"))
+            if first is not None:
+                firsts[segment_id] = first
+                covered.update(i for i in ids if first <= i < segment_id)
+        for segment_id in covered:
+            self._remove_files(segment_id)
+        ids = [i for i in ids if i not in covered]
+
+        for segment_id in ids[:-1]:
+            segment = Segment(self.directory, segment_id)
+            segment.first = firsts.get(segment_id, segment_id)
+            if not self._load_hint(segment):
+                self._load_log(segment)
+                self._write_hint(segment)
+            self._sealed.append(segment)
+
+        self._active = Segment(self.directory, ids[-1] if ids else 0, writable=True)
+        valid_end = self._load_log(self._active)
+        if valid_end < self._active.size:
+            self._active.truncate(valid_end)  # Drop a torn tail
+
+    def _apply(self, segment, flags, encoded_key, value_offset, value_length):
+        if flags == _MERGED:
+            return
+        key = encoded_key.decode()
+        old = self._index.pop(key, None)
+        if old is not None:
+            old[0].dead += _record_size(encoded_key, old[2])
+        if flags == _PUT:
+            self._index[key] = (segment, value_offset, value_length)
+        # Tombstones aren't counted as dead: compaction can only drop them
+        # once it reaches the oldest segment
+
+    def _load_log(self, segment):
+        entries, end = segment.scan()
+        for entry in entries:
+            self._apply(segment, *entry)
+        return end
+
+    def _load_hint(self, segment):
+        # False if the segment has no usable hint file
+        entries = _read_hint(segment.hint_path)
+        if entries is None:
+            return False
+        for entry in entries:
+            self._apply(segment, *entry)
+        return True
+
+    def _write_hint(self, segment):
+        entries = [_HINT.pack(flags, len(key), value_offset, value_length) + key
+                   for flags, key, value_offset, value_length in segment.scan()[0]]
+        temporary = segment.hint_path + ".tmp"
+        with open(temporary, "wb") as handle:
+            handle.write(_HINT_MAGIC + b"".join(entries))
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, segment.hint_path)
+
+    def _remove_files(self, segment_id):
+        for ext in (".log", ".hint"):
+            path = os.path.join(self.directory, f"{segment_id:010d}{ext}")
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Public interface
+
+    def get(self, key: str):
+        """Return the bytes stored under key, or None."""
+        location = self._index.get(key)
+        if location is None:
+            return None
+        # Holding the segment keeps it readable even if compaction retires it now
+        segment, offset, length = location
+        return segment.read(offset, length)
+
+    def get_many(self, keys):
+        """Return {key: bytes} for the keys that are present."""
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def put(self, key: str, value: bytes) -> None:
+        """Store value under key."""
+        self._append([(key, value, _PUT)])
+
+    def put_many(self, items) -> None:
+        """Store every (key, value) pair with one write and one fsync."""
+        self._append([(key, value, _PUT) for key, value in items])
+
+    def delete(self, key: str) -> bool:
+        """Remove key; returns False if it wasn't present."""
+        if key not in self._index:
+            return False
+        self._append([(key, b"", _DELETE)])
+        return True
+
+    def keys(self):
+        return list(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def _append(self, entries):
+        if self._closed:
+            raise ValueError("LogStore is closed")
+        if not entries:
+            return
+        encoded = [(key, key.encode(), value, flags) for key, value, flags in entries]
+        records = [_encode_record(flags, encoded_key, value) for _, encoded_key, value, flags in encoded]
+        with self._lock:
+            segment = self._active
+            offset = segment.append(b"".join(records))  # One write for the whole batch
+            for (key, encoded_key, value, flags), record in zip(encoded, records):
+                old = self._index.pop(key, None)
+                if old is not None:
+                    old[0].dead += _record_size(encoded_key, old[2])
+                if flags == _PUT:
+                    self._index[key] = (segment, offset + _RECORD.size + len(encoded_key), len(value))
+                offset += len(record)
+            self._written += 1
+            sequence = self._written
+            if segment.size >= self.max_segment_size:
+                self._rotate()
+        if self.sync:
+            self._commit(sequence)
+
+    def _rotate(self):
+        # Called with self._lock held: only swap in a new active segment. The
+        # background thread fsyncs the full one and writes its hint file.
+        self._sealing.append(self._active)
+        self._active = Segment(self.directory, self._active.id + 1, writable=True)
+        self._maybe_compact()
+
+    def _finish_seals(self):
+        # Called with self._compact_lock held. A segment joins _sealed (and
+        # becomes eligible for compaction) once its hint file exists.
+        while True:
+            with self._lock:
+                if not self._sealing:
+                    return
+                segment = self._sealing[0]
+            segment.sync()
+            self._write_hint(segment)
+            with self._lock:
+                segment.seal()  # Under the lock: _commit may be duplicating its descriptor
+                self._sealing.pop(0)
+                self._sealed.append(segment)
+
+    def _commit(self, sequence):
+        # Group commit: one writer fsyncs on behalf of everyone who has
+        # written so far; the others wait for that fsync instead of issuing
+        # their own.
+        with self._sync:
+            while self._synced < sequence:
+                if not self._syncing:
+                    self._syncing = True
+                    break
+                self._sync.wait()
+            else:
+                return
+        synced = False
+        try:
+            with self._lock:
+                target = self._written
+                # Full segments not sealed yet may hold some of these writes
+                fds = [os.dup(segment._write_fd) for segment in self._sealing + [self._active]]
+            try:
+                for fd in fds:
+                    os.fsync(fd)
+                synced = True
+            finally:
+                for fd in fds:
+                    os.close(fd)
+        finally:
+            with self._sync:
+                self._syncing = False
+                if synced:
+                    self._synced = max(self._synced, target)
+                self._sync.notify_all()
+
+    # Compaction
+
+    def _pick_run(self, force=False):
+        """
+        Contiguous run of sealed segments worth compacting, or None.
+
+        A run reads at most max_compact_bytes (a single larger segment is
+        allowed). It qualifies if at least compact_ratio of it is dead, or
+        if it is several segments that together fit in one, which merges
+        the small outputs of earlier compactions (size tiering). The run
+        freeing the most dead bytes wins. With force, any run with dead
+        bytes qualifies. Called with self._lock held.
+        """
+        sealed = self._sealed
+        best, best_score = None, None
+        for start in range(len(sealed)):
+            total = dead = 0
+            for end in range(start, len(sealed)):
+                total += sealed[end].size
+                dead += sealed[end].dead
+                if total > self.max_compact_bytes and end > start:
+                    break
+                count = end - start + 1
+                worth = (dead > 0 if force else total and dead / total >= self.compact_ratio) or \
+                    (count > 1 and total <= self.max_segment_size)
+                if worth and (best_score is None or (dead, count) > best_score):
+                    best, best_score = (start, end + 1), (dead, count)
+        return sealed[best[0]:best[1]] if best else None
+
+    def _worth_compacting(self):
+        # Called with self._lock held
+        return len(self._sealed) >= self.min_compact_segments and self._pick_run() is not None
+
+    def _maybe_compact(self):
+        # Called with self._lock held
+        if self._compactor is None and (self._sealing or self._worth_compacting()):
+            self._compactor = threading.Thread(target=self._background_compact, name="lightningmcp-logstore-compact",
+                                               daemon=True)
+            self._compactor.start()
+
+    def _background_compact(self):
+        # Seal full segments and compact until there is nothing left to do
+        try:
+            while True:
+                self._compact()
+                with self._lock:
+                    if not self._sealing and not self._worth_compacting():
+                        self._compactor = None
+                        return
+        except BaseException:
+            with self._lock:
+                self._compactor = None
+            raise
+
+    def compact(self):
+        """
+        Compact every sealed segment that has dead records, one bounded run
+        at a time, then merge runs of undersized segments.
+
+        Writers keep appending to the active segment meanwhile.
+        """
+        done = set()
+        while True:
+            run = self._compact(force=True, skip=done)
+            if run is None:
+                return
+            done.add(run)
+
+    def _compact(self, force=False, skip=()):
+        """
+        Rewrite one run of sealed segments (see _pick_run) as one segment
+        holding only their live records.
+
+        The result takes the highest id it replaces and records the lowest
+        (including what compacted inputs replaced),
+        so a crash before the inputs are deleted is cleaned up on the next
+        start. Unless the run starts at the oldest segment, tombstones of
+        deleted keys are kept, since an older segment may still hold a value
+        they hide.
+
+        Returns:
+            Ids of the compacted segments, or None if no run qualified (or
+            it is in skip)
+        """
+        with self._compact_lock:
+            self._finish_seals()
+            with self._lock:
+                inputs = self._pick_run(force)
+                oldest = bool(inputs) and inputs[0] is self._sealed[0]
+            run = tuple(segment.id for segment in inputs or ())
+            if not inputs or run in skip:
+                return None
+
+            tombstones = []
+            if not oldest:
+                for segment in inputs:
+                    entries = _read_hint(segment.hint_path)
+                    if entries is None:
+                        entries = segment.scan()[0]
+                    tombstones.extend(key for flags, key, _, _ in entries if flags == _DELETE)
+            with self._lock:
+                members = set(inputs)
+                live = [(key, location) for key, location in self._index.items() if location[0] in members]
+                deleted = list(dict.fromkeys(key for key in tombstones if key.decode() not in self._index))
+
+            target_id = inputs[-1].id
+            temporary = os.path.join(self.directory, f"{target_id:010d}.log.tmp")
+            moved = []
+            with open(temporary, "wb") as handle:
+                chunks = [_encode_record(_MERGED, b"", str(inputs[0].first).encode())]
+                chunks.extend(_encode_record(_DELETE, key, b"") for key in deleted)
+                offset = sum(len(chunk) for chunk in chunks)
+                for key, location in live:
+                    segment, value_offset, length = location
+                    encoded_key = key.encode()
+                    record = _encode_record(_PUT, encoded_key, segment.read(value_offset, length))
+                    moved.append((key, location, offset + _RECORD.size + len(encoded_key), length))
+                    chunks.append(record)
+                    offset += len(record)
+                    if len(chunks) >= 1024:
+                        handle.write(b"".join(chunks))
+                        chunks = []
+                handle.write(b"".join(chunks))
+                handle.flush()
+                os.fsync(handle.fileno())
+
+            with self._lock:
+                target = inputs[-1]
+                if os.path.exists(target.hint_path):
+                    os.remove(target.hint_path)  # Stale until rewritten below
+                os.replace(temporary, target.path)
+                compacted = Segment(self.directory, target_id)
+                compacted.first = inputs[0].first
+                for key, location, value_offset, length in moved:
+                    # Keys written or deleted during compaction keep their newer location
+                    if self._index.get(key) is location:
+                        self._index[key] = (compacted, value_offset, length)
+                    else:
+                        compacted.dead += _record_size(key.encode(), length)
+                first = self._sealed.index(inputs[0])
+                # The inputs aren't closed: a reader may still hold one for a
+                # moment, and it is released with the reader's last reference
+                self._sealed[first:first + len(inputs)] = [compacted]
+            self._write_hint(compacted)
+            for segment in inputs[:-1]:
+                self._remove_files(segment.id)
+            return run
+
+    def close(self):
+        """fsync and close every segment."""
+        if self._closed:
+            return
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._compact_lock:
+            self._finish_seals()
+        with self._lock:
+            self._closed = True
+            self._active.close()
+            for segment in self._sealing + self._sealed:
+                segment.close()
+        self._unlock()
@@ -1,51 +1,84 @@
 import json
 import os
-from typing import Any, Dict, Optional
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+from .logstore import LogStore
 
 
 class DataStorage:
     """
     Storage class for managing data persistence.
-    This implementation provides a simple file-based storage system
-    that could be extended to support MongoDB, PostgreSQL, etc.
+
+    Backed by a log-structured store (data.logstore.LogStore): writes are
+    appends, reads are an index lookup plus an mmap slice, and keys are kept
+    exactly as given. Calls block, so async code should go through
+    data.async_storage.ThreadedStorage, which also hosts the MongoDB backend.
+    A directory is used by one process at a time (opening it elsewhere raises
+    data.logstore.StoreLockedError), so workers sharing data use MongoDB.
     """
 
-    def __init__(self, storage_dir: str = "./data_store"):
+    def __init__(self, storage_dir: str = "./data_store", sync: bool = True, **options):
         """
         Initialize the data storage with a directory.
 
         Args:
             storage_dir: Directory to store data files
+            sync: fsync each save before returning (concurrent saves share one fsync)
+            options: Additional arguments for data.logstore.LogStore
         """
         # Connect to DB or file system
         self.storage_dir = storage_dir
-        os.makedirs(storage_dir, exist_ok=True)
+        self._store = LogStore(storage_dir, sync=sync, **options)
+        self._add_lock = threading.Lock()
+        self._import_legacy_files()
+
+    def _import_legacy_files(self):
+        # Earlier versions wrote one <sanitized key>.json file per key. Import
+        # them under that name (what list_keys used to return) and move them
+        # aside so they aren't imported again.
+        legacy = [name for name in os.listdir(self.storage_dir) if name.endswith(".json")]
+        if not legacy:
+            return
+        archive = os.path.join(self.storage_dir, "legacy")
+        os.makedirs(archive, exist_ok=True)
+        for name in legacy:
+            path = os.path.join(self.storage_dir, name)
+            with open(path, "r") as f:
+                value = json.load(f)
+            if name[:-5] not in self._store:
+                self.save(name[:-5], value)
+            os.replace(path, os.path.join(archive, name))
 
-    def _get_file_path(self, key: str) -> str:
+    def save(self, key: str, value: Any) -> None:
         """
-        Get the file path for a given key.
+        Save data to storage.
 
         Args:
             key: Unique identifier for the data
-
-        Returns:
-            String path to the file
+            value: Data to store (must be JSON serializable)
         """
-        # Sanitize the key to create a valid filename
-        safe_key = "".join([c if c.isalnum() else "_" for c in key])
-        return os.path.join(self.storage_dir, f"{safe_key}.json")
+        self._store.put(key, json.dumps(value, separators=(",", ":")).encode())
 
-    def save(self, key: str, value: Any) -> None:
+    def add(self, key: str, value: Any) -> bool:
         """
-        Save data to storage.
+        Save data unless the key already exists.
+
+        Atomic with respect to other add calls on this storage, which makes
+        it usable as a compare-and-swap on versioned keys.
 
         Args:
             key: Unique identifier for the data
             value: Data to store (must be JSON serializable)
+
+        Returns:
+            True if saved, False if the key was already present
         """
-        file_path = self._get_file_path(key)
-        with open(file_path, 'w') as f:
-            json.dump(value, f, indent=2)
+        with self._add_lock:
+            if key in self._store:
+                return False
+            self.save(key, value)
+            return True
 
     def load(self, key: str) -> Optional[Any]:
         """
@@ -57,12 +90,32 @@ class DataStorage:
         Returns:
             The stored data or None if not found
         """
-        file_path = self._get_file_path(key)
-        if not os.path.exists(file_path):
+        data = self._store.get(key)
+        if data is None:
             return None
+        return json.loads(data)
+
+    def load_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Load several keys at once.
+
+        Args:
+            keys: Identifiers to look up
+
+        Returns:
+            Dict of the keys that exist to their data
+        """
+        return {key: json.loads(data) for key, data in self._store.get_many(keys).items()}
 
-        with open(file_path, 'r') as f:
-            return json.load(f)
+    def save_many(self, items: Dict[str, Any]) -> None:
+        """
+        Save several entries with a single write and fsync.
+
+        Args:
+            items: Dict of key to data (must be JSON serializable)
+        """
+        self._store.put_many([(key, json.dumps(value, separators=(",", ":")).encode())
+                              for key, value in items.items()])
 
     def delete(self, key: str) -> bool:
         """
@@ -74,11 +127,7 @@ class DataStorage:
         Returns:
             True if successful, False otherwise
         """
-        file_path = self._get_file_path(key)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            return True
-        return False
+        return self._store.delete(key)
 
     def list_keys(self) -> list:
         """
@@ -87,54 +136,12 @@ class DataStorage:
         Returns:
             List of keys
         """
-        if not os.path.exists(self.storage_dir):
-            return []
-
-        # Get all JSON files and extract the keys
-        files = [f for f in os.listdir(
-            self.storage_dir) if f.endswith('.json')]
-        # Remove the .json extension to get original keys
-        keys = [f[:-5] for f in files]
-        return keys
-
-
-# Example implementation for MongoDB (placeholder)
-class MongoDBStorage:
-    """
-    MongoDB implementation of DataStorage.
-    This is a placeholder that would need pymongo and actual implementation.
-    """
-
-    def __init__(self, connection_string: str, db_name: str, collection: str):
-        """
-        Initialize MongoDB storage.
-
-        Args:
-            connection_string: MongoDB connection string
-            db_name: Database name
-            collection: Collection name
-        """
-        # This would use pymongo in a real implementation
-        self.connection_string = connection_string
-        self.db_name = db_name
-        self.collection = collection
-        print(f"Connected to MongoDB: {db_name}.{collection}")
+        return self._store.keys()
 
-    def save(self, key: str, value: Any) -> None:
-        """Placeholder for MongoDB document insertion"""
-        print(f"Saving {key} to MongoDB")
-
-    def load(self, key: str) -> Optional[Dict]:
-        """Placeholder for MongoDB document retrieval"""
-        print(f"Loading {key} from MongoDB")
-        return None
+    def compact(self) -> None:
+        """Reclaim the space of overwritten and deleted values."""
+        self._store.compact()
 
-    def delete(self, key: str) -> bool:
-        """Placeholder for MongoDB document deletion"""
-        print(f"Deleting {key} from MongoDB")
-        return True
-
-    def list_keys(self) -> list:
-        """Placeholder for MongoDB key listing"""
-        print("Listing all keys in MongoDB")
-        return []
+    def close(self) -> None:
+        """Flush and close the underlying files."""
+        self._store.close()
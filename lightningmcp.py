@@ -1,88 +1,259 @@
-from fastapi import FastAPI
+import contextlib
+import os
+import tempfile
+from core.resources import ResourceSpec
+from core.resilience import INFRASTRUCTURE_ERRORS
+from core.tools import ToolRegistry, ToolSpec
 from typing import Callable, Dict, Any, Optional, TypeVar, Union, List
 
+# Importing this module only loads core.tools and core.resources: the web stack (FastAPI,
+# pydantic models, middleware), the runtime and Redis are imported when the
+# app or runtime is first used, so CLI tool-runners and short-lived workers
+# that only build a registry start fast.
+
 
 class LightningMCP:
     """
     Main LightningMCP application class that provides the core functionality.
     """
 
-    def __init__(self, title: str = "LightningMCP", description: str = None):
+    def __init__(self, title: str = "LightningMCP", description: str = None,
+                 redis_url: str = "redis://localhost", cache=None, tools: dict = None, **runtime_options):
         """
         Initialize a new LightningMCP application.
 
         Args:
             title: The title of the application
             description: Optional description
+            redis_url: Redis URL for the shared result cache
+            cache: Optional pre-built cache (e.g. for tests without Redis)
+            tools: Optional manifest of tools to declare (see declare_tools)
+            runtime_options: Additional arguments for core.runtime.Runtime
         """
-        self.app = FastAPI(title=title, description=description)
-        self.tools = {}
+        self.title = title
+        self.description = description
+        self.tools = ToolRegistry()
         self.resources = {}
+        self._startup_hooks = []
+        self._shutdown_hooks = []
+        self._runtime_options = dict(redis_url=redis_url, cache=cache, **runtime_options)
+        self._runtime = None
+        self._app = None
+        if tools:
+            self.declare_tools(tools)
+
+    @property
+    def runtime(self):
+        """The app's core.runtime.Runtime, built on first use."""
+        if self._runtime is None:
+            # One orchestrator, engine, executor pool and Redis pool for the whole app
+            from core.runtime import Runtime
+            self._runtime = Runtime(self.tools, resources=self.resources, **self._runtime_options)
+        return self._runtime
+
+    @property
+    def app(self):
+        """The FastAPI application, built on first use."""
+        if self._app is None:
+            from fastapi import FastAPI
+            from api.ratelimit import RateLimitMiddleware
+            from api.routes import router
+            from monitoring.tracing import TracingMiddleware
+
+            app = FastAPI(title=self.title, description=self.description, lifespan=self._lifespan)
+            app.state.runtime = self.runtime
+            app.add_middleware(RateLimitMiddleware, runtime=self.runtime)
+            app.add_middleware(TracingMiddleware, tracer=self.runtime.tracer)  # Outermost, so 429s are traced
+
+            # Register default routes
+            app.include_router(router)
+            self._app = app
+        return self._app
+
+    @contextlib.asynccontextmanager
+    async def _lifespan(self, app):
+        await self.runtime.startup()
+        for hook in self._startup_hooks:
+            await hook()
+        try:
+            yield
+        finally:
+            for hook in reversed(self._shutdown_hooks):
+                await hook()
+            await self.runtime.shutdown()
+
+    def on_startup(self, func):
+        """
+        Decorator to register a coroutine run after the runtime has started.
+
+        Args:
+            func: Async function taking no arguments
 
-        # Register default routes
-        from api.routes import router
-        self.app.include_router(router)
+        Returns:
+            The original function
+        """
+        self._startup_hooks.append(func)
+        return func
 
-    def tool(self, name: str = None, description: str = None):
+    def on_shutdown(self, func):
+        """
+        Decorator to register a coroutine run before the runtime is drained.
+
+        Args:
+            func: Async function taking no arguments
+
+        Returns:
+            The original function
+        """
+        self._shutdown_hooks.append(func)
+        return func
+
+    def tool(self, name: str = None, description: str = None,
+             cpu_bound: bool = False, max_concurrency: Union[int, str] = None,
+             version: str = None, cache_stream: bool = False, semantic_threshold: float = None,
+             conflicts: List[str] = (), circuit_breaker: bool = True,
+             failure_on=INFRASTRUCTURE_ERRORS, retry=None,
+             hedge: bool = False, equivalent: str = None, invalidates: List[str] = (),
+             cache: bool = True):
         """
         Decorator to register a function as a tool.
 
+        Coroutine functions run on the event loop, plain functions run in a
+        thread pool, and functions marked ``cpu_bound`` run in a process pool
+        (they must be importable at module level so they can be pickled).
+        Generator and async generator functions are registered as streaming
+        tools whose chunks are sent to clients as they are produced; sync
+        generators always run in the thread pool.
+
         Args:
             name: Optional name for the tool (defaults to function name)
             description: Optional description for the tool
+            cpu_bound: Run the tool in the process pool instead of a thread
+            max_concurrency: Optional cap on concurrent calls of this tool, or
+                "adaptive" to let the cap follow the tool's latency
+            version: Optional version string; bump it to invalidate cached results
+            cache_stream: Cache a streaming tool's chunks and replay them on hits
+            semantic_threshold: Opt in to semantic caching: a call whose string
+                arguments are at least this similar (0-1) to an earlier call with
+                identical other arguments reuses its result
+            conflicts: Conflict groups; tools sharing a group never run
+                concurrently (e.g. writers of the same store)
+            circuit_breaker: Reject calls fast (CircuitOpenError) while most
+                recent calls of the tool failed, probing again after a cooldown
+            failure_on: Exception types the breaker counts as failures (by
+                default connection errors and timeouts; never ValueError)
+            retry: Retry failed calls: a core.resilience.RetryPolicy or a number
+                of attempts (jittered exponential backoff within the deadline)
+            hedge: If a call runs past the tool's p95 latency, start a second
+                one and keep whichever finishes first (idempotent tools only)
+            equivalent: Name of a group of interchangeable tools (same
+                parameters, same results); plans call whichever member is
+                expected to finish first
+            invalidates: Ids of resources the tool changes; every successful
+                call drops their cached contents (on every worker)
+            cache: Cache results (default); pass False for tools with side
+                effects so every call runs
 
         Returns:
             Decorator function
         """
         def decorator(func):
-            tool_name = name or func.__name__
-            tool_desc = description or func.__doc__
-
-            # Register the tool
-            self.tools[tool_name] = {
-                "name": tool_name,
-                "description": tool_desc,
-                "function": func
-            }
+            # Signature introspection and validator compilation happen once, here
+            spec = ToolSpec(func, name=name, description=description, cpu_bound=cpu_bound,
+                            max_concurrency=max_concurrency, version=version,
+                            cache_stream=cache_stream, semantic_threshold=semantic_threshold,
+                            conflicts=conflicts, circuit_breaker=circuit_breaker, failure_on=failure_on,
+                            retry=retry, hedge=hedge, equivalent=equivalent, invalidates=invalidates,
+                            cache=cache)
+            self.tools[spec.name] = spec
 
             # Return the original function
             return func
 
         return decorator
 
-    def resource(self, resource_id: str):
+    def declare_tools(self, manifest: dict):
+        """
+        Register tools by import path, without importing their modules.
+
+        Each module is imported the first time its tool is looked up, so an
+        app with many tools pays only for the ones it runs.
+
+        Args:
+            manifest: Tool name -> "package.module:function", or -> dict with
+                a "target" import path plus options for the tool decorator,
+                e.g. {"report": {"target": "tools.reports:build", "cpu_bound": True}}
+        """
+        for name, entry in manifest.items():
+            if isinstance(entry, str):
+                self.tools.declare(name, entry)
+            else:
+                options = dict(entry)
+                self.tools.declare(name, options.pop("target"), **options)
+
+    def resource(self, resource_id: str, description: str = None, ttl: float = None):
         """
         Decorator to register a function as a resource.
 
+        Resources are served at ``GET /resources/read?uri=<id>``. The result
+        is computed once and served from the resource cache, with an ETag,
+        until it is invalidated: by a tool declaring ``invalidates``, by
+        invalidate_resource, or after ``ttl`` seconds. The function may take
+        one argument, a context dict shared by every reader (so results must
+        not depend on who asks).
+
         Args:
             resource_id: Unique identifier for the resource
+            description: Optional description (defaults to the docstring)
+            ttl: Optional seconds a computed result is served
 
         Returns:
             Decorator function
         """
         def decorator(func):
-            # Register the resource
-            self.resources[resource_id] = {
-                "id": resource_id,
-                "function": func
-            }
+            self.resources[resource_id] = ResourceSpec(resource_id, func, description=description, ttl=ttl)
 
             # Return the original function
             return func
 
         return decorator
 
-    def run(self, host: str = "0.0.0.0", port: int = 8000, **kwargs):
+    def invalidate_resource(self, resource_id: str):
+        """
+        Drop a resource's cached contents, on every worker, after changing
+        what it shows. Call it on the event loop.
+
+        Args:
+            resource_id: The ID of the resource
+        """
+        if self.runtime.resource_cache is not None:
+            self.runtime.resource_cache.invalidate(resource_id)
+
+    def run(self, host: str = "0.0.0.0", port: int = 8000, app_path: str = None, **kwargs):
         """
         Run the LightningMCP application.
 
         Args:
             host: Host to bind to
             port: Port to bind to
+            app_path: Import string of the ASGI app (e.g. "main:mcp.app");
+                uvicorn needs one to start several workers
             kwargs: Additional arguments to pass to uvicorn
+
+        Raises:
+            ValueError: If several workers would each keep their own sessions
+                (the storage isn't shared between processes)
         """
+        workers = kwargs.get("workers") or 1
+        if workers > 1 and not getattr(self._runtime_options.get("storage"), "shared", False):
+            raise ValueError("Several workers need a storage shared between processes "
+                             "(e.g. data.async_storage.MongoStorage) for their sessions")
         import uvicorn
-        uvicorn.run(self.app, host=host, port=port, **kwargs)
+        from monitoring.metrics import METRICS_DIR_ENV
+        if workers > 1 and not os.environ.get(METRICS_DIR_ENV):
+            # Workers inherit this and share metrics through files in it
+            os.environ[METRICS_DIR_ENV] = tempfile.mkdtemp(prefix="lightningmcp-metrics-")
+        uvicorn.run(app_path or self.app, host=host, port=port, **kwargs)
 
     def get_tool(self, name: str):
         """
@@ -92,7 +263,7 @@ class LightningMCP:
             name: The name of the tool
 
         Returns:
-            The tool object or None if not found
+            The ToolSpec or None if not found
         """
         return self.tools.get(name)
 
@@ -104,7 +275,7 @@ class LightningMCP:
             resource_id: The ID of the resource
 
         Returns:
-            The resource object or None if not found
+            The ResourceSpec or None if not found
         """
         return self.resources.get(resource_id)
 
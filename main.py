@@ -1,34 +1,45 @@
-from fastapi import FastAPI
-from api.routes import router as api_router
-from lightningmcp import app
+import collections
+import threading
 
-app = FastAPI(title="LightningMCP")
+from core.resources import ItemWindow
+from lightningmcp import LightningMCP
 
-app.include_router(api_router)
+mcp = LightningMCP()
 
-# Define a simple calculation tool
+# Recent calculations, oldest first (sync tools run in worker threads)
+history = collections.deque(maxlen=10000)
+history_dropped = 0  # Calculations that fell off the front of history
+history_lock = threading.Lock()
 
+# Define a simple calculation tool (not cached: every call must reach the history)
 
-@app.tool()
+
+@mcp.tool(invalidates=["resource://calculation_history"], cache=False)
 def calculate(a: float, operation: str, b: float) -> float:
     """Perform basic math operations"""
     if operation == "+":
-        return a + b
+        result = a + b
     elif operation == "-":
-        return a - b
+        result = a - b
     elif operation == "*":
-        return a * b
+        result = a * b
     elif operation == "/":
         if b == 0:
             raise ValueError("Division by zero")
-        return a / b
+        result = a / b
     else:
         raise ValueError(f"Unsupported operation: {operation}")
+    global history_dropped
+    with history_lock:
+        if len(history) == history.maxlen:
+            history_dropped += 1
+        history.append({"a": a, "operation": operation, "b": b, "result": result})
+    return result
 
 # Define a tool for text processing
 
 
-@app.tool()
+@mcp.tool()
 def process_text(text: str, operation: str) -> str:
     """Process text with various operations"""
     if operation == "uppercase":
@@ -45,11 +56,23 @@ def process_text(text: str, operation: str) -> str:
 # Define a resource for calculation history
 
 
-@app.resource("resource://calculation_history")
-async def get_calculation_history(ctx):
+@mcp.resource("resource://calculation_history")
+def get_calculation_history():
     """Get calculation history"""
-    # In a real app, this would retrieve from a database
-    return ctx.get("history", [])
+    # Served from the resource cache until calculate runs again; clients page
+    # through it with ?offset= (a sequence number, so it survives the oldest
+    # calculations being dropped) and revalidate with If-None-Match
+    with history_lock:
+        return ItemWindow(history, first=history_dropped)
+
+
+def __getattr__(name):
+    # "uvicorn main:app" looks the ASGI app up here; building it only then
+    # keeps imports of this module (e.g. by process-pool workers) light
+    if name == "app":
+        return mcp.app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, reload=True)
+    mcp.run(host="0.0.0.0", port=8000, app_path="main:app", reload=True)
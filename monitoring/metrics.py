@@ -1,32 +1,401 @@
+import contextlib
+import math
+import os
+import re
+import threading
 import time
+from array import array
+
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_:]")
+
+# Directory shared by all worker processes; setting it enables multi-process mode
+METRICS_DIR_ENV = "LIGHTNINGMCP_METRICS_DIR"
+
+
+def _metric_name(name):
+    # Prometheus names only allow [a-zA-Z0-9_:]; "executor.queue_depth" -> "executor_queue_depth"
+    return _INVALID_NAME_CHARS.sub("_", name)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{_metric_name(k)}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _allocate_local(size, config=None):
+    # Default storage: process-private doubles. Multi-process mode swaps in
+    # slices of a memory-mapped file instead (see monitoring.multiprocess).
+    return array("d", bytes(size * 8))
+
+
+class _Sharded:
+    """
+    Per-thread storage: each thread writes only its own shard, so the write
+    path takes no lock. Shards are merged when the metric is read.
+    """
+
+    def __init__(self, size, allocate=_allocate_local, config=None):
+        self._size = size
+        self._allocate = allocate
+        self._config = config
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()  # Only taken when a thread creates its shard
+
+    def shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._allocate(self._size, self._config)
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def add(self, values):
+        shard = self.shard()
+        for i, value in enumerate(values):
+            shard[i] += value
+
+    def merged(self):
+        with self._lock:
+            shards = list(self._shards)
+        total = [0] * self._size
+        for shard in shards:
+            for i, value in enumerate(shard):
+                if value:
+                    total[i] += value
+        return total
+
+    def reset(self):
+        with self._lock:
+            for shard in self._shards:
+                for i in range(len(shard)):
+                    shard[i] = 0
+
+
+class Counter:
+    """Monotonically increasing value."""
+
+    type = "counter"
+
+    def __init__(self, allocate=_allocate_local):
+        self._storage = _Sharded(1, allocate)
+
+    def inc(self, value=1):
+        self._storage.shard()[0] += value
+
+    def value(self):
+        return self._storage.merged()[0]
+
+    def slots(self):
+        return self._storage.merged()
+
+    def merge(self, values):
+        self._storage.add(values)
+
+    def reset(self):
+        self._storage.reset()
+
+
+class Gauge:
+    """Value that can go up and down. Gauges are rarely hot, so they use a lock."""
+
+    type = "gauge"
+
+    def __init__(self, allocate=_allocate_local):
+        self._value = allocate(1)
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._value[0] = value
+
+    def inc(self, value=1):
+        with self._lock:
+            self._value[0] += value
+
+    def dec(self, value=1):
+        self.inc(-value)
+
+    def value(self):
+        return self._value[0]
+
+    def slots(self):
+        return [self._value[0]]
+
+    def merge(self, values):
+        self.inc(values[0])
+
+    def reset(self):
+        self._value[0] = 0.0
+
+
+class Histogram:
+    """
+    Fixed-memory histogram with logarithmic buckets (HDR-style).
+
+    Bucket ``i`` covers ``[min_value * growth**i, min_value * growth**(i+1))``
+    so every recorded value is known to within the bucket's relative width
+    (about 9% with the default growth of 2**(1/8)), whatever the range.
+    Values below ``min_value`` fall into the first bucket and values above
+    ``max_value`` into the last. Memory is a few KB per labelled series and
+    never grows with the number of samples.
+    """
+
+    type = "histogram"
+
+    def __init__(self, min_value=1e-6, max_value=1e4, growth=2 ** (1 / 8), export_every=8,
+                 allocate=_allocate_local):
+        self.min_value = min_value
+        self.growth = growth
+        self._inv_log_growth = 1 / math.log(growth)
+        self.bucket_count = int(math.ceil(math.log(max_value / min_value) * self._inv_log_growth)) + 1
+        self.export_every = export_every  # Fine buckets folded into each exported "le" bucket
+        # Enough to rebuild an identical histogram in another process
+        self.config = (min_value, max_value, growth, export_every)
+        # Shard layout: [count, sum, bucket_0, ..., bucket_n]
+        self._storage = _Sharded(self.bucket_count + 2, allocate, self.config)
+
+    def _index(self, value):
+        if value <= self.min_value:
+            return 0
+        index = int(math.log(value / self.min_value) * self._inv_log_growth)
+        return index if index < self.bucket_count else self.bucket_count - 1
+
+    def observe(self, value):
+        shard = self._storage.shard()
+        shard[0] += 1
+        shard[1] += value
+        shard[self._index(value) + 2] += 1
+
+    def upper_bound(self, index):
+        return self.min_value * self.growth ** (index + 1)
+
+    def snapshot(self):
+        """Merged (count, sum, bucket counts) across all shards."""
+        merged = self._storage.merged()
+        return merged[0], merged[1], merged[2:]
+
+    def slots(self):
+        return self._storage.merged()
+
+    def merge(self, values):
+        self._storage.add(values)
+
+    @staticmethod
+    def _quantile(count, buckets, upper_bound, q):
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for index, bucket in enumerate(buckets):
+            seen += bucket
+            if seen >= rank:
+                return upper_bound(index)
+        return upper_bound(len(buckets) - 1)
+
+    def quantile(self, q):
+        count, _, buckets = self.snapshot()
+        return self._quantile(count, buckets, self.upper_bound, q)
+
+    def summary(self):
+        count, total, buckets = self.snapshot()
+        return {
+            "count": int(count),
+            "sum": total,
+            **{f"p{int(q * 100)}": self._quantile(count, buckets, self.upper_bound, q) for q in (0.5, 0.95, 0.99)},
+        }
+
+    def exposition_buckets(self):
+        """Cumulative (le, count) pairs at every ``export_every``-th boundary, plus +Inf."""
+        count, _, buckets = self.snapshot()
+        cumulative = 0
+        result = []
+        for index, bucket in enumerate(buckets):
+            cumulative += bucket
+            if (index + 1) % self.export_every == 0:
+                result.append((self.upper_bound(index), cumulative))
+        result.append((math.inf, count))
+        return result
+
+    def reset(self):
+        self._storage.reset()
+
+
+class MetricFamily:
+    """A named metric with one child per label set."""
+
+    def __init__(self, name, metric_type, factory, description="", store=None):
+        self.name = name
+        self.type = metric_type
+        self.description = description
+        self._factory = factory
+        self._store = store
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _create(self, key):
+        if self._store is None:
+            return self._factory()
+        return self._factory(allocate=self._store.allocator(self.name, self.type, key))
+
+    def labels(self, labels=None):
+        key = _label_key(labels)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._create(key)
+        return child
+
+    def children(self):
+        with self._lock:
+            return list(self._children.items())
 
 
 class MetricsCollector:
-    def __init__(self):
+    """
+    Registry of counters, gauges and histograms.
+
+    Writes are O(1) and lock-free once a series exists, memory is fixed per
+    labelled series, and a name can only ever have one type.
+
+    With a ``directory`` (or ``LIGHTNINGMCP_METRICS_DIR`` set) every worker
+    process writes its series into its own memory-mapped files there, and
+    reads sum the files of all workers, so any worker can answer a scrape.
+    """
+
+    def __init__(self, directory: str = None):
+        """
+        Initialize the collector.
+
+        Args:
+            directory: Shared directory for multi-process mode (defaults to
+                the LIGHTNINGMCP_METRICS_DIR environment variable; pass ""
+                for a process-local collector regardless)
+        """
         self._metrics = {}
+        self._lock = threading.Lock()
+        if directory is None:
+            directory = os.environ.get(METRICS_DIR_ENV)
+        self.directory = directory or None
+        self._store = None
+        if self.directory:
+            from .multiprocess import MMapStore
+            self._store = MMapStore(self.directory)
+
+    def _family(self, name, metric_type, factory):
+        family = self._metrics.get(name)
+        if family is None:
+            with self._lock:
+                family = self._metrics.get(name)
+                if family is None:
+                    family = self._metrics[name] = MetricFamily(name, metric_type, factory, store=self._store)
+        if family.type != metric_type:
+            raise ValueError(f"Metric {name!r} is a {family.type}, not a {metric_type}")
+        return family
 
-    def record(self, name, value):
-        """Record a single metric value."""
-        if name not in self._metrics:
-            self._metrics[name] = []
-        self._metrics[name].append(value)
+    def counter(self, name, labels=None):
+        return self._family(name, "counter", Counter).labels(labels)
 
-    def increment_counter(self, name, value=1):
+    def gauge(self, name, labels=None):
+        return self._family(name, "gauge", Gauge).labels(labels)
+
+    def histogram(self, name, labels=None):
+        return self._family(name, "histogram", Histogram).labels(labels)
+
+    def record(self, name, value, labels=None):
+        """Record a single metric value in a histogram."""
+        self.histogram(name, labels).observe(value)
+
+    def increment_counter(self, name, value=1, labels=None):
         """Increment a counter metric."""
-        if name not in self._metrics:
-            self._metrics[name] = 0
-        self._metrics[name] += value
+        self.counter(name, labels).inc(value)
 
-    def observe_duration(self, name, start_time):
-        """Record the duration of an operation."""
+    def set_gauge(self, name, value, labels=None):
+        """Set a gauge metric."""
+        self.gauge(name, labels).set(value)
+
+    def observe_duration(self, name, start_time, labels=None):
+        """Record the duration of an operation started at time.time() start_time."""
         duration = time.time() - start_time
-        self.record(name, duration)
+        self.record(name, duration, labels)
+
+    @contextlib.contextmanager
+    def timer(self, name, labels=None):
+        """Context manager recording the duration of its body in seconds."""
+        histogram = self.histogram(name, labels)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    def _aggregate(self):
+        # In multi-process mode, reads see the sum over every worker's files
+        from .multiprocess import collect
+        return collect(self.directory)
 
     def get_metrics(self):
-        """Retrieve all collected metrics."""
-        # In a real system, this would format metrics for a monitoring system (e.g., Prometheus)
-        return self._metrics
+        """
+        Retrieve all collected metrics.
+
+        Unlabelled metrics map to their value (histograms to a count/sum/p50/
+        p95/p99 summary); labelled metrics map to {"k=v,...": value}.
+        """
+        if self._store is not None:
+            return self._aggregate().get_metrics()
+        result = {}
+        for name, family in list(self._metrics.items()):
+            values = {}
+            for key, child in family.children():
+                value = child.summary() if family.type == "histogram" else child.value()
+                values[",".join(f"{k}={v}" for k, v in key)] = value
+            result[name] = values[""] if list(values) == [""] else values
+        return result
+
+    def render_prometheus(self):
+        """Format every metric in the Prometheus text exposition format."""
+        if self._store is not None:
+            return self._aggregate().render_prometheus()
+        lines = []
+        for name, family in sorted(self._metrics.items()):
+            metric = _metric_name(name)
+            lines.append(f"# TYPE {metric} {family.type}")
+            for key, child in family.children():
+                if family.type == "histogram":
+                    for upper, cumulative in child.exposition_buckets():
+                        le = "+Inf" if upper == math.inf else f"{upper:.6g}"
+                        lines.append(f"{metric}_bucket{_format_labels(key, [('le', le)])} {_format_value(cumulative)}")
+                    count, total, _ = child.snapshot()
+                    lines.append(f"{metric}_sum{_format_labels(key)} {_format_value(total)}")
+                    lines.append(f"{metric}_count{_format_labels(key)} {_format_value(count)}")
+                else:
+                    lines.append(f"{metric}{_format_labels(key)} {_format_value(child.value())}")
+        return "\n".join(lines) + "\n"
 
     def reset_metrics(self):
         """Reset all collected metrics (useful for testing)."""
-        self._metrics = {}
+        with self._lock:
+            for family in self._metrics.values():
+                for _, child in family.children():
+                    child.reset()  # Zero shared slots too, not just our references
+            self._metrics = {}
@@ -0,0 +1,223 @@
+import contextlib
+import fcntl
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import uuid
+from functools import partial
+
+from .metrics import Counter, Gauge, Histogram, MetricsCollector
+
+# File layout: an 8-byte "used" offset, then records of
+#   <u32 key length><u32 slot count><JSON key, padded to 8 bytes><slot doubles>
+# The key is [name, type, [[label, value], ...], histogram config or null].
+_HEADER = struct.Struct("<Q")
+_RECORD = struct.Struct("<II")
+_WORKER_FILE = re.compile(r"^metrics_(\d+)_([0-9a-f]+)_(\d+)\.db$")
+_TEMPORARY_FILE = re.compile(r"^metrics_(\d+)_([0-9a-f]+)_(\d+)\.db\.tmp$")  # A segment before its rename
+ARCHIVE_FILE = "metrics_archive.db"
+_LOCK_FILE = ".lock"
+
+# Store tokens owned by this process; anything else carrying our pid is stale
+_live_tokens = set()
+
+
+def _padded(length):
+    return (length + 7) & ~7
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, owned by someone else
+    return True
+
+
+@contextlib.contextmanager
+def _locked(directory, operation):
+    # Only scrapes and cleanup take this lock; metric writes never do
+    with open(os.path.join(directory, _LOCK_FILE), "a+b") as handle:
+        fcntl.flock(handle, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class MMapStore:
+    """
+    Metric slots for one worker process, carved out of memory-mapped files.
+
+    Each process only ever writes its own files, so updates are plain stores
+    into shared memory: no locks and no syscalls on the write path. Other
+    processes read the files to aggregate. Files grow in fixed-size segments
+    because a mapping can't be resized while slots point into it.
+    """
+
+    def __init__(self, directory: str, segment_size: int = 1 << 20):
+        """
+        Initialize the store, archiving files left behind by dead workers.
+
+        Args:
+            directory: Directory shared by all worker processes
+            segment_size: Size of each memory-mapped file in bytes
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.pid = os.getpid()
+        self.token = uuid.uuid4().hex[:8]
+        self._segments = []
+        self._mmap = None
+        self._used = 0
+        self._lock = threading.Lock()
+        cleanup_dead_workers(directory)
+        _live_tokens.add(self.token)
+
+    def _new_segment(self, size):
+        path = os.path.join(self.directory, f"metrics_{self.pid}_{self.token}_{len(self._segments)}.db")
+        # Write the header under a name scrapes don't list, then rename, so a
+        # scrape never sees the file before its header
+        temporary = path + ".tmp"
+        fd = os.open(temporary, os.O_CREAT | os.O_RDWR | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)  # Sparse: untouched pages cost nothing
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._used = _HEADER.size
+        _HEADER.pack_into(self._mmap, 0, self._used)
+        os.replace(temporary, path)
+        self._segments.append(self._mmap)
+
+    def allocate(self, ident, size):
+        """Reserve ``size`` zeroed doubles for the series ``ident``."""
+        key = json.dumps(ident, separators=(",", ":")).encode()
+        needed = _RECORD.size + _padded(len(key)) + size * 8
+        with self._lock:
+            if self._mmap is None or self._used + needed > len(self._mmap):
+                self._new_segment(max(self.segment_size, needed + _HEADER.size))
+            mm, offset = self._mmap, self._used
+            _RECORD.pack_into(mm, offset, len(key), size)
+            mm[offset + _RECORD.size:offset + _RECORD.size + len(key)] = key
+            start = offset + _RECORD.size + _padded(len(key))
+            self._used = start + size * 8
+            # Publish the record only once it is complete
+            _HEADER.pack_into(mm, 0, self._used)
+        return memoryview(mm)[start:start + size * 8].cast("d")
+
+    def allocator(self, name, metric_type, label_key):
+        """Allocation function for one labelled series (see MetricFamily)."""
+        def allocate(size, config=None):
+            return self.allocate([name, metric_type, label_key, config], size)
+        return allocate
+
+
+def read_records(path):
+    """Yield (key, values) for every complete record in a metrics file."""
+    with open(path, "rb") as handle:
+        header = handle.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return
+        (used,) = _HEADER.unpack(header)
+        if used < _HEADER.size:
+            return  # Not initialized (e.g. a file from before headers were written first)
+        data = header + handle.read(used - _HEADER.size)
+    offset = _HEADER.size
+    while offset + _RECORD.size <= len(data):
+        key_length, size = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        key = json.loads(data[offset:offset + key_length])
+        offset += _padded(key_length)
+        yield key, struct.unpack_from(f"<{size}d", data, offset)
+        offset += size * 8
+
+
+def _worker_files(directory, pattern=_WORKER_FILE):
+    for filename in os.listdir(directory):
+        match = pattern.match(filename)
+        if match:
+            yield os.path.join(directory, filename), int(match.group(1)), match.group(2)
+
+
+_FACTORIES = {"counter": Counter, "gauge": Gauge}
+
+
+def _merge(collector, key, values):
+    name, metric_type, labels, config = key
+    factory = partial(Histogram, *config) if metric_type == "histogram" else _FACTORIES[metric_type]
+    family = collector._family(name, metric_type, factory)
+    family.labels(dict(labels)).merge(values)
+
+
+def _write_archive(path, collector):
+    chunks = []
+    used = _HEADER.size
+    for name, family in collector._metrics.items():
+        for label_key, child in family.children():
+            values = child.slots()
+            key = json.dumps([name, family.type, label_key, getattr(child, "config", None)],
+                             separators=(",", ":")).encode()
+            record = (_RECORD.pack(len(key), len(values)) + key.ljust(_padded(len(key)), b"\0")
+                      + struct.pack(f"<{len(values)}d", *values))
+            chunks.append(record)
+            used += len(record)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as handle:
+        handle.write(_HEADER.pack(used) + b"".join(chunks))
+    os.replace(temporary, path)
+
+
+def cleanup_dead_workers(directory):
+    """
+    Fold the files of exited workers into the archive and delete them.
+
+    Counters and histograms keep their totals so scraped values never go
+    backwards; gauges of dead workers are dropped. Segments a worker died
+    before renaming into place hold no records and are just deleted.
+
+    Returns:
+        List of removed file paths
+    """
+    pid = os.getpid()
+
+    def is_dead(owner, token):
+        return not _pid_alive(owner) or (owner == pid and token not in _live_tokens)
+
+    with _locked(directory, fcntl.LOCK_EX):
+        stale = [path for path, owner, token in _worker_files(directory, _TEMPORARY_FILE) if is_dead(owner, token)]
+        for path in stale:
+            os.remove(path)
+        dead = [path for path, owner, token in _worker_files(directory) if is_dead(owner, token)]
+        if not dead:
+            return stale
+        archive = MetricsCollector(directory="")
+        archive_path = os.path.join(directory, ARCHIVE_FILE)
+        for path in ([archive_path] if os.path.exists(archive_path) else []) + dead:
+            for key, values in read_records(path):
+                if key[1] != "gauge":
+                    _merge(archive, key, values)
+        _write_archive(archive_path, archive)
+        for path in dead:
+            os.remove(path)
+        return stale + dead
+
+
+def collect(directory):
+    """Sum every worker's metrics (and the archive) into a process-local collector."""
+    collector = MetricsCollector(directory="")
+    with _locked(directory, fcntl.LOCK_SH):
+        paths = [path for path, _, _ in _worker_files(directory)]
+        archive_path = os.path.join(directory, ARCHIVE_FILE)
+        if os.path.exists(archive_path):
+            paths.append(archive_path)
+        for path in paths:
+            for key, values in read_records(path):
+                _merge(collector, key, values)
+    return collector
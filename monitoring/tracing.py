@@ -0,0 +1,357 @@
+import contextlib
+import contextvars
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Spans are timed with the monotonic clock; this converts to Unix time on export
+_EPOCH_OFFSET_NS = time.time_ns() - time.monotonic_ns()
+
+_current_span = contextvars.ContextVar("lightningmcp_span", default=None)
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = ("name", "trace", "span_id", "parent_id", "start", "end", "attributes", "error")
+
+    def __init__(self, name, trace, parent_id, attributes, start=None):
+        self.name = name
+        self.trace = trace
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent_id
+        self.start = time.monotonic_ns() if start is None else start
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration(self):
+        """Duration in seconds (0 while the span is open)."""
+        return (self.end - self.start) / 1e9 if self.end is not None else 0.0
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Trace:
+    __slots__ = ("trace_id", "spans", "sampled", "error")
+
+    def __init__(self, sampled):
+        self.trace_id = random.getrandbits(128)
+        self.spans = []
+        self.sampled = sampled
+        self.error = False
+
+
+def _covered(intervals):
+    # Total length of the union of (start, end) intervals: concurrent children
+    # must not count twice against their parent.
+    total = 0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        elif end > current_end:
+            current_end = end
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class Tracer:
+    """
+    In-process span tracer built on contextvars.
+
+    Spans nest automatically across awaits and tasks. Every trace is recorded
+    while it runs; when its root span ends it is kept if it was head-sampled
+    (``sample_rate``), was slower than ``slow_threshold`` seconds or failed
+    (tail sampling). Kept traces go to a fixed-size ring buffer for
+    ``breakdown()`` and to the optional exporter.
+    """
+
+    def __init__(self, enabled: bool = True, sample_rate: float = 0.01, slow_threshold: float = 0.5,
+                 buffer_size: int = 1024, exporter=None):
+        """
+        Initialize the tracer.
+
+        Args:
+            enabled: When False, span() is a no-op
+            sample_rate: Fraction of traces kept regardless of latency
+            slow_threshold: Traces at least this slow (seconds) are always kept
+            buffer_size: Number of kept traces held in memory
+            exporter: Optional exporter receiving the spans of kept traces
+        """
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.exporter = exporter
+        # deque appends are atomic, so recording takes no lock
+        self._traces = deque(maxlen=buffer_size)
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """Context manager timing its body as a child of the current span."""
+        if not self.enabled:
+            yield _NOOP_SPAN
+            return
+        parent = _current_span.get()
+        if parent is None:
+            trace = _Trace(random.random() < self.sample_rate)
+            span = Span(name, trace, None, attributes)
+        else:
+            trace = parent.trace
+            span = Span(name, trace, parent.span_id, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.error = type(exc).__name__
+            trace.error = True
+            raise
+        finally:
+            span.end = time.monotonic_ns()
+            _current_span.reset(token)
+            trace.spans.append(span)
+            if parent is None:
+                self._finish(trace, span)
+
+    def add_span(self, name, start, end, **attributes):
+        """
+        Record an already finished child of the current span.
+
+        For stages only measured after the fact, such as executor queue wait.
+        Times are ``time.monotonic_ns()`` values. Ignored outside a trace.
+        """
+        parent = _current_span.get()
+        if not self.enabled or parent is None:
+            return
+        span = Span(name, parent.trace, parent.span_id, attributes, start=start)
+        span.end = end
+        parent.trace.spans.append(span)
+
+    def _finish(self, trace, root):
+        if not (trace.sampled or trace.error or root.duration >= self.slow_threshold):
+            return
+        self._traces.append(trace)
+        if self.exporter is not None:
+            self.exporter.export(trace.spans)
+
+    def traces(self):
+        """Kept traces, oldest first."""
+        return list(self._traces)
+
+    def breakdown(self):
+        """
+        Per-stage latency across the kept traces, flame-graph style.
+
+        ``self_ms`` is the wall time of a stage not covered by its children,
+        so stages sorted by it show where time actually goes.
+
+        Returns:
+            List of {"name", "count", "total_ms", "self_ms", "p50_ms", "p99_ms"}
+            sorted by self time, largest first
+        """
+        stages = {}
+        for trace in self.traces():
+            children = {}
+            for span in trace.spans:
+                if span.parent_id is not None:
+                    children.setdefault(span.parent_id, []).append((span.start, span.end))
+            for span in trace.spans:
+                total = span.end - span.start
+                own = total - _covered(children.get(span.span_id, ()))
+                stage = stages.setdefault(span.name, ([], [0]))
+                stage[0].append(total)
+                stage[1][0] += max(0, own)
+        result = []
+        for name, (durations, own) in stages.items():
+            durations.sort()
+            result.append({
+                "name": name,
+                "count": len(durations),
+                "total_ms": sum(durations) / 1e6,
+                "self_ms": own[0] / 1e6,
+                "p50_ms": _percentile(durations, 0.5) / 1e6,
+                "p99_ms": _percentile(durations, 0.99) / 1e6,
+            })
+        return sorted(result, key=lambda stage: stage["self_ms"], reverse=True)
+
+    def slowest(self, limit: int = 10):
+        """The ``limit`` slowest kept traces as nested span trees."""
+        def root_of(trace):
+            return next(span for span in trace.spans if span.parent_id is None)
+
+        ranked = sorted(self.traces(), key=lambda trace: root_of(trace).duration, reverse=True)
+        trees = []
+        for trace in ranked[:limit]:
+            children = {}
+            for span in trace.spans:
+                children.setdefault(span.parent_id, []).append(span)
+
+            def tree(span):
+                node = {"name": span.name, "duration_ms": (span.end - span.start) / 1e6,
+                        "attributes": span.attributes}
+                if span.error:
+                    node["error"] = span.error
+                kids = sorted(children.get(span.span_id, ()), key=lambda child: child.start)
+                if kids:
+                    node["children"] = [tree(child) for child in kids]
+                return node
+
+            trees.append({"trace_id": f"{trace.trace_id:032x}", **tree(root_of(trace))})
+        return trees
+
+    def clear(self):
+        self._traces.clear()
+
+    def shutdown(self):
+        """Flush and stop the exporter, if any."""
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans, service_name="lightningmcp"):
+    """Encode spans as an OTLP/JSON ExportTraceServiceRequest."""
+    encoded = []
+    for span in spans:
+        item = {
+            "traceId": f"{span.trace.trace_id:032x}",
+            "spanId": f"{span.span_id:016x}",
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(span.start + _EPOCH_OFFSET_NS),
+            "endTimeUnixNano": str(span.end + _EPOCH_OFFSET_NS),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id is not None:
+            item["parentSpanId"] = f"{span.parent_id:016x}"
+        encoded.append(item)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+        "scopeSpans": [{"scope": {"name": "lightningmcp"}, "spans": encoded}],
+    }]}
+
+
+_STOP = object()
+
+
+class FileExporter:
+    """
+    Writes spans to a file as OTLP/JSON lines, one batch per line, from a
+    background thread so request handling never waits on disk.
+    """
+
+    def __init__(self, path: str, batch_size: int = 512, flush_interval: float = 1.0,
+                 max_queue: int = 10000, service_name: str = "lightningmcp"):
+        """
+        Initialize the exporter.
+
+        Args:
+            path: File to append to (OTLP file exporter format)
+            batch_size: Spans per write
+            flush_interval: Max seconds a span waits before being written
+            max_queue: Traces buffered before new ones are dropped
+            service_name: service.name resource attribute
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.service_name = service_name
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._worker, name="lightningmcp-trace-export",
+                                                    daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1  # Never block a request on a slow disk
+
+    def _worker(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._write(batch)
+                return
+            if item is not None:
+                batch.extend(item)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, spans):
+        if not spans:
+            return
+        try:
+            with open(self.path, "a") as handle:
+                handle.write(json.dumps(to_otlp(spans, self.service_name)) + "\n")
+        except OSError:
+            logger.exception("Failed to export %d spans to %s", len(spans), self.path)
+
+    def shutdown(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a root span for every HTTP request."""
+
+    def __init__(self, app, tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        with self.tracer.span("request", method=scope["method"], path=scope["path"]):
+            await self.app(scope, receive, send)
@@ -0,0 +1,109 @@
+def _equivalence_groups(registry):
+    groups = {}
+    peek = getattr(registry, "peek", registry.get)  # Declared tools needn't be imported for this
+    for name in registry:
+        group = getattr(peek(name), "equivalent", None)  # Plain definition dicts have none
+        if group is not None:
+            groups.setdefault(group, []).append(name)
+    return groups
+
+
+def cost_inputs(steps, registry):
+    """
+    Names of the tools whose statistics the optimization of ``steps``
+    depends on: each step's tool and the rest of its ``equivalent`` group.
+    """
+    groups = _equivalence_groups(registry)
+    peek = getattr(registry, "peek", registry.get)
+    names = set()
+    for step in steps:
+        group = getattr(peek(step["tool_name"]), "equivalent", None)
+        names.update(groups[group] if group is not None else (step["tool_name"],))
+    return names
+
+
+def pick_alternatives(steps, registry, stats):
+    """
+    Point each step at the member of its tool's ``equivalent`` group with
+    the lowest expected cost (ties keep the requested tool).
+
+    Args:
+        steps: Plan steps
+        registry: Name -> ToolSpec mapping
+        stats: core.toolstats.ToolStatistics
+
+    Returns:
+        New list of steps
+    """
+    groups = _equivalence_groups(registry)
+    if not groups:
+        return list(steps)
+    chosen = []
+    for step in steps:
+        requested = step["tool_name"]
+        group = getattr(registry.get(requested), "equivalent", None)
+        if group is None:
+            chosen.append(step)
+            continue
+        best = min(groups[group], key=lambda name: (stats.expected_cost(name), name != requested))
+        chosen.append(step if best == requested else {**step, "tool_name": best})
+    return chosen
+
+
+def critical_path_order(ordered, dependencies, cost):
+    """
+    Reorder steps by critical path, for use as a launch priority.
+
+    A step's rank is its expected cost plus the largest rank among the steps
+    depending on it, i.e. the expected time from its start to the end of the
+    plan. Running the highest rank first keeps the longest chain moving; among
+    equal ranks, shorter (often cached) steps go first. As every step ranks
+    above its dependents, the result is still in dependency order.
+
+    Args:
+        ordered: Steps in dependency order
+        dependencies: Step id -> ids of the steps it depends on
+        cost: Function returning a tool's expected seconds per call
+
+    Returns:
+        New list of the same steps
+    """
+    costs = {step["id"]: max(cost(step["tool_name"]), 1e-9) for step in ordered}
+    ranks = {}
+    tails = {step["id"]: 0.0 for step in ordered}  # Largest rank among dependents
+    for step in reversed(ordered):
+        step_id = step["id"]
+        ranks[step_id] = costs[step_id] + tails[step_id]
+        for dep in dependencies[step_id]:
+            tails[dep] = max(tails[dep], ranks[step_id])
+    return sorted(ordered, key=lambda step: (-ranks[step["id"]], costs[step["id"]]))
+
+
+def mark_batches(steps, dependencies, registry, stats, min_hit_rate: float):
+    """
+    Mark independent calls of one tool that usually hit the cache to run as a
+    batch (one cache round trip for all of them).
+
+    Only calls that become ready together (same dependencies) are grouped,
+    and only for tools whose hit rate is at least ``min_hit_rate``: a batch
+    finishes with its slowest member, which costs little when most members
+    are served from the cache.
+
+    Returns:
+        New list of steps; grouped ones carry ``"batch": <first member id>``
+    """
+    groups = {}
+    for step in steps:
+        tool = registry.get(step["tool_name"])
+        tool_stats = stats.get(step["tool_name"])
+        if (getattr(tool, "streaming", True) or tool_stats is None
+                or tool_stats.hit_rate < min_hit_rate):
+            continue
+        key = (step["tool_name"], frozenset(dependencies[step["id"]]))
+        groups.setdefault(key, []).append(step["id"])
+    batch_of = {}
+    for members in groups.values():
+        if len(members) > 1:
+            for step_id in members:
+                batch_of[step_id] = members[0]
+    return [{**step, "batch": batch_of[step["id"]]} if step["id"] in batch_of else step for step in steps]
@@ -0,0 +1,212 @@
+import json
+from collections import OrderedDict
+
+_STEP_FIELDS = frozenset(("id", "tool_name", "parameters", "depends_on"))
+_REQUEST_FIELDS = frozenset(("steps",))
+_SCALARS = frozenset((str, int, float, bool, type(None)))
+
+
+class Slot:
+    """Placeholder for a request parameter value in a plan template."""
+
+    __slots__ = ("index",)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __repr__(self):
+        return f"Slot({self.index})"
+
+
+def _has_ref(value):
+    if isinstance(value, dict):
+        return "$ref" in value or any(_has_ref(item) for item in value.values())
+    if isinstance(value, list):
+        return any(_has_ref(item) for item in value)
+    return False
+
+
+def _is_slot(value):
+    # Literal values become slots; values wiring in other steps' outputs
+    # ($ref) shape the plan, so they stay part of the template
+    return type(value) in _SCALARS or not _has_ref(value)
+
+
+def _extra(mapping, known):
+    # Fields the planner might look at beyond the ones we template
+    if mapping.keys() <= known:
+        return ()
+    return tuple(sorted((name, repr(value)) for name, value in mapping.items() if name not in known))
+
+
+def _parameters_key(parameters, values):
+    names = []
+    for name, value in parameters.items():
+        if type(value) in _SCALARS or not _has_ref(value):
+            values.append(value)
+            names.append(name)
+        else:
+            names.append((name, json.dumps(value, sort_keys=True)))
+    return tuple(names)
+
+
+def plan_key(request):
+    """
+    Split a request into its structure and its literal parameter values.
+
+    Requests that differ only in literal parameter values get the same key,
+    and so share a compiled plan.
+
+    Args:
+        request: Request in the format accepted by plan_execution
+
+    Returns:
+        Tuple of (hashable key, slot values), or None if the request can't
+        be templated
+    """
+    values = []
+    try:
+        if "steps" in request:
+            steps = tuple(
+                (step.get("id"), step["tool_name"], tuple(step.get("depends_on", ())),
+                 _parameters_key(step.get("parameters", {}), values), _extra(step, _STEP_FIELDS))
+                for step in request["steps"])
+            return ("steps", steps, _extra(request, _REQUEST_FIELDS)), values
+        if "tool_name" in request:
+            parameters = _parameters_key(request.get("parameters", {}), values)
+            return ("tool", request["tool_name"], parameters, _extra(request, _STEP_FIELDS)), values
+    except (AttributeError, KeyError, TypeError):
+        pass  # Malformed; let the planner report it
+    return None
+
+
+def template_request(request):
+    """Copy of request with each literal parameter value replaced by a Slot, numbered like plan_key."""
+    count = 0
+
+    def slotted(parameters):
+        nonlocal count
+        template = {}
+        for name, value in parameters.items():
+            if _is_slot(value):
+                template[name] = Slot(count)
+                count += 1
+            else:
+                template[name] = value
+        return template
+
+    if "steps" in request:
+        return dict(request, steps=[dict(step, parameters=slotted(step.get("parameters", {})))
+                                    for step in request["steps"]])
+    return dict(request, parameters=slotted(request.get("parameters", {})))
+
+
+def _fill(value, values):
+    if isinstance(value, Slot):
+        return values[value.index]
+    if isinstance(value, dict):
+        return {key: _fill(item, values) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill(item, values) for item in value]
+    return value
+
+
+class CompiledPlan:
+    """A planned template, ready to be filled with a request's values."""
+
+    __slots__ = ("_steps", "_versions")
+
+    def __init__(self, plan, versions=()):
+        """
+        Compile a planned template.
+
+        Args:
+            plan: Steps planned from template_request
+            versions: (tool name, statistics version) pairs the plan was
+                optimized against
+        """
+        self._versions = tuple(versions)
+        self._steps = []  # (step, fixed parameters, [(name, slot index)], parameters need a deep fill)
+        for step in plan:
+            parameters = step["parameters"]
+            slots = [(name, value.index) for name, value in parameters.items() if isinstance(value, Slot)]
+            fixed = {name: value for name, value in parameters.items() if not isinstance(value, Slot)}
+            deep = any(_has_slot(value) for value in fixed.values())
+            self._steps.append((step, fixed, slots, deep))
+
+    def current(self, stats) -> bool:
+        """Whether no tool the plan was optimized against changed its costs materially since."""
+        return all(stats.version(name) == version for name, version in self._versions)
+
+    def fill(self, values):
+        """New list of steps with every Slot replaced by its request value."""
+        steps = []
+        for step, fixed, slots, deep in self._steps:
+            parameters = _fill(fixed, values) if deep else dict(fixed)
+            for name, index in slots:
+                parameters[name] = values[index]
+            steps.append({**step, "parameters": parameters})
+        return steps
+
+
+def _has_slot(value):
+    if isinstance(value, Slot):
+        return True
+    if isinstance(value, dict):
+        return any(_has_slot(item) for item in value.values())
+    if isinstance(value, list):
+        return any(_has_slot(item) for item in value)
+    return False
+
+
+class PlanCache:
+    """Bounded LRU of compiled plan templates, with hit/miss counts."""
+
+    def __init__(self, max_entries: int = 1024):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Max templates kept (least recently used are evicted)
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, is_current=None):
+        """
+        The plan cached under key, or None.
+
+        Args:
+            key: Plan key from plan_key
+            is_current: Optional predicate; plans failing it are dropped (and
+                counted as misses)
+        """
+        plan = self._entries.get(key)
+        if plan is not None and is_current is not None and not is_current(plan):
+            del self._entries[key]
+            plan = None
+        if plan is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return plan
+
+    def put(self, key, plan):
+        self._entries[key] = plan
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._entries)
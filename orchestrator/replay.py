@@ -0,0 +1,155 @@
+"""
+Offline replay of recorded plans: how much sooner would they have finished
+with the cost-based optimizer?
+
+Record plans by passing a PlanRecorder to the orchestrator (for a baseline,
+also pass ``optimize=False`` so plans run in request order):
+
+    ToolChainOrchestrator(..., optimize=False, recorder=PlanRecorder("plans.jsonl"))
+
+then, from the repository root:
+
+    python -m orchestrator.replay plans.jsonl --fan-out 8
+
+Each plan is simulated twice with its recorded step durations, in recorded
+order and in optimized order, under the same fan-out limit as _run_plan.
+Tool statistics are rebuilt from the recordings, so tools that were always
+cached simply look fast. Without the app's tool registry only the ordering
+is optimized (alternatives and batching need ToolSpecs).
+"""
+import argparse
+import heapq
+import json
+from collections import Counter
+
+from core.toolstats import ToolStatistics
+
+from .toolchain import ToolChainOrchestrator, step_dependencies, topological_sort
+
+
+class PlanRecorder:
+    """Appends each finished plan, with its step durations, to a JSON lines file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", buffering=1)
+
+    def __call__(self, record: dict):
+        self._file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+def load_records(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def simulate(steps, durations, max_fan_out: int = 8) -> float:
+    """
+    Makespan of a plan scheduled like _run_plan: ready steps launch in plan
+    order, at most max_fan_out at once, and a batch lasts as long as its
+    slowest member.
+
+    Args:
+        steps: Plan steps
+        durations: Step id -> seconds
+        max_fan_out: Max steps running at once
+
+    Returns:
+        Seconds from the first step starting to the last one finishing
+    """
+    ordered = topological_sort(steps)
+    priority = {step["id"]: i for i, step in enumerate(ordered)}
+    pending = {step["id"]: len(step_dependencies(step)) for step in ordered}
+    dependents = {step["id"]: [] for step in ordered}
+    for step in ordered:
+        for dep in step_dependencies(step):
+            dependents[dep].append(step)
+    batch_sizes = Counter(step["batch"] for step in ordered if "batch" in step)
+    batches = {}
+    ready, running = [], []
+
+    def make_ready(step):
+        batch = step.get("batch")
+        if batch is None or batch_sizes[batch] < 2:
+            heapq.heappush(ready, (priority[step["id"]], [step]))
+            return
+        members = batches.setdefault(batch, [])
+        members.append(step)
+        if len(members) == batch_sizes[batch]:
+            heapq.heappush(ready, (min(priority[member["id"]] for member in members), members))
+
+    for step in ordered:
+        if pending[step["id"]] == 0:
+            make_ready(step)
+    clock = 0.0
+    while ready or running:
+        while ready and len(running) < max_fan_out:
+            rank, members = heapq.heappop(ready)
+            finish = clock + max(durations[member["id"]] for member in members)
+            heapq.heappush(running, (finish, rank, members))
+        clock, _, members = heapq.heappop(running)
+        for member in members:
+            for dependent in dependents[member["id"]]:
+                pending[dependent["id"]] -= 1
+                if pending[dependent["id"]] == 0:
+                    make_ready(dependent)
+    return clock
+
+
+def replay(records, max_fan_out: int = 8, tool_registry=None, stats=None) -> dict:
+    """
+    Compare recorded plans in recorded and optimized order.
+
+    Args:
+        records: Plans as written by PlanRecorder
+        max_fan_out: Fan-out limit to simulate
+        tool_registry: Optional name -> ToolSpec mapping (enables alternatives
+            and batching)
+        stats: Optional ToolStatistics (default: rebuilt from the records)
+
+    Returns:
+        Dict with the plan count, total simulated seconds for both orders,
+        the speedup and how many plans got faster or slower
+    """
+    if stats is None:
+        stats = ToolStatistics()
+        for record in records:
+            for step in record["steps"]:
+                stats.observe_call(step["tool_name"], step["duration"])
+    orchestrator = ToolChainOrchestrator(tool_registry=tool_registry if tool_registry is not None else {},
+                                         max_fan_out=max_fan_out, stats=stats, plan_cache_size=0)
+    summary = {"plans": len(records), "baseline_seconds": 0.0, "optimized_seconds": 0.0,
+               "improved": 0, "regressed": 0}
+    for record in records:
+        steps = record["steps"]
+        recorded = {step["id"]: step for step in steps}
+        baseline = simulate(steps, {step["id"]: step["duration"] for step in steps}, max_fan_out)
+        optimized_steps = orchestrator.optimize_plan({"steps": steps})["steps"]
+        # A step moved to an alternative tool takes that tool's expected time
+        durations = {step["id"]: recorded[step["id"]]["duration"]
+                     if step["tool_name"] == recorded[step["id"]]["tool_name"]
+                     else stats.expected_latency(step["tool_name"])
+                     for step in optimized_steps}
+        optimized = simulate(optimized_steps, durations, max_fan_out)
+        summary["baseline_seconds"] += baseline
+        summary["optimized_seconds"] += optimized
+        summary["improved"] += optimized < baseline * (1 - 1e-9)
+        summary["regressed"] += optimized > baseline * (1 + 1e-9)
+    summary["speedup"] = (summary["baseline_seconds"] / summary["optimized_seconds"]
+                          if summary["optimized_seconds"] else 1.0)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded plans with the cost-based optimizer")
+    parser.add_argument("path", help="JSON lines file written by PlanRecorder")
+    parser.add_argument("--fan-out", type=int, default=8, help="max steps running at once")
+    args = parser.parse_args(argv)
+    print(json.dumps(replay(load_records(args.path), args.fan_out), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,500 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import Counter
+
+from core.engine import SparkEngine, assemble_chunks
+from core.tools import ToolRegistry
+from core.toolstats import ToolStatistics
+from monitoring.metrics import MetricsCollector
+from monitoring.tracing import Tracer
+
+from .optimizer import cost_inputs, critical_path_order, mark_batches, pick_alternatives
+from .plancache import CompiledPlan, PlanCache, plan_key, template_request
+
+logger = logging.getLogger(__name__)
+
+
+class PlanError(ValueError):
+    """Raised when a request is malformed or its plan is not a valid dependency graph."""
+
+
+class StepExecutionError(RuntimeError):
+    """Raised when a plan step fails; the remaining steps are cancelled."""
+
+    def __init__(self, step_id, tool_name, error):
+        super().__init__(f"Step {step_id!r} ({tool_name}) failed: {error}")
+        self.step_id = step_id
+        self.tool_name = tool_name
+        self.error = error
+
+
+def _check_refs(value, where):
+    # Every {"$ref": ...} must name its step (and path) as a string
+    if isinstance(value, dict):
+        if set(value) == {"$ref"}:
+            if not isinstance(value["$ref"], str) or not value["$ref"]:
+                raise PlanError(f"{where}: $ref must be a non-empty string")
+        else:
+            for key, item in value.items():
+                _check_refs(item, f"{where}.{key}")
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            _check_refs(item, f"{where}[{i}]")
+
+
+def _check_step(step, where):
+    """Raise PlanError unless step has the shape analyze_request expects."""
+    if not isinstance(step, dict):
+        raise PlanError(f"{where}: a step must be an object")
+    if not isinstance(step.get("tool_name"), str):
+        raise PlanError(f"{where}: tool_name must be a string")
+    if "id" in step and not isinstance(step["id"], str):
+        raise PlanError(f"{where}: id must be a string")
+    parameters = step.get("parameters", {})
+    if not isinstance(parameters, dict):
+        raise PlanError(f"{where}: parameters must be an object")
+    depends_on = step.get("depends_on", [])
+    if not isinstance(depends_on, list) or not all(isinstance(dep, str) for dep in depends_on):
+        raise PlanError(f"{where}: depends_on must be a list of step ids")
+    _check_refs(parameters, f"{where}.parameters")
+
+
+def _collect_refs(value, refs):
+    # Parameters reference earlier outputs as {"$ref": "<step_id>[.<path>]"}
+    if isinstance(value, dict):
+        if set(value) == {"$ref"}:
+            refs.add(value["$ref"].split(".", 1)[0])
+        else:
+            for item in value.values():
+                _collect_refs(item, refs)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_refs(item, refs)
+    return refs
+
+
+def step_dependencies(step):
+    """
+    Ids of the steps a step depends on.
+
+    Args:
+        step: Plan step with optional ``depends_on`` and ``$ref`` parameters
+
+    Returns:
+        Set of step ids
+    """
+    return set(step.get("depends_on", [])) | _collect_refs(step.get("parameters", {}), set())
+
+
+def topological_sort(steps):
+    """
+    Order plan steps so every step comes after its dependencies.
+
+    Whenever several steps are ready, the earliest in the plan comes first
+    (Kahn's algorithm over a heap of plan positions), so a plan that is already
+    in dependency order comes back unchanged.
+
+    Args:
+        steps: List of plan steps, each with a unique ``id``
+
+    Returns:
+        New list of the same steps in dependency order
+    """
+    index = {}
+    for step in steps:
+        if step["id"] in index:
+            raise PlanError(f"Duplicate step id: {step['id']}")
+        index[step["id"]] = step
+
+    pending = {}
+    dependents = {step_id: [] for step_id in index}
+    for step in steps:
+        deps = step_dependencies(step)
+        for dep in deps:
+            if dep not in index:
+                raise PlanError(f"Step {step['id']!r} depends on unknown step {dep!r}")
+            dependents[dep].append(step["id"])
+        pending[step["id"]] = len(deps)
+
+    position = {step_id: i for i, step_id in enumerate(index)}
+    ready = [i for i, step in enumerate(steps) if pending[step["id"]] == 0]
+    ordered = []
+    while ready:
+        step = steps[heapq.heappop(ready)]
+        ordered.append(step)
+        for dependent in dependents[step["id"]]:
+            pending[dependent] -= 1
+            if pending[dependent] == 0:
+                heapq.heappush(ready, position[dependent])
+
+    if len(ordered) != len(steps):
+        cyclic = sorted(step_id for step_id, count in pending.items() if count)
+        raise PlanError(f"Plan has a dependency cycle between steps: {', '.join(cyclic)}")
+    return ordered
+
+
+def resolve_references(value, results):
+    """
+    Replace ``{"$ref": "step.path"}`` markers with outputs of finished steps.
+
+    The path after the step id is a dot-separated list of dict keys or list
+    indices into that step's result.
+
+    Raises:
+        PlanError: If a path doesn't exist in the referenced result
+    """
+    if isinstance(value, dict):
+        if set(value) == {"$ref"}:
+            step_id, *path = value["$ref"].split(".")
+            resolved = results[step_id]
+            try:
+                for part in path:
+                    resolved = resolved[int(part)] if isinstance(resolved, list) else resolved[part]
+            except (KeyError, IndexError, ValueError, TypeError):
+                raise PlanError(f"Reference {value['$ref']!r} does not match the output of step {step_id!r}") from None
+            return resolved
+        return {key: resolve_references(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_references(item, results) for item in value]
+    return value
+
+
 class ToolChainOrchestrator:
-    def __init__(self):
+    def __init__(self, engine=None, max_fan_out: int = 8, tool_registry=None, metrics=None, tracer=None,
+                 default_timeout: float = None, plan_cache_size: int = 1024, stats=None,
+                 optimize: bool = True, batch_hit_rate: float = 0.5, recorder=None):
         # Load tool registry, dependencies, etc.
-        self.tool_registry = {}  # Placeholder for tool definitions
+        self.tool_registry = tool_registry if tool_registry is not None else ToolRegistry()
+        self.engine = engine
+        self.max_fan_out = max_fan_out  # Max steps of one plan running at once
+        self.default_timeout = default_timeout  # Seconds per plan unless the context has a deadline
+        # Per-tool costs for optimize_plan, shared with the engine that feeds them
+        if stats is None:
+            stats = engine.stats if engine is not None else ToolStatistics()
+        self.stats = stats
+        self.optimize = optimize  # False runs plans in request order (e.g. to record baselines)
+        self.batch_hit_rate = batch_hit_rate  # Min hit rate for batching calls of one tool
+        # Optional callable given each finished plan with its step durations,
+        # e.g. an orchestrator.replay.PlanRecorder
+        self.recorder = recorder
+        # Compiled plans by request structure; 0 disables it (e.g. for a
+        # planner whose output depends on parameter values)
+        self.plan_cache = PlanCache(plan_cache_size) if plan_cache_size else None
+        self._registrations = 0
+        self._plan_cache_version = None
+        self.metrics = metrics if metrics is not None else MetricsCollector()
+        self.tracer = tracer if tracer is not None else Tracer(enabled=False)
 
     def register_tool(self, tool_definition):
-        # Method to register tools
-        self.tool_registry[tool_definition["name"]] = tool_definition
+        # Method to register tools: a ToolSpec or a plain definition dict
+        name = tool_definition["name"] if isinstance(tool_definition, dict) else tool_definition.name
+        self.tool_registry[name] = tool_definition
+        self._registrations += 1
 
     def analyze_request(self, request):
         # Analyze the incoming request to understand the user's intent and required tools
-        print(f"Analyzing request: {request}")
+        logger.debug("Analyzing request: %s", request)
         # This would involve natural language processing and understanding, likely using an LLM
-        # Placeholder: Return a simple plan based on a hypothetical tool name in the request
+        # Placeholder: requests either name one tool or list explicit steps
+        if not isinstance(request, dict):
+            raise PlanError("A request must be an object")
+        if "steps" in request:
+            if not isinstance(request["steps"], list) or not request["steps"]:
+                raise PlanError("steps must be a non-empty list")
+            for i, step in enumerate(request["steps"]):
+                _check_step(step, f"steps[{i}]")
+            return {"steps": [
+                {
+                    "id": step.get("id", f"step_{i}"),
+                    "tool_name": step["tool_name"],
+                    "parameters": step.get("parameters", {}),
+                    "depends_on": list(step.get("depends_on", [])),
+                }
+                for i, step in enumerate(request["steps"])
+            ]}
         if "tool_name" in request:
-            return {"initial_tool": request["tool_name"], "parameters": request.get("parameters", {})}
+            _check_step(request, "request")
+            return {"steps": [{
+                "id": "step_0",
+                "tool_name": request["tool_name"],
+                "parameters": request.get("parameters", {}),
+                "depends_on": [],
+            }]}
         return None
 
     def optimize_plan(self, plan):
-        # Optimize the execution plan based on tool dependencies, performance metrics, etc.
-        print(f"Optimizing plan: {plan}")
-        # This could involve dynamic dependency resolution and reordering of tool calls
-        # Placeholder: Simple pass-through
-        return plan
+        """
+        Rewrite a plan to minimize its expected critical-path latency, using
+        the per-tool statistics gathered by the engine.
+
+        Each step calls the cheapest tool of its ``equivalent`` group, steps
+        are ordered by critical path (the order _run_plan launches ready steps
+        in), and independent calls of a mostly cached tool are batched.
+
+        Args:
+            plan: {"steps": [...]} from analyze_request
+
+        Returns:
+            The optimized plan
+        """
+        logger.debug("Optimizing plan: %s", plan)
+        if not self.optimize:
+            return plan
+        steps = pick_alternatives(plan["steps"], self.tool_registry, self.stats)
+        ordered = topological_sort(steps)
+        dependencies = {step["id"]: step_dependencies(step) for step in ordered}
+        steps = critical_path_order(ordered, dependencies, self.stats.expected_latency)
+        steps = mark_batches(steps, dependencies, self.tool_registry, self.stats, self.batch_hit_rate)
+        return {**plan, "steps": steps}
 
     def plan_execution(self, request):
+        """
+        Plan a request, reusing the compiled plan of any earlier request with
+        the same structure (same steps, tools, parameter names and wiring).
+
+        Args:
+            request: {"tool_name", "parameters"} or {"steps": [...]}
+
+        Returns:
+            List of steps in dependency order, or None if it can't be planned
+        """
+        with self.metrics.timer("planning_seconds"):
+            keyed = plan_key(request) if self.plan_cache is not None and isinstance(request, dict) else None
+            if keyed is None:
+                return self._plan(request)
+            key, values = keyed
+            self._check_registry()
+            compiled = self.plan_cache.get(key, self._is_current)
+            self.metrics.increment_counter("plan_cache_total", labels={"result": "miss" if compiled is None else "hit"})
+            if compiled is None:
+                plan = self._plan(template_request(request))
+                if plan is None:
+                    return None  # Not cached: registering the missing tool may fix it
+                compiled = CompiledPlan(plan, self._cost_versions(plan))
+                self.plan_cache.put(key, compiled)
+            return compiled.fill(values)
+
+    def _cost_versions(self, plan):
+        # Statistics the plan was optimized against (none without optimization)
+        if not self.optimize:
+            return ()
+        return [(name, self.stats.version(name)) for name in cost_inputs(plan, self.tool_registry)]
+
+    def _is_current(self, compiled):
+        # Only plans whose tools' costs changed materially are recompiled
+        return compiled.current(self.stats)
+
+    def _check_registry(self):
+        # Any registration (through us or straight into a ToolRegistry) may
+        # change how requests plan
+        version = (getattr(self.tool_registry, "version", None), self._registrations)
+        if version != self._plan_cache_version:
+            self.plan_cache.clear()
+            self._plan_cache_version = version
+
+    def _plan(self, request):
         # Analyze, optimize, and plan tool execution
         analysis_result = self.analyze_request(request)
         if not analysis_result:
             return None  # Could not understand the request
 
+        # Every step must name a registered tool
+        if not all(step["tool_name"] in self.tool_registry for step in analysis_result["steps"]):
+            return None
+
         optimized_plan = self.optimize_plan(analysis_result)
+        if not optimized_plan:
+            return None
+        return topological_sort(optimized_plan["steps"])
 
-        # Generate the sequence of tool calls
-        # This is a simplified placeholder. A real orchestrator would handle complex chains.
-        if optimized_plan and optimized_plan["initial_tool"] in self.tool_registry:
-            return [{
-                "tool_name": optimized_plan["initial_tool"],
-                "parameters": optimized_plan["parameters"]
-            }]
-        return None
+    def _get_engine(self):
+        if self.engine is None:
+            self.engine = SparkEngine(stats=self.stats)  # Created once; apps inject the runtime's engine
+        return self.engine
 
-    # Placeholder method to execute a planned tool sequence (will interact with SparkEngine)
     async def execute_plan(self, plan_sequence, context):
-        print(f"Executing plan sequence: {plan_sequence}")
-        # Iterate through the sequence and call the SparkEngine
-        results = []
-        # Import SparkEngine here to avoid circular dependency for now
-        from core.engine import SparkEngine
-        engine = SparkEngine()  # Instantiate engine (should be dependency injected in a real app)
-
-        for step in plan_sequence:
+        """
+        Execute a plan, running independent steps concurrently.
+
+        A step starts as soon as all of its dependencies have finished, with
+        at most ``max_fan_out`` steps running at once; when more are ready,
+        the earliest in the plan goes first. Steps marked with the same
+        ``batch`` run as one engine batch. If any step fails the others are
+        cancelled and a StepExecutionError is raised.
+
+        Args:
+            plan_sequence: List of plan steps
+            context: Shared execution context
+
+        Returns:
+            List of step results in plan order
+        """
+        logger.debug("Executing plan sequence: %s", plan_sequence)
+        plan_sequence = self._with_ids(plan_sequence)
+        with self.metrics.timer("plan_latency_seconds"):
+            results = await self._run_plan(plan_sequence, context)
+        return [results[step["id"]] for step in plan_sequence]
+
+    async def stream_plan(self, plan_sequence, context, max_buffer: int = 64):
+        """
+        Execute a plan and yield events as steps make progress.
+
+        Events are dicts: ``{"event": "chunk", "step", "data"}`` for each
+        chunk of a streaming tool, ``{"event": "result", "step", "data"}``
+        when a step finishes, then a final ``{"event": "end"}`` or
+        ``{"event": "error", "step", "message"}``. At most ``max_buffer``
+        events are queued, so a slow consumer pauses the plan.
+
+        Args:
+            plan_sequence: List of plan steps
+            context: Shared execution context
+            max_buffer: Max events buffered ahead of the consumer
+        """
+        plan_sequence = self._with_ids(plan_sequence)
+        events = asyncio.Queue(max_buffer)
+
+        async def produce():
+            try:
+                await self._run_plan(plan_sequence, context, emit=events.put)
+            except Exception as exc:
+                await events.put({"event": "error", "step": getattr(exc, "step_id", None), "message": str(exc)})
+            else:
+                await events.put({"event": "end"})
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                event = await events.get()
+                yield event
+                if event["event"] in ("end", "error"):
+                    return
+        finally:
+            # Client went away or the plan finished: stop any running steps
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+    @staticmethod
+    def _with_ids(plan_sequence):
+        # Steps built by hand may omit ids; number them like analyze_request
+        return [step if "id" in step else {**step, "id": f"step_{i}"}
+                for i, step in enumerate(plan_sequence)]
+
+    async def _run_plan(self, plan_sequence, context, emit=None):
+        engine = self._get_engine()
+        ordered = topological_sort(plan_sequence)
+        pending = {step["id"]: len(step_dependencies(step)) for step in ordered}
+        dependents = {step["id"]: [] for step in ordered}
+        for step in ordered:
+            for dep in step_dependencies(step):
+                dependents[dep].append(step)
+        priority = {step["id"]: i for i, step in enumerate(ordered)}
+        batch_sizes = Counter(step["batch"] for step in ordered if "batch" in step)
+        batches = {}  # Batch id -> members ready so far
+
+        results = {}
+        durations = {} if self.recorder is not None else None
+        ready = []  # Heap of (priority, steps to run together)
+        running = 0
+        loop = asyncio.get_running_loop()
+        if self.default_timeout is not None and "deadline" not in context:
+            context["deadline"] = loop.time() + self.default_timeout
+        # Every step (and every retry inside it) shares the request's deadline
+        deadline = context.get("deadline")
+
+        def make_ready(step):
+            batch = step.get("batch")
+            if batch is None or batch_sizes[batch] < 2:
+                heapq.heappush(ready, (priority[step["id"]], [step]))
+                return
+            # Members share their dependencies, so they all get here together
+            members = batches.setdefault(batch, [])
+            members.append(step)
+            if len(members) == batch_sizes[batch]:
+                heapq.heappush(ready, (min(priority[member["id"]] for member in members), members))
+
+        def launch(group):
+            nonlocal running
+            while ready and running < self.max_fan_out:
+                running += 1
+                group.create_task(run_unit(heapq.heappop(ready)[1], group))
+
+        async def call(step, tool_name, params):
+            if deadline is not None and loop.time() >= deadline:
+                raise TimeoutError("Deadline exceeded before the step started")
+            if emit is None or not engine.is_streaming(tool_name):
+                return await engine.execute_tool(tool_name, params, context)
+            # Forward chunks as they arrive; dependents get the assembled result
+            chunks = []
+            async with asyncio.timeout_at(deadline):
+                async for chunk in engine.stream_tool(tool_name, params, context):
+                    chunks.append(chunk)
+                    await emit({"event": "chunk", "step": step["id"], "data": chunk})
+            return assemble_chunks(chunks)
+
+        async def run_step(step):
             tool_name = step["tool_name"]
-            params = step["parameters"]
-            result = await engine.execute_tool(tool_name, params, context)
-            results.append(result)
-            # In a real scenario, the context might be updated with the result for subsequent tools
+            try:
+                params = resolve_references(step["parameters"], results)
+                with self.tracer.span("plan.step", step=step["id"], tool=tool_name):
+                    results[step["id"]] = await call(step, tool_name, params)
+            except Exception as exc:
+                raise StepExecutionError(step["id"], tool_name, exc) from exc
+
+        async def run_batch(steps):
+            if deadline is not None and loop.time() >= deadline:
+                raise StepExecutionError(steps[0]["id"], steps[0]["tool_name"],
+                                         TimeoutError("Deadline exceeded before the step started"))
+            calls = []
+            for step in steps:
+                try:
+                    params = resolve_references(step["parameters"], results)
+                except PlanError as exc:
+                    raise StepExecutionError(step["id"], step["tool_name"], exc) from exc
+                calls.append({"tool_name": step["tool_name"], "parameters": params})
+            with self.tracer.span("plan.batch", steps=len(steps), tool=steps[0]["tool_name"]):
+                outcomes = await engine.execute_batch(calls, context)
+            for step, outcome in zip(steps, outcomes):
+                if isinstance(outcome, BaseException):
+                    raise StepExecutionError(step["id"], step["tool_name"], outcome) from outcome
+                results[step["id"]] = outcome
+
+        async def run_unit(steps, group):
+            nonlocal running
+            started = time.perf_counter()
+            try:
+                await (run_step(steps[0]) if len(steps) == 1 else run_batch(steps))
+            finally:
+                running -= 1
+            if durations is not None:
+                for step in steps:
+                    durations[step["id"]] = time.perf_counter() - started
+            launch(group)
+            for step in steps:
+                if emit is not None:
+                    await emit({"event": "result", "step": step["id"], "data": results[step["id"]]})
+                for dependent in dependents[step["id"]]:
+                    pending[dependent["id"]] -= 1
+                    if pending[dependent["id"]] == 0:
+                        make_ready(dependent)
+            launch(group)
+
+        with self.tracer.span("plan", steps=len(ordered)):
+            try:
+                # The task group cancels every other branch when one step fails
+                async with asyncio.TaskGroup() as group:
+                    for step in ordered:
+                        if pending[step["id"]] == 0:
+                            make_ready(step)
+                    launch(group)
+            except BaseExceptionGroup as failures:
+                error = failures.exceptions[0]
+                raise error from error.__cause__
 
+        if durations is not None:
+            self.recorder({"steps": [
+                {"id": step["id"], "tool_name": step["tool_name"],
+                 "depends_on": sorted(step_dependencies(step)), "duration": durations[step["id"]]}
+                for step in plan_sequence]})
         return results
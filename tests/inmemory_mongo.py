@@ -0,0 +1,124 @@
+import copy
+import re
+from types import SimpleNamespace
+
+
+def _matcher(filter_):
+    # Only _id filters are supported: that's all the storage backends issue
+    unsupported = set(filter_) - {"_id"}
+    if unsupported:
+        raise NotImplementedError(f"Unsupported filter fields: {sorted(unsupported)}")
+    if "_id" not in filter_:
+        return lambda key: True
+    condition = filter_["_id"]
+    if not isinstance(condition, dict):
+        return lambda key: key == condition
+    if set(condition) == {"$in"}:
+        wanted = set(condition["$in"])
+        return lambda key: key in wanted
+    if set(condition) == {"$regex"}:
+        pattern = re.compile(condition["$regex"])
+        return lambda key: isinstance(key, str) and pattern.search(key) is not None
+    raise NotImplementedError(f"Unsupported _id condition: {condition}")
+
+
+class InMemoryCursor:
+    """Async cursor over a snapshot of matching documents."""
+
+    def __init__(self, documents):
+        self._documents = documents
+
+    def sort(self, key, direction=1):
+        self._documents.sort(key=lambda document: document[key], reverse=direction < 0)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._documents:
+            yield document
+
+    async def to_list(self, length=None):
+        return self._documents[:length] if length else list(self._documents)
+
+
+class InMemoryCollection:
+    """
+    Minimal in-process stand-in for a motor collection, for tests.
+
+    Implements the calls data.async_storage.MongoStorage makes, with _id-only
+    filters. Documents are deep-copied in and out, as a BSON round trip would.
+    """
+
+    def __init__(self):
+        self._documents = {}
+
+    def _select(self, filter_):
+        match = _matcher(filter_ or {})
+        return [document for key, document in self._documents.items() if match(key)]
+
+    async def find_one(self, filter_=None):
+        for document in self._select(filter_):
+            return copy.deepcopy(document)
+        return None
+
+    def find(self, filter_=None):
+        return InMemoryCursor([copy.deepcopy(document) for document in self._select(filter_)])
+
+    async def insert_one(self, document):
+        if document["_id"] in self._documents:
+            from pymongo.errors import DuplicateKeyError
+            raise DuplicateKeyError(f"E11000 duplicate key error: {document['_id']!r}")
+        self._documents[document["_id"]] = copy.deepcopy(document)
+        return SimpleNamespace(inserted_id=document["_id"])
+
+    async def replace_one(self, filter_, replacement, upsert=False):
+        matches = self._select(filter_)
+        if matches or upsert:
+            key = matches[0]["_id"] if matches else filter_["_id"]
+            self._documents[key] = copy.deepcopy({**replacement, "_id": key})
+        return SimpleNamespace(matched_count=len(matches[:1]))
+
+    async def delete_one(self, filter_):
+        for document in self._select(filter_):
+            del self._documents[document["_id"]]
+            return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def bulk_write(self, requests, ordered=True):
+        # Accepts pymongo ReplaceOne / DeleteOne operations; pymongo has no
+        # public accessors for their fields, so this follows its internals
+        for request in requests:
+            if type(request).__name__ == "ReplaceOne":
+                await self.replace_one(request._filter, request._doc, upsert=request._upsert)
+            elif type(request).__name__ == "DeleteOne":
+                await self.delete_one(request._filter)
+            else:
+                raise NotImplementedError(f"Unsupported bulk operation: {request!r}")
+        return SimpleNamespace(acknowledged=True)
+
+
+class InMemoryMongoClient:
+    """client[database][collection] access to InMemoryCollections."""
+
+    def __init__(self):
+        self._databases = {}
+
+    def __getitem__(self, database):
+        collections = self._databases.setdefault(database, {})
+        return _Database(collections)
+
+    def close(self):
+        pass
+
+
+class _Database:
+    def __init__(self, collections):
+        self._collections = collections
+
+    def __getitem__(self, name):
+        return self._collections.setdefault(name, InMemoryCollection())
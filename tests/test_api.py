@@ -0,0 +1,228 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from core.cache import InMemoryInvalidationBus, VectorCache
+from core.inmemory import InMemoryRedis
+from core.security import Authenticator, PermissionSystem
+from lightningmcp import LightningMCP
+from monitoring.tracing import Tracer
+
+
+@pytest.fixture
+def mcp():
+    mcp = LightningMCP(cache=VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus()))
+
+    @mcp.tool()
+    def calculate(a: float, operation: str, b: float) -> float:
+        return a + b if operation == "+" else a * b
+
+    return mcp
+
+
+def test_execute_toolchain_uses_shared_runtime(mcp):
+    events = []
+
+    @mcp.on_startup
+    async def started():
+        events.append("startup")
+
+    @mcp.on_shutdown
+    async def stopped():
+        events.append("shutdown")
+
+    with TestClient(mcp.app) as client:
+        engine = mcp.runtime.engine
+        payload = {"request_data": {"tool_name": "calculate", "parameters": {"a": 2, "operation": "*", "b": 3}}}
+        for _ in range(2):
+            response = client.post("/execute_toolchain", json=payload)
+            assert response.status_code == 200
+            assert response.json() == {"results": [6]}
+        # Same engine and orchestrator across requests, with the app's tools
+        assert mcp.runtime.engine is engine
+        assert mcp.runtime.orchestrator.tool_registry is mcp.tools
+
+    assert events == ["startup", "shutdown"]
+    assert not mcp.runtime.started
+    assert mcp.runtime.engine is None
+
+
+def test_unplannable_request_is_rejected(mcp):
+    with TestClient(mcp.app) as client:
+        response = client.post("/execute_toolchain", json={"request_data": {"tool_name": "missing"}})
+        assert response.status_code == 400
+        cyclic = {"steps": [
+            {"id": "a", "tool_name": "calculate", "parameters": {"a": {"$ref": "b"}, "operation": "+", "b": 1}},
+            {"id": "b", "tool_name": "calculate", "parameters": {"a": {"$ref": "a"}, "operation": "+", "b": 1}},
+        ]}
+        response = client.post("/execute_toolchain", json={"request_data": cyclic})
+        assert response.status_code == 400
+        assert "cycle" in response.json()["detail"]
+
+        # Malformed plans are client errors, not server errors
+        for malformed in ({"steps": "abc"}, {"steps": [{"parameters": {}}]},
+                          {"tool_name": "calculate", "parameters": [1, "+", 2]},
+                          {"steps": [{"tool_name": "calculate", "depends_on": "a"}]},
+                          {"tool_name": "calculate", "parameters": {"a": {"$ref": 1}, "operation": "+", "b": 1}}):
+            assert client.post("/execute_toolchain", json={"request_data": malformed}).status_code == 400
+        # A reference that doesn't match the referenced output fails its step
+        dangling = {"steps": [
+            {"id": "a", "tool_name": "calculate", "parameters": {"a": 1, "operation": "+", "b": 1}},
+            {"id": "b", "tool_name": "calculate", "parameters": {"a": {"$ref": "a.missing"}, "operation": "+", "b": 1}},
+        ]}
+        response = client.post("/execute_toolchain", json={"request_data": dangling})
+        assert response.status_code == 422 and "a.missing" in response.json()["detail"]
+
+
+def test_execute_batch(mcp):
+    with TestClient(mcp.app) as client:
+        response = client.post("/execute_batch", json={"calls": [
+            {"tool_name": "calculate", "parameters": {"a": 1, "operation": "+", "b": 2}},
+            {"tool_name": "calculate", "parameters": {"a": 3, "operation": "*", "b": 4}},
+            {"tool_name": "unknown", "parameters": {}},
+        ]})
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert results[:2] == [{"result": 3}, {"result": 12}]
+        assert "Unknown tool" in results[2]["error"]
+
+
+def test_stream_toolchain(mcp):
+    @mcp.tool()
+    async def spell(word: str):
+        for letter in word:
+            yield letter
+
+    request = {"request_data": {"steps": [
+        {"id": "letters", "tool_name": "spell", "parameters": {"word": "hi"}},
+        {"id": "sum", "tool_name": "calculate", "parameters": {"a": 1, "operation": "+", "b": 1}},
+    ]}}
+    with TestClient(mcp.app) as client:
+        response = client.post("/execute_toolchain/stream?format=ndjson", json=request)
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        events = [json.loads(line) for line in response.text.splitlines()]
+        chunks = [event["data"] for event in events if event["event"] == "chunk"]
+        assert chunks == ["h", "i"]
+        results = {event["step"]: event["data"] for event in events if event["event"] == "result"}
+        assert results == {"letters": "hi", "sum": 2}
+        assert events[-1] == {"event": "end"}
+
+        response = client.post("/execute_toolchain/stream", json=request)
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert "event: chunk\ndata: " in response.text
+
+
+def test_tool_listing_and_validation(mcp):
+    with TestClient(mcp.app) as client:
+        tools = client.get("/tools").json()["tools"]
+        assert tools[0]["name"] == "calculate"
+        assert tools[0]["parameters"]["properties"]["a"] == {"type": "number"}
+
+        payload = {"request_data": {"tool_name": "calculate", "parameters": {"a": "x", "operation": "+", "b": 1}}}
+        response = client.post("/execute_toolchain", json=payload)
+        assert response.status_code == 422
+        assert "a: expected number" in response.json()["detail"]
+
+
+def test_metrics_endpoint(mcp):
+    with TestClient(mcp.app) as client:
+        payload = {"request_data": {"tool_name": "calculate", "parameters": {"a": 1, "operation": "+", "b": 1}}}
+        for _ in range(2):
+            client.post("/execute_toolchain", json=payload)
+        response = client.get("/metrics")
+        assert response.headers["content-type"].startswith("text/plain")
+        assert 'cache_lookups_total{tool="calculate"} 2' in response.text
+        assert 'cache_misses_total{tool="calculate"} 1' in response.text
+        assert 'tool_latency_seconds_count{tool="calculate"} 1' in response.text
+        assert "plan_latency_seconds_count 2" in response.text
+
+
+def test_debug_traces_breaks_down_request_latency():
+    mcp = LightningMCP(cache=VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus()),
+                       tracer=Tracer(sample_rate=1.0))
+
+    @mcp.tool()
+    def double(x: int) -> int:
+        return 2 * x
+
+    with TestClient(mcp.app) as client:
+        payload = {"request_data": {"tool_name": "double", "parameters": {"x": 2}}}
+        assert client.post("/execute_toolchain", json=payload).json() == {"results": [4]}
+        report = client.get("/debug/traces").json()
+
+    stages = {stage["name"] for stage in report["stages"]}
+    assert {"request", "plan", "plan.step", "cache.lookup", "tool.call", "executor.queue_wait"} <= stages
+    tree = next(trace for trace in report["slowest"] if trace["attributes"]["path"] == "/execute_toolchain")
+    assert [child["name"] for child in tree["children"]] == ["plan"]
+
+
+def test_every_plan_step_is_authorized():
+    rules = {
+        "analyst": {"allow": ["tool:calc*:execute"]},
+        "admin": {"inherits": ["analyst"], "allow": ["tool:*:*"]},
+    }
+    users = {"a-token": {"user_id": "ann", "role": "analyst"}, "b-token": {"user_id": "bob", "role": "admin"}}
+    mcp = LightningMCP(cache=VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus()),
+                       permissions=PermissionSystem(rules), authenticator=Authenticator(users.get))
+
+    @mcp.tool()
+    def calculate(a: float, b: float) -> float:
+        return a + b
+
+    @mcp.tool()
+    def purge() -> bool:
+        return True
+
+    plan = {"steps": [
+        {"id": "sum", "tool_name": "calculate", "parameters": {"a": 1, "b": 2}},
+        {"id": "purge", "tool_name": "purge", "parameters": {}},
+    ]}
+    with TestClient(mcp.app) as client:
+        response = client.post("/execute_toolchain", json={"request_data": plan})
+        assert response.status_code == 401
+        response = client.post("/execute_toolchain", json={"request_data": plan},
+                               headers={"Authorization": "Bearer a-token"})
+        assert response.status_code == 403
+        assert "purge" in response.json()["detail"]
+        response = client.post("/execute_batch", json={"calls": [{"tool_name": "purge"}]},
+                               headers={"Authorization": "Bearer a-token"})
+        assert response.status_code == 403
+        response = client.post("/execute_toolchain", json={"request_data": plan},
+                               headers={"Authorization": "Bearer b-token"})
+        assert response.json() == {"results": [3, True]}
+
+
+def test_request_timeout_returns_504(mcp):
+    @mcp.tool()
+    async def slow() -> str:
+        await asyncio.sleep(5)
+        return "late"
+
+    with TestClient(mcp.app) as client:
+        response = client.post("/execute_toolchain", json={"request_data": {"tool_name": "slow"}, "timeout": 0.05})
+        assert response.status_code == 504
+
+
+@pytest.mark.asyncio
+async def test_requests_during_the_drain_get_503(mcp):
+    import httpx
+    runtime = mcp.runtime
+    await runtime.startup()
+    with runtime.track_request():  # A request still in flight
+        stopping = asyncio.create_task(runtime.shutdown())
+        await asyncio.sleep(0)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=mcp.app), base_url="http://test") as client:
+            response = await client.get("/tools")
+        assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+        with pytest.raises(RuntimeError):
+            await runtime.startup()
+        assert runtime.engine is not None  # Not rebuilt, not yet torn down
+    await stopping
+    assert not runtime.started and not runtime.stopping
+    assert runtime.cache is None  # The closed injected cache isn't reused
+    runtime.cache = fresh = VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus())
+    await runtime.startup()
+    assert runtime.engine.cache is fresh
+    await runtime.shutdown()
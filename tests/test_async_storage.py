@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from data.async_storage import AsyncStorage, MemoryStorage, MongoStorage, ThreadedStorage
+from data.storage import DataStorage
+from inmemory_mongo import InMemoryCollection, InMemoryMongoClient
+
+
+class CountingCollection(InMemoryCollection):
+    """Records every call that would be a round trip to the server."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    async def find_one(self, filter_=None):
+        self.calls.append("find_one")
+        return await super().find_one(filter_)
+
+    def find(self, filter_=None):
+        self.calls.append("find")
+        return super().find(filter_)
+
+    async def bulk_write(self, requests, ordered=True):
+        self.calls.append("bulk_write")
+        return await super().bulk_write(requests, ordered)
+
+
+@pytest.fixture(params=["threaded", "mongo", "memory"])
+def storage(request, tmp_path):
+    if request.param == "threaded":
+        storage = ThreadedStorage(DataStorage(str(tmp_path)))
+    elif request.param == "memory":
+        storage = MemoryStorage()
+    else:
+        storage = MongoStorage(client=InMemoryMongoClient())
+    yield storage
+    asyncio.run(storage.close())
+
+
+@pytest.mark.asyncio
+async def test_backends_share_semantics(storage):
+    assert isinstance(storage, AsyncStorage)
+    await storage.put("user:1", {"name": "a"})
+    await storage.put_many({"user:2": {"name": "b"}, "session:1": [1, 2], "user:10": None})
+    assert await storage.get("user:1") == {"name": "a"}
+    assert await storage.get("missing") is None
+    assert await storage.get_many(["user:1", "session:1", "missing"]) == {"user:1": {"name": "a"},
+                                                                          "session:1": [1, 2]}
+    assert [key async for key, _ in storage.scan("user:")] == ["user:1", "user:10", "user:2"]
+    assert await storage.delete("user:1") and not await storage.delete("user:1")
+    assert [key async for key, _ in storage.scan("user:")] == ["user:10", "user:2"]
+    assert await storage.add("lock", 1) and not await storage.add("lock", 2)
+    assert await storage.get("lock") == 1
+
+
+@pytest.mark.asyncio
+async def test_mongo_bulk_operations_are_single_round_trips():
+    collection = CountingCollection()
+    storage = MongoStorage(client={"lightningmcp": {"storage": collection}})
+    await storage.put_many({f"k{i}": i for i in range(100)})
+    values = await storage.get_many(f"k{i}" for i in range(100))
+    assert len(values) == 100 and values["k42"] == 42
+    assert collection.calls == ["bulk_write", "find"]
+
+
+@pytest.mark.asyncio
+async def test_threaded_storage_keeps_the_loop_responsive(tmp_path):
+    storage = ThreadedStorage(DataStorage(str(tmp_path)))
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.gather(*(storage.put(f"k{i}", i) for i in range(50)))
+    task.cancel()
+    assert ticks > 1
+    assert await storage.get_many(["k0", "k49"]) == {"k0": 0, "k49": 49}
+    await storage.close()
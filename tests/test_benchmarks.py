@@ -0,0 +1,39 @@
+import pytest
+
+from benchmarks.harness import compare
+from benchmarks.startup import profile
+from benchmarks.suite import run_suite
+
+
+@pytest.mark.asyncio
+async def test_suite_reports_latency_throughput_and_allocations():
+    results = await run_suite(quick=True, only="cache_get")
+    assert results["meta"]["backend"] == "memory"
+    assert set(results["benchmarks"]) == {"cache_get_l1", "cache_get_l2"}
+    micro = results["benchmarks"]["cache_get_l1"]
+    assert micro["ops"] == 200
+    assert 0 < micro["p50_us"] <= micro["p95_us"] <= micro["p99_us"]
+    assert micro["ops_per_sec"] > 0
+    assert "retained_blocks_per_op" in micro and "peak_bytes_per_op" in micro
+
+    load = (await run_suite(quick=True, only="http_cached"))["benchmarks"]["http_cached"]
+    assert (load["ops"], load["errors"]) == (100, 0)
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+    baseline = {"benchmarks": {"a": {"p50_us": 10.0, "ops_per_sec": 1000.0},
+                               "b": {"p50_us": 10.0, "ops_per_sec": 1000.0}}}
+    results = {"benchmarks": {"a": {"p50_us": 12.0, "ops_per_sec": 900.0},
+                              "b": {"p50_us": 20.0, "ops_per_sec": 500.0},
+                              "new": {"p50_us": 1.0, "ops_per_sec": 1.0}}}
+    regressions = compare(results, baseline, tolerance=0.25)
+    assert [(r["benchmark"], r["field"], r["change"]) for r in regressions] == [
+        ("b", "p50_us", 1.0), ("b", "ops_per_sec", 0.5)]
+
+
+def test_startup_profile_reports_imports_and_first_request():
+    result = profile("main:mcp", top=5)
+    assert result["import"]["total_ms"] > 0 and len(result["import"]["slowest"]) == 5
+    first = result["first_request"]
+    assert first["status"] == 200
+    assert first["total_ms"] >= first["import_ms"] + first["build_app_ms"]
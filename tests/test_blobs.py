@@ -0,0 +1,146 @@
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from core.cache import InMemoryInvalidationBus, VectorCache
+from core.engine import SparkEngine
+from core.inmemory import InMemoryRedis
+from core.security import Authenticator, PermissionSystem
+from core.tools import ToolValidationError
+from data.blobs import BlobStore, MissingBlobError, is_blob_ref
+from lightningmcp import LightningMCP
+
+
+def checksum(data: bytes) -> dict:
+    # Module-level so the process pool can pickle it
+    return {"size": len(data), "first": data[0], "echo": bytes(data)}
+
+
+def test_blob_store_round_trip(tmp_path):
+    blobs = BlobStore(str(tmp_path), threshold=1024)
+    payload = os.urandom(4096)
+    ref = blobs.put(payload)
+    assert ref == blobs.put(bytearray(payload)) and ref["size"] == 4096 and ref["kind"] == "bytes"
+    view = blobs.get(ref)
+    assert isinstance(view, memoryview) and view.readonly and view == payload
+
+    value = {"doc": "x" * 2048, "small": "y", "items": [payload, 1], "kept": [1, 2]}
+    external = blobs.externalize(value)
+    assert is_blob_ref(external["doc"]) and external["doc"]["kind"] == "str"
+    assert external["items"][0] == ref and external["small"] == "y" and external["kept"] is value["kept"]
+    resolved = blobs.resolve(external)
+    assert resolved["doc"] == value["doc"] and resolved["items"][0] == payload
+    small = {"a": [1, "b"]}
+    assert blobs.externalize(small) is small and blobs.resolve(small) is small
+
+    # Another process attaches to the same directory and sees the same blobs
+    assert BlobStore(str(tmp_path)).get(ref) == payload
+    assert blobs.prune(max_age=-1) == 2
+    blobs.close()
+    with pytest.raises(MissingBlobError):
+        BlobStore(str(tmp_path)).get(ref)
+    with pytest.raises(ValueError):
+        blobs.get("../../etc/passwd")
+
+
+def test_reads_keep_blobs_and_prune_clears_abandoned_writes(tmp_path):
+    blobs = BlobStore(str(tmp_path), threshold=1024, max_age=100)
+    kept, unused = blobs.put(b"k" * 2048), blobs.put(b"u" * 2048)
+    abandoned = tmp_path / ".incoming-dead"  # A writer died before renaming it into place
+    abandoned.write_bytes(b"partial")
+    an_hour_ago = time.time() - 3600
+    for path in (blobs._path(kept["$blob"]), blobs._path(unused["$blob"]), abandoned):
+        os.utime(path, (an_hour_ago, an_hour_ago))
+
+    assert BlobStore(str(tmp_path)).get(kept) == b"k" * 2048  # Reading refreshes its age
+    assert blobs.prune() == 1
+    assert kept in blobs and unused not in blobs and not abandoned.exists()
+
+
+@pytest.mark.asyncio
+async def test_engine_passes_references(tmp_path):
+    mcp = LightningMCP()
+    seen = []
+
+    @mcp.tool()
+    def measure(data: bytes, label: str) -> dict:
+        seen.append((type(data), type(label)))
+        return {"size": len(data), "label": label[:3], "copy": bytes(data)}
+
+    mcp.tool(cpu_bound=True)(checksum)
+    blobs = BlobStore(str(tmp_path), threshold=1024)
+    engine = SparkEngine(tools=mcp.tools, cache=VectorCache(client=InMemoryRedis()), blobs=blobs)
+    payload = os.urandom(8192)
+    try:
+        result = await engine.execute_tool("measure", {"data": payload, "label": "z" * 2000}, {})
+        # The tool read a memoryview; its large result was stored as a blob
+        assert seen == [(memoryview, str)]
+        assert result["size"] == 8192 and result["label"] == "zzz" and is_blob_ref(result["copy"])
+        assert blobs.get(result["copy"]) == payload
+        # A second call with the same payload is a cache hit on the reference
+        again = await engine.execute_tool("measure", {"data": blobs.put(payload), "label": "z" * 2000}, {})
+        assert again == result and len(seen) == 1
+
+        # Process pool: only references cross, and the result comes back as one
+        outcome = await engine.execute_tool("checksum", {"data": payload}, {})
+        assert outcome["size"] == 8192 and outcome["first"] == payload[0]
+        assert outcome["echo"] == result["copy"]
+
+        with pytest.raises(ToolValidationError):
+            await engine.execute_tool("measure", {"data": {"$blob": "0" * 32, "kind": "str"}, "label": "a"}, {})
+    finally:
+        engine.shutdown()
+
+
+def test_blob_endpoints(tmp_path):
+    mcp = LightningMCP(cache=VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus()),
+                       blobs=BlobStore(str(tmp_path), threshold=1024))
+
+    @mcp.tool()
+    async def word_count(text: str) -> int:
+        return len(text.split())
+
+    document = "lorem ipsum " * 1000
+    with TestClient(mcp.app) as client:
+        ref = client.put("/blobs", params={"kind": "str"}, content=document.encode()).json()
+        assert ref["kind"] == "str" and ref["size"] == len(document)
+        response = client.get(f"/blobs/{ref['$blob']}")
+        assert response.content == document.encode() and response.headers["etag"] == f'"{ref["$blob"]}"'
+        assert client.get(f"/blobs/{'0' * 32}").status_code == 404
+        assert client.get("/blobs/nope").status_code == 400
+
+        # By reference or inline, the tool sees the same text
+        for text in (ref, document):
+            request = {"request_data": {"tool_name": "word_count", "parameters": {"text": text}}}
+            result = client.post("/execute_toolchain", json=request).json()["results"]
+            assert result == [2000]
+
+
+def test_blob_limits_permissions_and_expired_references(tmp_path):
+    users = {"admin-token": {"user_id": "a", "role": "admin"}, "user-token": {"user_id": "u", "role": "user"}}
+    mcp = LightningMCP(cache=VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus()),
+                       blobs=BlobStore(str(tmp_path), threshold=1024, max_blob_bytes=4096),
+                       permissions=PermissionSystem(), authenticator=Authenticator(users.get))
+
+    @mcp.tool()
+    async def size(data: bytes) -> int:
+        return len(data)
+
+    admin, user = ({"Authorization": f"Bearer {token}"} for token in users)
+    with TestClient(mcp.app) as client:
+        # Anyone may read blobs, only roles allowed to write resources may upload
+        assert client.put("/blobs", content=b"x" * 2048, headers=user).status_code == 403
+        ref = client.put("/blobs", content=b"x" * 2048, headers=admin).json()
+        assert client.get(f"/blobs/{ref['$blob']}", headers=user).content == b"x" * 2048
+        assert client.put("/blobs", content=b"x" * 4097, headers=admin).status_code == 413
+        chunks = (b"x" * 1024 for _ in range(5))  # No Content-Length: cut off while streaming
+        assert client.put("/blobs", content=chunks, headers=admin).status_code == 413
+
+        # A reference whose blob was pruned is a clear 410, not a server error
+        mcp.runtime.blobs.prune(max_age=-1)
+        mcp.runtime.blobs.close()  # As in a worker that never mapped it
+        request = {"request_data": {"tool_name": "size", "parameters": {"data": ref}}}
+        response = client.post("/execute_toolchain", json=request, headers=user)
+        assert response.status_code == 410 and "upload it again" in response.json()["detail"]
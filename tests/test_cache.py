@@ -0,0 +1,271 @@
+import asyncio
+import gc
+import os
+import subprocess
+import sys
+import warnings
+
+import pytest
+
+from core.cache import InMemoryInvalidationBus, VectorCache
+from core.engine import SparkEngine
+from core.inmemory import InMemoryRedis
+from core.keys import canonical_encode, derive_cache_key
+from core.serialization import PickleSerializer, ResultCodec, SerializationError
+from lightningmcp import LightningMCP
+
+
+def test_cache_keys_are_stable_across_processes():
+    """Keys don't depend on PYTHONHASHSEED, so workers share cache entries"""
+    code = "from core.keys import derive_cache_key; print(derive_cache_key('t', {'b': [1, {'x': None}], 'a': 'y'}))"
+    keys = set()
+    for seed in ("1", "2"):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+        keys.add(output.stdout.strip())
+    assert keys == {derive_cache_key("t", {"a": "y", "b": [1, {"x": None}]})}
+
+
+def test_canonical_encoding_is_type_tagged():
+    """Equal-looking values of different types never share a key"""
+    encodings = {canonical_encode(v) for v in (1, 1.0, True, "1", b"1", [1], (1,))}
+    assert len(encodings) == 6  # Lists and tuples are the same sequence
+    assert canonical_encode({"a": 1, "b": 2}) == canonical_encode({"b": 2, "a": 1})
+    assert canonical_encode(["ab", "c"]) != canonical_encode(["a", "bc"])
+    with pytest.raises(TypeError):
+        canonical_encode(object())
+
+
+def test_result_codec_round_trips():
+    serializers = ["json", "pickle"]
+    try:
+        import msgpack  # noqa: F401
+        serializers.append("msgpack")
+    except ImportError:
+        pass
+    for serializer in serializers:
+        codec = ResultCodec(serializer, compress_threshold=64)
+        value = {"text": "x" * 500, "items": [1, 2.5, None]}
+        raw = codec.encode(value)
+        assert len(raw) < 500  # Compressed above the threshold
+        assert codec.decode(raw) == value
+
+    # Entries written with one serializer are readable by any codec
+    assert ResultCodec("pickle").decode(ResultCodec("json").encode({"a": 1})) == {"a": 1}
+    with pytest.raises(SerializationError):
+        ResultCodec("json").decode(ResultCodec("pickle").encode({"a": 1}))
+
+    with pytest.raises(SerializationError):
+        ResultCodec("json").encode(object())
+
+
+def test_pickle_serializer_uses_out_of_band_buffers():
+    np = pytest.importorskip("numpy")
+    array = np.arange(1000, dtype=np.float64)
+    raw = PickleSerializer().dumps(array)
+    restored = PickleSerializer().loads(raw)
+    assert np.array_equal(restored, array)
+    # The array is a view over the encoded bytes rather than a copy
+    assert not restored.flags.owndata
+
+
+@pytest.mark.asyncio
+async def test_results_are_shared_through_l2():
+    """A second worker decodes the first worker's result from Redis"""
+    mcp = LightningMCP()
+    calls = []
+
+    @mcp.tool()
+    async def lookup(query: dict) -> dict:
+        calls.append(query)
+        return {"answer": query["q"].upper(), "tags": ["a", "b"]}
+
+    redis_client = InMemoryRedis()
+    bus = InMemoryInvalidationBus()
+    worker_a = SparkEngine(tools=mcp.tools, cache=VectorCache(client=redis_client, bus=bus))
+    worker_b = SparkEngine(tools=mcp.tools, cache=VectorCache(client=redis_client, bus=bus))
+
+    params = {"query": {"q": "abc", "filters": [1, 2]}}
+    first = await worker_a.execute_tool("lookup", params, {})
+    second = await worker_b.execute_tool("lookup", params, {})
+    assert first == second == {"answer": "ABC", "tags": ["a", "b"]}
+    assert len(calls) == 1
+    assert worker_b.cache.stats["l2_hits"] == 1
+
+
+class CountingRedis(InMemoryRedis):
+    """Counts Redis round trips"""
+
+    def __init__(self):
+        super().__init__()
+        self.round_trips = []
+
+    async def get(self, key):
+        self.round_trips.append("get")
+        return await super().get(key)
+
+    async def mget(self, keys, *args):
+        self.round_trips.append("mget")
+        return await InMemoryRedis.mget(self, keys, *args)
+
+    def pipeline(self, transaction=True):
+        self.round_trips.append("pipeline")
+        return super().pipeline(transaction)
+
+
+@pytest.mark.asyncio
+async def test_both_tiers_return_the_same_shape():
+    redis_client = InMemoryRedis()
+    cache = VectorCache(client=redis_client, bus=InMemoryInvalidationBus())
+
+    async def compute():
+        return {"pair": (1, 2)}
+
+    computed = await cache.get_or_compute("k", compute)
+    from_l1 = await cache.get("k")
+    from_l2 = await VectorCache(client=redis_client, bus=InMemoryInvalidationBus()).get("k")
+    assert computed == from_l1 == from_l2 == {"pair": [1, 2]}
+    batched = await cache.get_or_compute_many({"b": compute})
+    assert batched["b"] == await cache.get("b") == {"pair": [1, 2]}
+
+
+class DownRedis(InMemoryRedis):
+    """Reads work, writes fail as if the connection dropped"""
+
+    async def set(self, key, value, ex=None):
+        from redis.exceptions import ConnectionError
+        raise ConnectionError("Connection reset by peer")
+
+
+@pytest.mark.asyncio
+async def test_failed_write_back_still_returns_the_value(caplog):
+    cache = VectorCache(client=DownRedis(), bus=InMemoryInvalidationBus())
+    release = asyncio.Event()
+    runs = []
+
+    async def compute():
+        runs.append(1)
+        await release.wait()
+        return {"v": 1}
+
+    leader = asyncio.ensure_future(cache.get_or_compute("k", compute))
+    await asyncio.sleep(0)
+    waiter = asyncio.ensure_future(cache.get_or_compute("k", compute))
+    await asyncio.sleep(0)
+    release.set()
+    assert await leader == await waiter == {"v": 1} and len(runs) == 1
+    assert "Could not cache k" in caplog.text
+    assert await cache.get("k") is None  # Nothing was cached
+
+
+@pytest.mark.asyncio
+async def test_batch_uses_one_lookup_and_one_write():
+    mcp = LightningMCP()
+    calls = []
+
+    @mcp.tool()
+    async def square(x: int) -> int:
+        calls.append(x)
+        return x * x
+
+    redis_client = CountingRedis()
+    engine = SparkEngine(tools=mcp.tools, cache=VectorCache(client=redis_client, bus=InMemoryInvalidationBus()))
+    batch = [{"tool_name": "square", "parameters": {"x": x}} for x in (1, 2, 2, 3)]
+    batch.append({"tool_name": "missing", "parameters": {}})
+
+    outcomes = await engine.execute_batch(batch, {})
+    assert outcomes[:4] == [1, 4, 4, 9]
+    assert isinstance(outcomes[4], ValueError)
+    assert sorted(calls) == [1, 2, 3]  # Duplicate calls run once
+    assert redis_client.round_trips == ["mget", "pipeline"]
+
+    # A second worker finds everything with a single MGET
+    redis_client.round_trips.clear()
+    other = SparkEngine(tools=mcp.tools, cache=VectorCache(client=redis_client, bus=InMemoryInvalidationBus()))
+    assert await other.execute_batch(batch[:4], {}) == [1, 4, 4, 9]
+    assert redis_client.round_trips == ["mget"]
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_reuses_near_identical_calls():
+    pytest.importorskip("numpy")
+    mcp = LightningMCP()
+    calls = []
+
+    @mcp.tool(semantic_threshold=0.9)
+    async def forecast(city: str, question: str, days: int = 1) -> str:
+        calls.append(question)
+        return f"sunny in {city} for {days} day(s)"
+
+    engine = SparkEngine(tools=mcp.tools, cache=VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus()))
+    first = await engine.execute_tool("forecast", {"city": "Paris", "question": "What is the weather tomorrow?"}, {})
+    # Case, whitespace, punctuation and word order don't matter
+    near = await engine.execute_tool("forecast", {"city": "paris", "question": "tomorrow  what is the weather"}, {})
+    # Non-string arguments must match exactly
+    other_days = await engine.execute_tool(
+        "forecast", {"city": "Paris", "question": "What is the weather tomorrow?", "days": 3}, {})
+    await engine.execute_tool("forecast", {"city": "Paris", "question": "Stock price of ACME"}, {})
+    assert near == first and other_days != first and len(calls) == 3
+
+    results = engine.metrics.get_metrics()["semantic_cache_total"]
+    assert results["result=near,tool=forecast"] == 1 and results["result=miss,tool=forecast"] == 3
+    engine.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_batches_use_the_semantic_cache_and_fail_cleanly():
+    pytest.importorskip("numpy")
+    mcp = LightningMCP()
+    calls = []
+
+    @mcp.tool(semantic_threshold=0.9)
+    async def forecast(city: str, question: str) -> str:
+        calls.append(question)
+        return f"sunny in {city}"
+
+    engine = SparkEngine(tools=mcp.tools, cache=VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus()))
+    await engine.execute_tool("forecast", {"city": "Paris", "question": "What is the weather tomorrow?"}, {})
+    batch = [{"tool_name": "forecast", "parameters": {"city": "paris", "question": "tomorrow what is the weather"}}]
+    assert await engine.execute_batch(batch, {}) == ["sunny in Paris"] and len(calls) == 1
+
+    # A malformed call after a direct one raises before any call is started
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        with pytest.raises(KeyError):
+            await engine.execute_batch(batch + [{"parameters": {}}], {})
+        gc.collect()
+    assert not [w for w in caught if "never awaited" in str(w.message)]
+    engine.shutdown()
+
+
+def test_ivf_index_search_and_eviction():
+    np = pytest.importorskip("numpy")
+    from core.semantic import IVFIndex, SemanticCache
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(600, 32)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = IVFIndex(32, nlist=8, nprobe=3, min_train=200)
+    for i, vector in enumerate(vectors):
+        index.add(i, vector, partition=i % 2)
+    assert index._centroids is not None  # Trained once enough vectors arrived
+    assert index.search(vectors[10], partition=0) == (10, pytest.approx(1.0))
+    key, _ = index.search(vectors[10], partition=1)
+    assert key % 2 == 1  # Never crosses partitions
+    for i in range(0, 600, 3):
+        index.remove(i)
+    assert len(index) == 400 and index.search(vectors[3], partition=1) != (3, pytest.approx(1.0))
+
+    mcp = LightningMCP()
+
+    @mcp.tool(semantic_threshold=0.9)
+    def echo(text: str) -> str:
+        return text
+
+    semantic = SemanticCache(max_entries=2)
+    for i, text in enumerate(["alpha beta", "gamma delta", "epsilon zeta"]):
+        semantic.add(mcp.tools["echo"], {"text": text}, f"key{i}")
+    assert len(semantic) == 2
+    assert semantic.search(mcp.tools["echo"], {"text": "Alpha   beta"}, 0.9) is None  # Evicted
+    assert semantic.search(mcp.tools["echo"], {"text": "zeta epsilon"}, 0.9) == "key2"
@@ -1,21 +1,84 @@
 import pytest
 import asyncio
-from core.engine import SparkEngine, can_execute_parallel
+import subprocess
+import sys
+import time
+from typing import Literal, Mapping, Optional, Sequence
+from core.cache import InMemoryInvalidationBus, LRUCache, VectorCache
+from core.engine import SparkEngine
+from core.inmemory import InMemoryRedis
+from core.resilience import AdaptiveLimiter, CircuitBreaker, CircuitOpenError
+from core.tools import ToolSpec, ToolValidationError
+from lightningmcp import LightningMCP
+
+
+def make_cache(bus=None):
+    """Two-tier cache backed by the in-memory Redis stand-in"""
+    return VectorCache(client=InMemoryRedis(), bus=bus or InMemoryInvalidationBus())
+
+
+def cpu_square(x: int) -> int:
+    """Module-level so it can be pickled into the process pool"""
+    return x * x
+
+
+@pytest.fixture
+def mcp():
+    """Create a LightningMCP app with a few registered tools"""
+    mcp = LightningMCP()
+
+    @mcp.tool()
+    def regular_tool(param: str) -> dict:
+        return {"result": f"regular:{param}"}
+
+    @mcp.tool()
+    def sensitive_tool(param: str) -> dict:
+        return {"result": f"sensitive:{param}"}
+
+    @mcp.tool()
+    async def async_tool(param: str) -> dict:
+        return {"result": f"async:{param}"}
+
+    @mcp.tool()
+    def slow_tool(delay: float) -> float:
+        time.sleep(delay)
+        return delay
+
+    mcp.tool(cpu_bound=True)(cpu_square)
+    return mcp
 
 
 @pytest.fixture
-def spark_engine():
+def spark_engine(mcp):
     """Create a SparkEngine instance for testing"""
-    return SparkEngine()
+    engine = SparkEngine(tools=mcp.tools, cache=make_cache())
+    yield engine
+    engine.shutdown()
 
 
-def test_can_execute_parallel():
-    """Test the can_execute_parallel function"""
-    # Should return False for 'sensitive_tool'
-    assert not can_execute_parallel("sensitive_tool", [])
+@pytest.mark.asyncio
+async def test_conflict_groups_never_overlap(mcp):
+    """Tools sharing a conflict group run one at a time; other tools don't wait"""
+    active = set()
+    overlaps = []
+
+    def make(name, conflicts):
+        async def tool(i: int) -> int:
+            if active & {"writer_a", "writer_b"}:
+                overlaps.append(name)
+            active.add(name)
+            await asyncio.sleep(0.01)
+            active.discard(name)
+            return i
+        mcp.tool(name=name, conflicts=conflicts)(tool)
 
-    # Should return True for any other tool
-    assert can_execute_parallel("regular_tool", [])
+    make("writer_a", ["ledger"])
+    make("writer_b", ["ledger", "audit"])
+    make("reader", [])
+    engine = SparkEngine(tools=mcp.tools, cache=make_cache())
+    calls = [engine.execute_tool(name, {"i": i}, {}) for i in range(4) for name in ("writer_a", "writer_b", "reader")]
+    assert len(await asyncio.gather(*calls)) == 12
+    assert set(overlaps) == {"reader"}  # Only the ungrouped tool ran alongside a writer
 
 
 @pytest.mark.asyncio
@@ -27,9 +90,8 @@ async def test_execute_tool_parallel(spark_engine):
     # Execute a tool that should run in parallel
     result = await spark_engine.execute_tool("regular_tool", {"param": "value"}, context)
 
-    # Check the result (based on our implementation which returns a static result)
-    assert "result" in result
-    assert result["result"] == "parallel_executed"
+    # The registered function is actually called
+    assert result["result"] == "regular:value"
 
 
 @pytest.mark.asyncio
@@ -41,9 +103,60 @@ async def test_execute_tool_sequential(spark_engine):
     # Execute a tool that should NOT run in parallel
     result = await spark_engine.execute_tool("sensitive_tool", {"param": "value"}, context)
 
-    # Check the result (based on our implementation which returns a static result)
-    assert "result" in result
-    assert result["result"] == "sequential_executed"
+    assert result["result"] == "sensitive:value"
+
+
+@pytest.mark.asyncio
+async def test_execute_tool_dispatch_kinds(spark_engine):
+    """Coroutine tools run inline, CPU-bound tools run in the process pool"""
+    assert (await spark_engine.execute_tool("async_tool", {"param": "x"}, {}))["result"] == "async:x"
+    assert await spark_engine.execute_tool("cpu_square", {"x": 7}, {}) == 49
+    assert spark_engine.parallel_executor._process_pool is not None
+
+
+@pytest.mark.asyncio
+async def test_sync_tool_does_not_block_event_loop(spark_engine):
+    """A slow sync tool runs in the thread pool while the loop keeps ticking"""
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    await spark_engine.execute_tool("slow_tool", {"delay": 0.2}, {})
+    task.cancel()
+    assert ticks >= 5
+
+
+@pytest.mark.asyncio
+async def test_unknown_tool(spark_engine):
+    with pytest.raises(ValueError):
+        await spark_engine.execute_tool("missing_tool", {}, {})
+
+
+@pytest.mark.asyncio
+async def test_max_concurrency(mcp):
+    """Per-tool concurrency limits queue excess calls"""
+    active = 0
+    peak = 0
+
+    @mcp.tool(max_concurrency=2)
+    async def limited_tool(i: int) -> int:
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return i
+
+    engine = SparkEngine(tools=mcp.tools, cache=make_cache())
+    results = await asyncio.gather(*(engine.execute_tool("limited_tool", {"i": i}, {}) for i in range(6)))
+    assert sorted(results) == list(range(6))
+    assert peak == 2
+    assert engine.parallel_executor.stats()["tools"]["limited_tool"] == {"waiting": 0, "running": 0}
 
 
 @pytest.mark.asyncio
@@ -52,8 +165,8 @@ async def test_cache_behavior(spark_engine, monkeypatch):
     # Mock the parallel_executor to track calls
     calls = []
 
-    async def mock_submit(self, tool_name, params, context):
-        calls.append((tool_name, params))
+    async def mock_submit(self, tool, params, context):
+        calls.append((tool.name, params))
         return {"result": "executed_once"}
 
     # Apply the mock
@@ -64,7 +177,7 @@ async def test_cache_behavior(spark_engine, monkeypatch):
     )
 
     # Define test parameters
-    tool_name = "cacheable_tool"
+    tool_name = "regular_tool"
     params = {"param": "value"}
     context = {"active_tools": []}
 
@@ -79,3 +192,297 @@ async def test_cache_behavior(spark_engine, monkeypatch):
 
     # Should still have only one call (cache hit)
     assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_are_coalesced(mcp):
+    """Concurrent misses for the same key run the tool only once"""
+    calls = 0
+
+    @mcp.tool()
+    async def lookup(q: str) -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return q.upper()
+
+    engine = SparkEngine(tools=mcp.tools, cache=make_cache())
+    results = await asyncio.gather(*(engine.execute_tool("lookup", {"q": "abc"}, {}) for _ in range(10)))
+    assert results == ["ABC"] * 10
+    assert calls == 1
+    assert engine.cache.stats["coalesced"] == 9
+
+
+@pytest.mark.asyncio
+async def test_uncached_tool_runs_every_call(mcp):
+    """Tools with side effects opt out of caching with cache=False"""
+    log = []
+
+    @mcp.tool(cache=False)
+    def record(entry: str) -> int:
+        log.append(entry)
+        return len(log)
+
+    engine = SparkEngine(tools=mcp.tools, cache=make_cache())
+    assert [await engine.execute_tool("record", {"entry": "a"}, {}) for _ in range(2)] == [1, 2]
+    calls = [{"tool_name": "record", "parameters": {"entry": "a"}}] * 2
+    assert sorted(await engine.execute_batch(calls, {})) == [3, 4]
+    assert log == ["a"] * 4
+    assert engine.metrics.counter("cache_lookups_total", {"tool": "record"}).value() == 0
+
+
+def test_lru_cache_bounds():
+    """L1 evicts least recently used entries by count and by bytes"""
+    l1 = LRUCache(max_entries=2, max_bytes=10, ttl=60)
+    l1.set("a", b"1234")
+    l1.set("b", b"1234")
+    l1.get("a")
+    l1.set("c", b"1234")
+    assert "b" not in l1 and "a" in l1 and "c" in l1
+    l1.set("d", b"12345678")
+    assert len(l1) == 1 and l1.nbytes == 8
+
+
+@pytest.mark.asyncio
+async def test_invalidation_keeps_l1_coherent():
+    """Invalidating on one worker evicts the key from every worker's L1"""
+    bus = InMemoryInvalidationBus()
+    redis_client = InMemoryRedis()
+    worker_a = VectorCache(client=redis_client, bus=bus)
+    worker_b = VectorCache(client=redis_client, bus=bus)
+
+    await worker_a.set("k", "v1")
+    assert await worker_b.get("k") == "v1"
+    assert "k" in worker_b.l1
+
+    await worker_a.invalidate("k")
+    assert "k" not in worker_b.l1
+    assert await worker_b.get("k") is None
+
+
+@pytest.mark.asyncio
+async def test_sync_generator_streams_with_backpressure(mcp):
+    produced = []
+
+    @mcp.tool()
+    def count(n: int):
+        for i in range(n):
+            produced.append(i)
+            yield i
+
+    engine = SparkEngine(tools=mcp.tools, cache=make_cache())
+    engine.parallel_executor.stream_buffer = 2
+    stream = engine.stream_tool("count", {"n": 100}, {})
+    assert await anext(stream) == 0
+    await asyncio.sleep(0.05)
+    # The generator is paused by the bounded queue rather than running ahead
+    assert len(produced) <= 4
+    await stream.aclose()
+    await asyncio.sleep(0.05)
+    assert len(produced) <= 5
+    assert engine.parallel_executor.stats()["pools"]["thread"]["in_flight"] == 0
+    engine.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_cached_stream_replays_chunks(mcp):
+    runs = 0
+
+    @mcp.tool(cache_stream=True)
+    async def words(text: str):
+        nonlocal runs
+        runs += 1
+        for word in text.split():
+            yield word + " "
+
+    engine = SparkEngine(tools=mcp.tools, cache=make_cache())
+    first = [chunk async for chunk in engine.stream_tool("words", {"text": "a b c"}, {})]
+    second = [chunk async for chunk in engine.stream_tool("words", {"text": "a b c"}, {})]
+    assert first == second == ["a ", "b ", "c "]
+    assert runs == 1
+    # Non-streaming callers get the assembled text
+    assert await engine.execute_tool("words", {"text": "a b c"}, {}) == "a b c "
+
+
+def test_tool_spec_validation_and_schema():
+    def search(query: str, limit: int = 10, weights: list[float] = None,
+               mode: Literal["fast", "exact"] = "fast", owner: Optional[str] = None) -> list:
+        return []
+
+    spec = ToolSpec(search)
+    assert not hasattr(spec, "__dict__")
+    assert spec.validate({"query": "q", "limit": 5.0, "weights": [1, 2]}) == {
+        "query": "q", "limit": 5, "weights": [1.0, 2.0]}
+    assert spec.schema["required"] == ["query"]
+    assert spec.schema["properties"]["weights"] == {"type": "array", "items": {"type": "number"}, "default": None}
+    assert spec.schema["properties"]["mode"]["enum"] == ["fast", "exact"]
+
+    for bad in ({}, {"query": 1}, {"query": "q", "limit": 1.5}, {"query": "q", "mode": "slow"},
+                {"query": "q", "extra": True}, {"query": "q", "weights": ["x"]}):
+        with pytest.raises(ToolValidationError):
+            spec.validate(bad)
+
+    def shapes(pair: tuple[int, str], many: tuple[int, ...] = (), seq: Sequence[float] = (),
+               table: Mapping[str, int] = None) -> None:
+        pass
+
+    spec = ToolSpec(shapes)
+    assert spec.validate({"pair": [1, "a"], "many": [1, 2.0, 3], "seq": [1], "table": {"k": 2.0}}) == {
+        "pair": (1, "a"), "many": (1, 2, 3), "seq": [1.0], "table": {"k": 2}}
+    assert spec.schema["properties"]["pair"]["prefixItems"] == [{"type": "integer"}, {"type": "string"}]
+    assert spec.schema["properties"]["seq"]["items"] == {"type": "number"}
+    for bad in ({"pair": [1]}, {"pair": [1, 2]}, {"pair": [1, "a"], "seq": ["x"]},
+                {"pair": [1, "a"], "table": {"k": "v"}}, {"pair": [1, "a"], "many": ["x"]}):
+        with pytest.raises(ToolValidationError):
+            spec.validate(bad)
+
+
+@pytest.mark.asyncio
+async def test_equivalent_params_share_cache_entry(spark_engine):
+    assert await spark_engine.execute_tool("cpu_square", {"x": 3}, {}) == 9
+    assert await spark_engine.execute_tool("cpu_square", {"x": 3.0}, {}) == 9
+    assert spark_engine.cache.stats["l1_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_fails_fast_and_probes(mcp):
+    """A failing tool opens its breaker; a successful probe closes it again"""
+    calls = 0
+    healthy = False
+
+    @mcp.tool()
+    async def flaky(i: int) -> int:
+        nonlocal calls
+        calls += 1
+        if not healthy:
+            raise ConnectionError("downstream unavailable")
+        return i
+
+    engine = SparkEngine(tools=mcp.tools, cache=make_cache())
+    breaker = engine.parallel_executor._get_breaker(mcp.tools["flaky"])
+    breaker.cooldown = 0.05
+    for i in range(breaker.min_calls):
+        with pytest.raises(ConnectionError):
+            await engine.execute_tool("flaky", {"i": i}, {})
+    with pytest.raises(CircuitOpenError):
+        await engine.execute_tool("flaky", {"i": 100}, {})
+    assert calls == breaker.min_calls
+
+    await asyncio.sleep(0.06)
+    healthy = True
+    assert await engine.execute_tool("flaky", {"i": 101}, {}) == 101
+    assert breaker.state == CircuitBreaker.CLOSED
+    text = engine.metrics.render_prometheus()
+    assert 'circuit_breaker_rejections_total{tool="flaky"} 1' in text
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_counts_only_infrastructure_failures(mcp):
+    """Bad input never opens the circuit; failure_on picks what does"""
+    class QuotaExceeded(Exception):
+        pass
+
+    @mcp.tool()
+    async def strict(x: int) -> int:
+        raise ValueError("x out of range")
+
+    @mcp.tool(failure_on=[QuotaExceeded])
+    async def metered(x: int) -> int:
+        raise QuotaExceeded()
+
+    engine = SparkEngine(tools=mcp.tools, cache=make_cache())
+    executor = engine.parallel_executor
+    for i in range(executor._get_breaker(mcp.tools["strict"]).min_calls * 2):
+        with pytest.raises(ValueError):
+            await engine.execute_tool("strict", {"x": i}, {})
+        with pytest.raises(ToolValidationError):
+            await engine.execute_tool("strict", {"x": "not a number"}, {})
+    assert executor._get_breaker(mcp.tools["strict"]).state == CircuitBreaker.CLOSED
+
+    breaker = executor._get_breaker(mcp.tools["metered"])
+    for i in range(breaker.min_calls):
+        with pytest.raises(QuotaExceeded):
+            await engine.execute_tool("metered", {"x": i}, {})
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.counts(ValueError()) and not breaker.counts(ConnectionError())
+
+
+def test_circuit_breaker_half_open_admits_one_probe():
+    breaker = CircuitBreaker(min_calls=2, cooldown=0)
+    breaker.record(True)
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.before_call("t") is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call("t")  # Probe still in flight
+    breaker.record(True, probe=True)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_backs_off_on_latency_and_recovers():
+    limiter = AdaptiveLimiter(initial=8, tolerance=2.0)
+    for _ in range(8):
+        await limiter.acquire()
+    now = time.monotonic()
+    for _ in range(8):
+        limiter._adapt(now - 0.01, 0.01, False)  # Establish the baseline
+    limit = limiter.limit
+    assert limit > 8  # Grew while fully used
+    limiter._adapt(now, 0.1, False)  # 10x the baseline
+    assert limiter.limit == pytest.approx(limit * limiter.backoff)
+    limiter._adapt(now, 0.1, False)  # Started before the decrease: same round
+    assert limiter.limit == pytest.approx(limit * limiter.backoff)
+
+    # Over the new limit (6), callers wait until enough slots are released
+    waiter = asyncio.ensure_future(limiter.acquire())
+    for _ in range(2):
+        limiter.release(now, None)  # Cancelled calls don't adapt the limit
+        await asyncio.sleep(0)
+        assert not waiter.done()
+    limiter.release(now, None)
+    await asyncio.sleep(0)
+    assert waiter.done() and limiter.in_flight == 6
+
+
+@pytest.mark.asyncio
+async def test_adaptive_concurrency_on_tool(mcp):
+    @mcp.tool(max_concurrency="adaptive")
+    async def downstream(i: int) -> int:
+        await asyncio.sleep(0.001)
+        return i
+
+    engine = SparkEngine(tools=mcp.tools, cache=make_cache())
+    results = await asyncio.gather(*(engine.execute_tool("downstream", {"i": i}, {}) for i in range(50)))
+    assert results == list(range(50))
+    limiter = engine.parallel_executor._limits["downstream"]
+    assert limiter.in_flight == 0
+    assert limiter.min_limit <= limiter.limit <= limiter.max_limit
+
+
+@pytest.mark.asyncio
+async def test_declared_tools_are_imported_on_first_use(tmp_path, monkeypatch):
+    (tmp_path / "declared_tools.py").write_text(
+        "def double(x: int) -> int:\n    return 2 * x\n\n\ndef triple(x: int) -> int:\n    return 3 * x\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    mcp = LightningMCP(cache=make_cache(), tools={
+        "double": "declared_tools:double",
+        "triple": {"target": "declared_tools:triple", "version": "2"},
+    })
+    assert "double" in mcp.tools and mcp.tools.version == 2
+    assert "declared_tools" not in sys.modules
+
+    engine = SparkEngine(tools=mcp.tools, cache=make_cache())
+    assert await engine.execute_tool("double", {"x": 4}, {}) == 8
+    assert "declared_tools" in sys.modules
+    assert isinstance(mcp.tools.peek("double"), ToolSpec)
+    assert not isinstance(mcp.tools.peek("triple"), ToolSpec)  # Not looked up yet
+    assert mcp.tools["triple"].cache_version == ToolSpec(sys.modules["declared_tools"].triple, version="2").cache_version
+    assert mcp.tools.version == 2  # Loading a declared tool is not a change
+
+
+def test_importing_lightningmcp_defers_the_web_stack():
+    code = ("import sys, lightningmcp\n"
+            "print([m for m in ('fastapi', 'pydantic', 'redis', 'api.routes', 'core.runtime') if m in sys.modules])")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
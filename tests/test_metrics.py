@@ -0,0 +1,120 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from monitoring.metrics import Histogram, MetricsCollector
+from monitoring.multiprocess import ARCHIVE_FILE, read_records
+
+
+def test_histogram_quantiles_within_bucket_error():
+    histogram = Histogram()
+    for i in range(1, 1001):
+        histogram.observe(i / 1000)  # 1ms .. 1s, uniform
+    for q, expected in ((0.5, 0.5), (0.95, 0.95), (0.99, 0.99)):
+        assert abs(histogram.quantile(q) - expected) / expected < 0.1
+    count, total, _ = histogram.snapshot()
+    assert count == 1000
+    assert total == pytest.approx(500.5)
+
+
+def test_thread_shards_are_merged():
+    metrics = MetricsCollector()
+
+    def work():
+        for _ in range(1000):
+            metrics.increment_counter("calls_total", labels={"tool": "t"})
+            metrics.record("latency_seconds", 0.01)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    snapshot = metrics.get_metrics()
+    assert snapshot["calls_total"] == {"tool=t": 8000}
+    assert snapshot["latency_seconds"]["count"] == 8000
+
+
+def test_metric_type_clash_is_rejected():
+    metrics = MetricsCollector()
+    metrics.increment_counter("requests")
+    with pytest.raises(ValueError):
+        metrics.record("requests", 1.0)
+
+
+def test_prometheus_exposition():
+    metrics = MetricsCollector()
+    metrics.increment_counter("cache_lookups_total", 3, labels={"tool": 'say "hi"'})
+    metrics.set_gauge("executor.queue_depth", 2, labels={"pool": "thread"})
+    metrics.record("tool_latency_seconds", 0.25, labels={"tool": "t"})
+
+    text = metrics.render_prometheus()
+    assert "# TYPE cache_lookups_total counter" in text
+    assert 'cache_lookups_total{tool="say \\"hi\\""} 3' in text
+    assert 'executor_queue_depth{pool="thread"} 2' in text
+    assert 'tool_latency_seconds_bucket{tool="t",le="+Inf"} 1' in text
+    assert 'tool_latency_seconds_count{tool="t"} 1' in text
+
+
+WORKER = """
+import sys
+from monitoring.metrics import MetricsCollector
+metrics = MetricsCollector(sys.argv[1])
+for _ in range(int(sys.argv[2])):
+    metrics.increment_counter("calls_total", labels={"tool": "t"})
+    metrics.record("latency_seconds", 0.01)
+metrics.set_gauge("queue_depth", 5)
+"""
+
+
+def test_worker_processes_are_summed(tmp_path):
+    for calls in ("3", "4"):
+        subprocess.run([sys.executable, "-c", WORKER, str(tmp_path), calls], check=True)
+
+    # Creating a collector folds the exited workers' files into the archive
+    metrics = MetricsCollector(str(tmp_path))
+    metrics.increment_counter("calls_total", labels={"tool": "t"})
+    files = [name for name in os.listdir(tmp_path) if name.endswith(".db")]
+    assert ARCHIVE_FILE in files and len(files) == 2  # Archive plus our own file
+
+    snapshot = metrics.get_metrics()
+    assert snapshot["calls_total"] == {"tool=t": 8}
+    assert snapshot["latency_seconds"]["count"] == 7
+    assert "queue_depth" not in snapshot  # Gauges die with their worker
+    assert 'calls_total{tool="t"} 8' in metrics.render_prometheus()
+
+
+def test_live_collectors_share_a_directory(tmp_path):
+    first, second = MetricsCollector(str(tmp_path)), MetricsCollector(str(tmp_path))
+    first.record("latency_seconds", 0.5)
+    second.record("latency_seconds", 0.5)
+    second.set_gauge("queue_depth", 2)
+    first.set_gauge("queue_depth", 1)
+    snapshot = first.get_metrics()
+    assert snapshot["latency_seconds"]["count"] == 2
+    assert snapshot["queue_depth"] == 3
+
+    # A segment caught before its header was written is skipped, not a failed scrape
+    blank = tmp_path / f"metrics_{os.getpid()}_{first._store.token}_9.db"
+    blank.write_bytes(bytes(4096))
+    assert list(read_records(str(blank))) == []
+    assert first.get_metrics()["latency_seconds"]["count"] == 2
+
+
+def test_segments_of_workers_that_died_before_the_rename_are_removed(tmp_path):
+    dead = int(subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                              capture_output=True, text=True, check=True).stdout)
+    orphan = tmp_path / f"metrics_{dead}_abcd1234_0.db.tmp"
+    orphan.write_bytes(bytes(4096))
+    first = MetricsCollector(str(tmp_path))
+    first.record("latency_seconds", 0.5)
+    in_progress = tmp_path / f"metrics_{os.getpid()}_{first._store.token}_1.db.tmp"  # A live worker's
+    in_progress.write_bytes(bytes(4096))
+
+    second = MetricsCollector(str(tmp_path))  # Opening the directory cleans up
+    assert not orphan.exists() and in_progress.exists()
+    assert second.get_metrics()["latency_seconds"]["count"] == 1
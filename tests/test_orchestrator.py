@@ -0,0 +1,325 @@
+import asyncio
+import time
+
+import pytest
+
+from core.cache import InMemoryInvalidationBus, VectorCache
+from core.engine import SparkEngine
+from core.inmemory import InMemoryRedis
+from core.resilience import RetryPolicy
+from lightningmcp import LightningMCP
+from orchestrator.replay import replay
+from orchestrator.toolchain import PlanError, StepExecutionError, ToolChainOrchestrator, topological_sort
+
+
+@pytest.fixture
+def mcp():
+    mcp = LightningMCP()
+
+    @mcp.tool()
+    async def fetch(source: str, delay: float = 0.1) -> dict:
+        await asyncio.sleep(delay)
+        return {"source": source, "values": [1, 2, 3]}
+
+    @mcp.tool()
+    async def combine(left: list, right: list) -> int:
+        return sum(left) + sum(right)
+
+    @mcp.tool()
+    async def fail(message: str) -> None:
+        await asyncio.sleep(0.01)
+        raise RuntimeError(message)
+
+    return mcp
+
+
+@pytest.fixture
+def orchestrator(mcp):
+    engine = SparkEngine(tools=mcp.tools, cache=VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus()))
+    orchestrator = ToolChainOrchestrator(engine=engine, max_fan_out=4)
+    for tool in mcp.tools.values():
+        orchestrator.register_tool(tool)
+    yield orchestrator
+    engine.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_independent_steps_run_concurrently(orchestrator):
+    plan = orchestrator.plan_execution({"steps": [
+        {"id": "total", "tool_name": "combine",
+         "parameters": {"left": {"$ref": "a.values"}, "right": {"$ref": "b.values"}}},
+        {"id": "a", "tool_name": "fetch", "parameters": {"source": "a"}},
+        {"id": "b", "tool_name": "fetch", "parameters": {"source": "b"}},
+    ]})
+    assert [step["id"] for step in plan] == ["a", "b", "total"]
+
+    start = time.perf_counter()
+    results = await orchestrator.execute_plan(plan, {})
+    elapsed = time.perf_counter() - start
+
+    assert results[2] == 12
+    # The two 100ms fetches overlap: latency is the critical path, not the sum
+    assert elapsed < 0.18
+
+
+def test_invalid_plans_are_rejected():
+    with pytest.raises(PlanError):
+        topological_sort([
+            {"id": "a", "tool_name": "t", "parameters": {"x": {"$ref": "b"}}},
+            {"id": "b", "tool_name": "t", "parameters": {}, "depends_on": ["a"]},
+        ])
+    with pytest.raises(PlanError):
+        topological_sort([{"id": "a", "tool_name": "t", "parameters": {"x": {"$ref": "missing"}}}])
+
+
+@pytest.mark.asyncio
+async def test_failed_branch_cancels_siblings(orchestrator):
+    plan = orchestrator.plan_execution({"steps": [
+        {"id": "slow", "tool_name": "fetch", "parameters": {"source": "s", "delay": 5}},
+        {"id": "boom", "tool_name": "fail", "parameters": {"message": "bad input"}},
+    ]})
+    start = time.perf_counter()
+    with pytest.raises(StepExecutionError) as info:
+        await orchestrator.execute_plan(plan, {})
+    assert info.value.step_id == "boom"
+    assert isinstance(info.value.__cause__, RuntimeError)
+    assert time.perf_counter() - start < 1
+
+
+@pytest.mark.asyncio
+async def test_transient_failures_are_retried(mcp, orchestrator):
+    attempts = 0
+
+    @mcp.tool(retry=RetryPolicy(attempts=3, base_delay=0.001))
+    async def unstable(x: int) -> int:
+        nonlocal attempts
+        attempts += 1
+        if attempts < 3:
+            raise ConnectionError("reset by peer")
+        return x
+
+    orchestrator.register_tool(mcp.tools["unstable"])
+    plan = orchestrator.plan_execution({"tool_name": "unstable", "parameters": {"x": 7}})
+    assert await orchestrator.execute_plan(plan, {}) == [7]
+    assert attempts == 3
+    assert orchestrator.engine.metrics.counter("tool_retries_total", {"tool": "unstable"}).value() == 2
+
+
+@pytest.mark.asyncio
+async def test_deadline_bounds_steps_and_retries(mcp, orchestrator):
+    @mcp.tool(retry=RetryPolicy(attempts=10, base_delay=0.05))
+    async def down() -> None:
+        raise ConnectionError("refused")
+
+    orchestrator.register_tool(mcp.tools["down"])
+    orchestrator.default_timeout = 0.2
+    plan = orchestrator.plan_execution({"steps": [
+        {"id": "slow", "tool_name": "fetch", "parameters": {"source": "s", "delay": 5}},
+        {"id": "down", "tool_name": "down", "parameters": {}},
+    ]})
+    start = time.perf_counter()
+    with pytest.raises(StepExecutionError) as info:
+        await orchestrator.execute_plan(plan, {})
+    assert time.perf_counter() - start < 0.5
+    assert isinstance(info.value.error, (TimeoutError, ConnectionError))
+
+    context = {}
+    plan = orchestrator.plan_execution({"tool_name": "fetch", "parameters": {"source": "t", "delay": 5}})
+    with pytest.raises(StepExecutionError) as info:
+        await orchestrator.execute_plan(plan, context)
+    assert isinstance(info.value.error, TimeoutError)
+    assert "deadline" in context
+
+
+@pytest.mark.asyncio
+async def test_slow_attempt_is_hedged(mcp, orchestrator):
+    calls = 0
+
+    @mcp.tool(hedge=True)
+    async def lookup(key: str) -> str:
+        nonlocal calls
+        calls += 1
+        # Every 25th call stalls, like a request stuck behind a GC pause
+        await asyncio.sleep(5 if calls % 25 == 0 else 0.001)
+        return key
+
+    engine = orchestrator.engine
+    for i in range(24):
+        assert await engine.execute_tool("lookup", {"key": f"k{i}"}, {}) == f"k{i}"
+    start = time.perf_counter()
+    assert await engine.execute_tool("lookup", {"key": "stalled"}, {}) == "stalled"
+    assert time.perf_counter() - start < 1
+    assert calls == 26  # The stalled attempt plus its hedge
+    assert engine.metrics.counter("tool_hedges_total", {"tool": "lookup"}).value() == 1
+
+
+def test_plans_are_cached_by_structure(orchestrator):
+    calls = []
+    analyze = orchestrator.analyze_request
+    orchestrator.analyze_request = lambda request: calls.append(request) or analyze(request)
+
+    def request(source, delay):
+        return {"steps": [
+            {"id": "a", "tool_name": "fetch", "parameters": {"source": source, "delay": delay}},
+            {"id": "b", "tool_name": "fetch", "parameters": {"source": "b"}},
+            {"id": "sum", "tool_name": "combine",
+             "parameters": {"left": {"$ref": "a.values"}, "right": {"$ref": "b.values"}}},
+        ]}
+
+    first = orchestrator.plan_execution(request("x", 0.1))
+    second = orchestrator.plan_execution(request("y", 0.2))
+    assert len(calls) == 1
+    assert first[0]["parameters"] == {"source": "x", "delay": 0.1}
+    assert second[0]["parameters"] == {"source": "y", "delay": 0.2}
+    assert second[2]["parameters"] == {"left": {"$ref": "a.values"}, "right": {"$ref": "b.values"}}
+
+    # Different wiring or parameter names is a different template
+    rewired = request("x", 0.1)
+    rewired["steps"][2]["parameters"]["right"] = {"$ref": "a.values"}
+    orchestrator.plan_execution(rewired)
+    orchestrator.plan_execution({"tool_name": "fetch", "parameters": {"source": "s"}})
+    assert len(calls) == 3
+    assert orchestrator.plan_cache.hit_rate == pytest.approx(1 / 4)
+    assert orchestrator.metrics.counter("plan_cache_total", {"result": "hit"}).value() == 1
+    assert orchestrator.metrics.histogram("planning_seconds").snapshot()[0] == 4
+
+
+def test_plan_cache_is_invalidated_by_registry_changes(mcp):
+    # The app's registry, changed by @mcp.tool() rather than register_tool
+    orchestrator = ToolChainOrchestrator(tool_registry=mcp.tools)
+    request = {"tool_name": "fetch", "parameters": {"source": "s"}}
+    orchestrator.plan_execution(request)
+    orchestrator.plan_execution(request)
+    assert orchestrator.plan_cache.hits == 1
+
+    @mcp.tool(name="fetch")
+    async def fetch_v2(source: str) -> dict:
+        return {"source": source}
+
+    orchestrator.plan_execution(request)
+    assert orchestrator.plan_cache.misses == 2
+    del mcp.tools["fetch"]
+    assert orchestrator.plan_execution(request) is None
+    assert len(orchestrator.plan_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_plans_use_the_fastest_equivalent_tool(mcp, orchestrator):
+    @mcp.tool(equivalent="search")
+    async def slow_search(query: str) -> str:
+        await asyncio.sleep(0.05)
+        return f"slow:{query}"
+
+    @mcp.tool(equivalent="search")
+    async def fast_search(query: str) -> str:
+        return f"fast:{query}"
+
+    orchestrator.register_tool(mcp.tools["slow_search"])
+    orchestrator.register_tool(mcp.tools["fast_search"])
+    # Statistics come from the engine's calls
+    engine = orchestrator.engine
+    await engine.execute_tool("slow_search", {"query": "a"}, {})
+    await engine.execute_tool("fast_search", {"query": "a"}, {})
+    await engine.execute_tool("fast_search", {"query": "a"}, {})
+    stats = engine.stats.get("fast_search")
+    assert (stats.calls, stats.lookups, stats.hit_rate) == (1, 2, 0.5)
+    assert engine.stats.expected_cost("fast_search") < engine.stats.expected_cost("slow_search")
+
+    plan = orchestrator.plan_execution({"tool_name": "slow_search", "parameters": {"query": "b"}})
+    assert plan[0]["tool_name"] == "fast_search"
+    assert await orchestrator.execute_plan(plan, {}) == ["fast:b"]
+
+
+def test_only_plans_of_tools_whose_costs_moved_are_recompiled(mcp):
+    @mcp.tool(equivalent="search")
+    async def slow_search(query: str) -> str:
+        return f"slow:{query}"
+
+    @mcp.tool(equivalent="search")
+    async def fast_search(query: str) -> str:
+        return f"fast:{query}"
+
+    orchestrator = ToolChainOrchestrator(tool_registry=mcp.tools)
+    stats = orchestrator.stats
+    search = {"tool_name": "slow_search", "parameters": {"query": "q"}}
+    fetch = {"tool_name": "fetch", "parameters": {"source": "s"}}
+    stats.observe_call("slow_search", 0.5)
+    stats.observe_call("fast_search", 0.01)
+    stats.observe_call("fetch", 0.1)
+    assert orchestrator.plan_execution(search)[0]["tool_name"] == "fast_search"
+    orchestrator.plan_execution(fetch)
+
+    # Thousands of samples that don't move the costs keep every plan
+    for _ in range(2000):
+        stats.observe_call("fetch", 0.1)
+        stats.observe_call("fast_search", 0.01)
+    orchestrator.plan_execution(search)
+    orchestrator.plan_execution(fetch)
+    assert orchestrator.plan_cache.misses == 2
+
+    # fast_search gets slow: only the plan choosing between the searches is redone
+    version = stats.version("fast_search")
+    for _ in range(100):
+        stats.observe_call("fast_search", 2.0)
+    assert stats.version("fast_search") > version
+    assert orchestrator.plan_execution(search)[0]["tool_name"] == "slow_search"
+    orchestrator.plan_execution(fetch)
+    assert (orchestrator.plan_cache.hits, orchestrator.plan_cache.misses) == (3, 3)
+
+
+@pytest.mark.asyncio
+async def test_cached_calls_of_one_tool_are_batched(orchestrator):
+    engine = orchestrator.engine
+    for _ in range(3):
+        await engine.execute_tool("fetch", {"source": "warm", "delay": 0}, {})
+    batches = []
+    execute_batch = engine.execute_batch
+    engine.execute_batch = lambda calls, context: batches.append(len(calls)) or execute_batch(calls, context)
+
+    plan = orchestrator.plan_execution({"steps": [
+        {"id": "a", "tool_name": "fetch", "parameters": {"source": "a", "delay": 0}},
+        {"id": "b", "tool_name": "fetch", "parameters": {"source": "b", "delay": 0}},
+        {"id": "sum", "tool_name": "combine",
+         "parameters": {"left": {"$ref": "a.values"}, "right": {"$ref": "b.values"}}},
+    ]})
+    assert [step.get("batch") for step in plan] == ["a", "a", None]
+    assert (await orchestrator.execute_plan(plan, {}))[2] == 12
+    assert batches == [2]
+
+
+@pytest.mark.asyncio
+async def test_critical_path_runs_first(mcp, orchestrator):
+    # Learn that fetch is slow and combine is fast
+    await orchestrator.engine.execute_tool("fetch", {"source": "x", "delay": 0.05}, {})
+    await orchestrator.engine.execute_tool("combine", {"left": [1], "right": [2]}, {})
+    orchestrator.max_fan_out = 1
+    plan = orchestrator.plan_execution({"steps": [
+        {"id": "quick", "tool_name": "combine", "parameters": {"left": [1], "right": [1]}},
+        {"id": "a", "tool_name": "fetch", "parameters": {"source": "a", "delay": 0.05}},
+        {"id": "sum", "tool_name": "combine",
+         "parameters": {"left": {"$ref": "a.values"}, "right": [0]}},
+    ]})
+    assert [step["id"] for step in plan] == ["a", "quick", "sum"]
+
+    records = []
+    orchestrator.recorder = records.append
+    await orchestrator.execute_plan(plan, {})
+    assert [step["id"] for step in records[0]["steps"]] == ["a", "quick", "sum"]
+    assert records[0]["steps"][2]["depends_on"] == ["a"]
+    assert records[0]["steps"][0]["duration"] >= 0.05
+
+
+def test_replay_shows_the_optimized_makespan():
+    # Two short independent steps recorded ahead of a long chain
+    record = {"steps": [
+        {"id": "x1", "tool_name": "short", "depends_on": [], "duration": 1.0},
+        {"id": "x2", "tool_name": "short", "depends_on": [], "duration": 1.0},
+        {"id": "a", "tool_name": "head", "depends_on": [], "duration": 1.0},
+        {"id": "b", "tool_name": "tail", "depends_on": ["a"], "duration": 3.0},
+    ]}
+    summary = replay([record] * 3, max_fan_out=2)
+    assert summary["plans"] == 3
+    assert summary["baseline_seconds"] == pytest.approx(15.0)
+    assert summary["optimized_seconds"] == pytest.approx(12.0)
+    assert (summary["improved"], summary["regressed"]) == (3, 0)
+    assert summary["speedup"] == pytest.approx(1.25)
@@ -0,0 +1,136 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from redis.exceptions import ConnectionError
+
+from api.ratelimit import TOKEN_BUCKET_SCRIPT, LocalBuckets, RateLimiter, RedisBuckets, _refill
+from core.cache import InMemoryInvalidationBus, VectorCache
+from core.inmemory import InMemoryRedis
+from core.security import Authenticator
+from lightningmcp import LightningMCP
+
+
+@InMemoryRedis.emulates(TOKEN_BUCKET_SCRIPT)
+def _token_bucket(client, keys, args):
+    # Python twin of the Lua script for the fake
+    rate, burst, cost = map(float, args)
+    now = time.monotonic()
+    entry = client._live(keys[0])
+    tokens, updated = map(float, entry[0].split()) if entry else (burst, now)
+    tokens, wait = _refill(tokens, updated, now, rate, burst, cost)
+    client._data[keys[0]] = (f"{tokens!r} {now!r}".encode(), now + burst / rate + 1)
+    return repr(wait).encode()
+
+
+@pytest.mark.asyncio
+async def test_local_bucket_allows_burst_then_reports_wait():
+    buckets = LocalBuckets()
+    assert [await buckets.take("a", rate=1, burst=3) for _ in range(3)] == [0, 0, 0]
+    wait = await buckets.take("a", rate=1, burst=3)
+    assert 0.9 < wait <= 1
+    assert await buckets.take("b", rate=1, burst=3) == 0  # Independent keys
+    assert await buckets.take("c", rate=10, burst=5, cost=6) == pytest.approx(0.1, abs=0.01)
+    # Refunds never raise a bucket above its burst
+    await buckets.take("b", rate=1, burst=3, cost=-10)
+    assert [await buckets.take("b", rate=0.001, burst=3) for _ in range(4)][-1] > 0
+
+
+@pytest.mark.asyncio
+async def test_redis_buckets_are_shared_between_workers():
+    client = InMemoryRedis()
+    first, second = RedisBuckets(client), RedisBuckets(client)
+    assert await first.take("tenant:x", rate=0.1, burst=2) == 0
+    assert await second.take("tenant:x", rate=0.1, burst=2) == 0
+    assert await first.take("tenant:x", rate=0.1, burst=2) > 9
+
+
+@pytest.mark.asyncio
+async def test_redis_buckets_fall_back_to_local_when_redis_is_down():
+    class DownRedis:
+        def register_script(self, script):
+            async def run(keys=None, args=None):
+                raise ConnectionError("refused")
+            return run
+
+    buckets = RedisBuckets(DownRedis())
+    assert await buckets.take("tenant:x", rate=0.1, burst=1) == 0
+    assert await buckets.take("tenant:x", rate=0.1, burst=1) > 0
+
+
+def test_tenant_is_verified_user_or_address():
+    scope = {"headers": [(b"x-api-key", b"secret")], "client": ("10.0.0.1", 1234)}
+    # Unverified credentials are ignored: they are free to change
+    assert RateLimiter.tenant(scope) == "ip:10.0.0.1"
+    assert RateLimiter.tenant(scope, {"user_id": "ann"}) == "user:ann"
+    assert RateLimiter.tenant({"headers": []}) == "ip:unknown"
+
+
+@pytest.mark.asyncio
+async def test_rejected_tools_use_no_quota():
+    limiter = RateLimiter(tool_rates={"cheap": (0.001, 2), "scarce": (0.001, 1)})
+    assert await limiter.check_tools("t", ["scarce"]) is None
+    name, wait = await limiter.check_tools("t", ["cheap", "scarce"])
+    assert name == "scarce" and wait > 0
+    # The rejected request's "cheap" tokens were refunded
+    assert await limiter.check_tools("t", ["cheap", "cheap"]) is None
+
+
+def _verify(token):
+    return {"user_id": token, "role": "admin"} if token in ("a", "b") else None
+
+
+@pytest.fixture
+def limited():
+    limiter = RateLimiter(rate=0.01, burst=3, tool_rates={"expensive": (0.01, 2)},
+                          backend=RedisBuckets(InMemoryRedis()), max_queue_depth=4)
+    mcp = LightningMCP(cache=VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus()),
+                       rate_limiter=limiter, authenticator=Authenticator(_verify))
+
+    @mcp.tool()
+    def expensive(x: int) -> int:
+        return x
+
+    return mcp
+
+
+def _bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_tenant_quota_returns_429_with_retry_after(limited):
+    payload = {"request_data": {"tool_name": "expensive", "parameters": {"x": 1}}}
+    with TestClient(limited.app) as client:
+        assert client.post("/execute_toolchain", json=payload, headers=_bearer("a")).status_code == 200
+        assert client.get("/tools", headers=_bearer("a")).status_code == 200
+        assert client.get("/tools", headers=_bearer("a")).status_code == 200
+        response = client.get("/tools", headers=_bearer("a"))
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+        # Other tenants and exempt paths are unaffected
+        assert client.get("/tools", headers=_bearer("b")).status_code == 200
+        assert client.get("/health", headers=_bearer("a")).status_code == 200
+        # An unverified token is just another request from the client's address
+        assert client.get("/tools", headers=_bearer("forged")).status_code == 200
+        assert 'rate_limited_total{reason="tenant"} 1' in client.get("/metrics").text
+
+
+def test_tool_quota_counts_every_step(limited):
+    step = {"tool_name": "expensive", "parameters": {"x": 1}}
+    plan = {"steps": [{"id": str(i), **step} for i in range(3)]}
+    with TestClient(limited.app) as client:
+        response = client.post("/execute_toolchain", json={"request_data": plan})
+        assert response.status_code == 429
+        assert "expensive" in response.json()["detail"]
+        assert "Retry-After" in response.headers
+
+
+def test_load_is_shed_when_executor_queue_is_deep(limited):
+    with TestClient(limited.app) as client:
+        executor = limited.runtime.engine.parallel_executor
+        executor._in_flight["thread"] = executor.max_workers + 5
+        response = client.get("/tools")
+        assert response.status_code == 429
+        assert response.json() == {"detail": "Server overloaded"}
+        executor._in_flight["thread"] = 0
+        assert client.get("/tools").status_code == 200
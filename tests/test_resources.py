@@ -0,0 +1,155 @@
+import asyncio
+import collections
+
+import pytest
+from fastapi.testclient import TestClient
+
+from core.cache import InMemoryInvalidationBus, VectorCache
+from core.inmemory import InMemoryRedis
+from core.resources import ItemWindow, ResourceCache, ResourceSpec
+from lightningmcp import LightningMCP
+
+
+@pytest.mark.asyncio
+async def test_resource_cache_computes_once_until_invalidated():
+    calls = 0
+    release = asyncio.Event()
+
+    async def history(ctx):
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return [ctx["owner"], calls]
+
+    bus = InMemoryInvalidationBus()
+    registry = {"resource://h": ResourceSpec("resource://h", history)}
+    cache = ResourceCache(registry, context={"owner": "a"}, bus=bus)
+    other = ResourceCache(registry, context={"owner": "a"}, bus=bus)  # Another worker
+
+    # Concurrent reads share one computation
+    reads = [asyncio.ensure_future(cache.get("resource://h")) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    entries = await asyncio.gather(*reads)
+    assert calls == 1 and entries[0] is entries[2] and entries[0].value == ["a", 1]
+    assert (await cache.get("resource://h")) is entries[0]
+
+    # A change made while computing is not lost
+    release.clear()
+    cache.invalidate("resource://h")
+    pending = asyncio.ensure_future(cache.get("resource://h"))
+    while calls < 2:
+        await asyncio.sleep(0)
+    cache.invalidate("resource://h")  # Changed again while computing
+    release.set()
+    assert (await pending).value == ["a", 2]
+    assert (await cache.get("resource://h")).value == ["a", 3]
+
+    # Invalidations reach the other worker
+    first = await other.get("resource://h")
+    cache.invalidate("resource://h")
+    await cache.close()
+    assert (await other.get("resource://h")) is not first
+
+    with pytest.raises(KeyError):
+        await cache.get("resource://missing")
+
+
+def test_resource_endpoint_revalidates_and_pages():
+    mcp = LightningMCP(cache=VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus()))
+    items = []
+    reads = 0
+
+    @mcp.tool(invalidates=["resource://items"])
+    async def add_item(name: str) -> int:
+        items.append(name)
+        return len(items)
+
+    @mcp.resource("resource://items")
+    async def list_items():
+        nonlocal reads
+        reads += 1
+        return list(items)
+
+    @mcp.resource("resource://config")
+    def config():
+        return {"mode": "fast"}
+
+    def add(name):
+        request = {"request_data": {"tool_name": "add_item", "parameters": {"name": name}}}
+        assert client.post("/execute_toolchain", json=request).status_code == 200
+
+    with TestClient(mcp.app) as client:
+        for i in range(5):
+            add(f"item{i}")
+        assert [r["uri"] for r in client.get("/resources").json()["resources"]] == [
+            "resource://items", "resource://config"]
+
+        response = client.get("/resources/read", params={"uri": "resource://items"})
+        assert response.json()["contents"] == [f"item{i}" for i in range(5)]
+        tag = response.headers["etag"]
+        again = client.get("/resources/read", params={"uri": "resource://items"}, headers={"If-None-Match": tag})
+        assert again.status_code == 304 and again.content == b"" and reads == 1
+
+        page = client.get("/resources/read", params={"uri": "resource://items", "offset": 3, "limit": 10}).json()
+        assert page["contents"] == ["item3", "item4"] and page["total"] == 5 and page["next_offset"] is None
+        ranged = client.get("/resources/read", params={"uri": "resource://items"}, headers={"Range": "items=0-1"})
+        assert ranged.status_code == 206 and ranged.headers["content-range"] == "items 0-1/5"
+        assert ranged.json()["contents"] == ["item0", "item1"]
+
+        # Polling for new items: 304 until a tool appends one
+        poll = {"uri": "resource://items", "offset": 5}
+        empty = client.get("/resources/read", params=poll)
+        assert empty.json()["contents"] == []
+        assert client.get("/resources/read", params=poll,
+                          headers={"If-None-Match": empty.headers["etag"]}).status_code == 304
+        add("item5")
+        fresh = client.get("/resources/read", params=poll, headers={"If-None-Match": empty.headers["etag"]})
+        assert fresh.status_code == 200 and fresh.json()["contents"] == ["item5"]
+        # Pages that didn't change still revalidate
+        old_page = client.get("/resources/read", params={"uri": "resource://items"}, headers={
+            "Range": "items=0-1", "If-None-Match": ranged.headers["etag"]})
+        assert old_page.status_code == 304
+
+        assert client.get("/resources/read", params={"uri": "resource://config"}).json()["contents"] == {
+            "mode": "fast"}
+        assert client.get("/resources/read", params={"uri": "resource://config", "offset": 1}).status_code == 400
+        assert client.get("/resources/read", params={"uri": "resource://nope"}).status_code == 404
+
+
+def test_bounded_history_pages_by_sequence_number():
+    mcp = LightningMCP(cache=VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus()))
+    history = collections.deque(maxlen=3)
+    appended = 0
+
+    @mcp.tool(invalidates=["resource://history"], cache=False)
+    def record(n: int) -> int:
+        nonlocal appended
+        history.append(n)
+        appended += 1
+        return n
+
+    @mcp.resource("resource://history")
+    def read_history():
+        return ItemWindow(history, first=appended - len(history))
+
+    def add(n):
+        request = {"request_data": {"tool_name": "record", "parameters": {"n": n}}}
+        assert client.post("/execute_toolchain", json=request).status_code == 200
+
+    with TestClient(mcp.app) as client:
+        for n in range(3):
+            add(n)
+        poll = {"uri": "resource://history", "offset": 3}
+        empty = client.get("/resources/read", params=poll)
+        assert empty.json()["contents"] == [] and empty.json()["total"] == 3
+        add(3)  # Drops 0; the poller's offset still points at the new item
+        fresh = client.get("/resources/read", params=poll, headers={"If-None-Match": empty.headers["etag"]})
+        assert fresh.status_code == 200
+        assert fresh.json() == {"uri": "resource://history", "contents": [3], "offset": 3, "first": 1,
+                                "total": 4, "next_offset": None}
+        # An offset that was dropped resumes at the oldest retained item
+        stale = client.get("/resources/read", params={"uri": "resource://history", "offset": 0}).json()
+        assert stale["offset"] == 1 and stale["contents"] == [1, 2, 3]
+        ranged = client.get("/resources/read", params={"uri": "resource://history"}, headers={"Range": "items=2-3"})
+        assert ranged.headers["content-range"] == "items 2-3/4" and ranged.json()["contents"] == [2, 3]
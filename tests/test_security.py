@@ -0,0 +1,99 @@
+import json
+import os
+
+import pytest
+
+from core.security import Authenticator, PermissionSystem, RuleError
+
+
+RULES = {
+    "viewer": {"allow": ["resource:*:read"]},
+    "analyst": {"inherits": ["viewer"], "allow": ["tool:*:execute"], "deny": ["tool:admin_*:*"]},
+    "admin": {"inherits": ["analyst"], "allow": ["tool:admin_*:execute"]},
+}
+
+
+def test_default_rules_match_the_old_matrix():
+    permissions = PermissionSystem()
+    admin, user = {"role": "admin"}, {"role": "user"}
+    assert permissions.check_permission(admin, tool="calculate", action="register")
+    assert permissions.check_permission(user, tool="calculate", action="execute")
+    assert not permissions.check_permission(user, tool="calculate", action="register")
+    assert permissions.check_permission(user, resource="resource://history", action="read")
+    assert not permissions.check_permission(None, tool="calculate", action="execute")
+    assert not permissions.check_permission({"role": "ghost"}, tool="calculate", action="execute")
+
+
+def test_wildcards_inheritance_and_deny():
+    permissions = PermissionSystem(RULES)
+    analyst, admin = {"role": "analyst"}, {"role": "admin"}
+    assert permissions.check_permission(analyst, resource="resource://x", action="read")  # Inherited
+    assert permissions.check_permission(analyst, tool="calculate", action="execute")
+    assert not permissions.check_permission(analyst, tool="admin_purge", action="execute")
+    # Deny is inherited too and wins over the child's allow
+    assert not permissions.check_permission(admin, tool="admin_purge", action="execute")
+    assert permissions.check_permission({"roles": ["viewer", "analyst"]}, tool="calculate", action="execute")
+
+
+def test_decision_memo_is_bounded():
+    permissions = PermissionSystem(RULES, max_cached_decisions=8)
+    viewer = {"role": "viewer"}
+    for i in range(100):  # Caller-chosen names, e.g. resource URIs
+        assert permissions.check_permission(viewer, resource=f"resource://{i}", action="read")
+    assert len(permissions._table._masks) == 8
+    assert not permissions.check_permission(viewer, tool="calculate", action="execute")
+
+
+def test_invalid_rules_are_rejected():
+    with pytest.raises(RuleError):
+        PermissionSystem({"a": {"inherits": ["b"]}, "b": {"inherits": ["a"]}})
+    with pytest.raises(RuleError):
+        PermissionSystem({"a": {"allow": ["tool:execute"]}})
+    permissions = PermissionSystem(RULES)
+    with pytest.raises(RuleError):
+        permissions.load_rules({"a": {"inherits": ["missing"]}})
+    assert permissions.check_permission({"role": "analyst"}, tool="calculate", action="execute")
+
+
+def test_rules_file_is_hot_reloaded(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(RULES))
+    permissions = PermissionSystem(path=str(path), reload_interval=0)
+    viewer = {"role": "viewer"}
+    assert not permissions.check_permission(viewer, tool="calculate", action="execute")
+
+    path.write_text(json.dumps({**RULES, "viewer": {"allow": ["tool:calculate:execute"]}}))
+    os.utime(path, ns=(0, 1))  # Make sure the mtime changes
+    permissions.refresh()
+    assert permissions.check_permission(viewer, tool="calculate", action="execute")
+
+    path.write_text("{not json")
+    os.utime(path, ns=(0, 2))
+    permissions.refresh()  # Broken file: keep the last good rules
+    assert permissions.check_permission(viewer, tool="calculate", action="execute")
+
+
+@pytest.mark.asyncio
+async def test_authenticator_caches_by_token_digest():
+    calls = []
+
+    def verify(token):
+        calls.append(token)
+        return {"user_id": "ann", "role": "admin"} if token == "good" else None
+
+    authenticator = Authenticator(verify, ttl=60, negative_ttl=0, max_entries=2)
+    assert (await authenticator.authenticate("good"))["user_id"] == "ann"
+    assert (await authenticator.authenticate("good"))["user_id"] == "ann"
+    assert calls == ["good"]
+    assert "good" not in authenticator._entries  # Stored under its digest
+    assert await authenticator.authenticate(None) is None
+
+    # Rejections expire after negative_ttl (0 here), so they are re-verified
+    assert await authenticator.authenticate("bad") is None
+    assert await authenticator.authenticate("bad") is None
+    assert calls == ["good", "bad", "bad"]
+
+    authenticator.revoke("good")
+    await authenticator.authenticate("good")
+    assert calls[-1] == "good"
+    assert len(authenticator._entries) <= 2
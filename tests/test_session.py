@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from core.cache import InMemoryInvalidationBus, VectorCache
+from core.inmemory import InMemoryRedis
+from core.session import PatchError, SessionConflict, SessionStore, apply_patch, make_patch
+from data.async_storage import MongoStorage
+from inmemory_mongo import InMemoryMongoClient
+from lightningmcp import LightningMCP
+
+
+def test_patches_copy_only_the_changed_path():
+    state = {"user": {"name": "a", "tags": ["x"]}, "history": list(range(1000))}
+    patched = apply_patch(state, [{"op": "add", "path": "/user/tags/-", "value": "y"},
+                                  {"op": "replace", "path": "/user/name", "value": "b"},
+                                  {"op": "add", "path": "/a~1b", "value": 1}])
+    assert patched == {"user": {"name": "b", "tags": ["x", "y"]}, "history": list(range(1000)), "a/b": 1}
+    assert state["user"] == {"name": "a", "tags": ["x"]}  # Unchanged
+    assert patched["history"] is state["history"]  # Shared, not copied
+
+    with pytest.raises(PatchError):
+        apply_patch(state, [{"op": "test", "path": "/user/name", "value": "b"}])
+    with pytest.raises(PatchError):
+        apply_patch(state, [{"op": "remove", "path": "/missing"}])
+
+    new = {"user": {"name": "a", "tags": ["x", "y", "z"]}, "count": 1}
+    patch = make_patch(state, new)
+    assert apply_patch(state, patch) == new
+    assert {"op": "add", "path": "/user/tags/-", "value": "z"} in patch
+
+
+def make_store(client, bus=None, **options):
+    return SessionStore(MongoStorage(client=client), bus=bus, **options)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writers_rebase_instead_of_losing_updates():
+    client = InMemoryMongoClient()
+    first, second = make_store(client), make_store(client)  # Two workers sharing storage
+    await first.update("s1", [{"op": "add", "path": "/count", "value": 0}])
+
+    async def increment(store, i):
+        await store.update("s1", [{"op": "add", "path": "/seen/-", "value": i}])
+
+    await first.update("s1", [{"op": "add", "path": "/seen", "value": []}])
+    await asyncio.gather(*(increment(store, i) for i in range(10) for store in (first, second)))
+    current = await second.get("s1")
+    assert current["version"] == 22
+    assert sorted(current["state"]["seen"]) == sorted(list(range(10)) * 2)
+    assert (await first.get("s1")) == current
+
+    with pytest.raises(SessionConflict) as conflict:
+        await first.update("s1", [{"op": "replace", "path": "/count", "value": 5}], expected_version=3)
+    assert conflict.value.current == 22
+    assert await first.update("s1", [{"op": "replace", "path": "/count", "value": 5}], expected_version=22) == 23
+
+
+@pytest.mark.asyncio
+async def test_snapshots_bound_the_log_and_reload_the_state():
+    client = InMemoryMongoClient()
+    store = make_store(client, snapshot_every=5)
+    for i in range(12):
+        await store.update("s1", [{"op": "add", "path": f"/k{i}", "value": i}])
+    await store.close()
+    keys = [key async for key, _ in store.storage.scan("session:s1:")]
+    assert "session:s1:s000000000010" in keys
+    assert "session:s1:v000000000003" not in keys and "session:s1:s000000000005" not in keys
+
+    fresh = make_store(client, snapshot_every=5)
+    assert await fresh.get("s1") == {"version": 12, "state": {f"k{i}": i for i in range(12)}}
+
+
+@pytest.mark.asyncio
+async def test_subscribers_receive_diffs_across_workers():
+    client, bus = InMemoryMongoClient(), InMemoryInvalidationBus()
+    first, second = make_store(client, bus), make_store(client, bus)
+    await second.get("s1")  # Hot on the second worker
+    subscription = await second.subscribe("s1", max_queue=4)
+    await first.update("s1", [{"op": "add", "path": "/a", "value": 1}])
+    await first.update("s1", [{"op": "add", "path": "/b", "value": 2}])
+    updates = [await subscription.__anext__() for _ in range(3)]
+    assert updates == [{"version": 0, "state": {}},
+                       {"version": 1, "patch": [{"op": "add", "path": "/a", "value": 1}]},
+                       {"version": 2, "patch": [{"op": "add", "path": "/b", "value": 2}]}]
+    assert await second.get("s1") == {"version": 2, "state": {"a": 1, "b": 2}}  # From the hot tier
+
+    # A subscriber that falls behind is resynced with the full state
+    for i in range(6):
+        await first.update("s1", [{"op": "add", "path": f"/c{i}", "value": i}])
+    resync, latest = await subscription.__anext__(), await subscription.__anext__()
+    assert resync["version"] == 7 and resync["state"]["c4"] == 4
+    assert latest == {"version": 8, "patch": [{"op": "add", "path": "/c5", "value": 5}]}
+    subscription.close()
+
+
+def test_session_routes():
+    mcp = LightningMCP(cache=VectorCache(client=InMemoryRedis(), bus=InMemoryInvalidationBus()))
+    with TestClient(mcp.app) as client:
+        response = client.patch("/sessions/chat-1", json={"patch": [{"op": "add", "path": "/turns", "value": []}]})
+        assert response.json() == {"version": 1}
+        response = client.patch("/sessions/chat-1", json={"patch": [{"op": "add", "path": "/turns/-", "value": "hi"}],
+                                                          "version": 1})
+        assert response.json() == {"version": 2}
+        assert client.get("/sessions/chat-1").json() == {"version": 2, "state": {"turns": ["hi"]}}
+
+        stale = client.patch("/sessions/chat-1", json={"patch": [], "version": 1})
+        assert stale.status_code == 409 and stale.json()["detail"]["version"] == 2
+        bad = client.patch("/sessions/chat-1", json={"patch": [{"op": "remove", "path": "/nope"}]})
+        assert bad.status_code == 422
+        assert client.get("/sessions/bad:id").status_code == 400
+
+
+def test_several_workers_require_shared_storage(monkeypatch, tmp_path):
+    import uvicorn
+    from monitoring.metrics import METRICS_DIR_ENV
+    started = []
+    monkeypatch.setenv(METRICS_DIR_ENV, str(tmp_path))
+    monkeypatch.setattr(uvicorn, "run", lambda app, **kwargs: started.append(kwargs.get("workers")))
+    with pytest.raises(ValueError):
+        LightningMCP().run(app_path="main:mcp.app", workers=2)  # Sessions would split per worker
+    LightningMCP(storage=MongoStorage(client=InMemoryMongoClient())).run(app_path="main:mcp.app", workers=2)
+    LightningMCP().run(app_path="main:mcp.app")
+    assert started == [2, None]
@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+
+import pytest
+
+from data.logstore import LogStore, StoreLockedError
+from data.storage import DataStorage
+
+
+def test_round_trip_and_exact_keys(tmp_path):
+    storage = DataStorage(str(tmp_path))
+    storage.save("a.b", {"v": 1})
+    storage.save("a_b", [1, 2])
+    storage.save("a.b", {"v": 2})
+    assert storage.load("a.b") == {"v": 2}
+    assert storage.load("a_b") == [1, 2]
+    assert sorted(storage.list_keys()) == ["a.b", "a_b"]
+    assert storage.delete("a_b") and not storage.delete("a_b")
+    assert storage.load("a_b") is None
+    storage.close()
+
+    # The index is rebuilt from the log on reopen
+    reopened = DataStorage(str(tmp_path))
+    assert reopened.list_keys() == ["a.b"]
+    assert reopened.load("a.b") == {"v": 2}
+    reopened.close()
+
+
+def test_directory_is_opened_by_one_store_at_a_time(tmp_path):
+    store = LogStore(str(tmp_path), sync=False)
+    with pytest.raises(StoreLockedError):
+        LogStore(str(tmp_path))  # Like a second worker pointed at the same path
+    store.put("k", b"v")
+    store.close()
+    reopened = LogStore(str(tmp_path))
+    assert reopened.get("k") == b"v"
+    reopened.close()
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    store = LogStore(str(tmp_path), sync=False)
+    store.put("kept", b"1")
+    store.put("torn", b"2" * 100)
+    store.close()
+    (log,) = [name for name in os.listdir(tmp_path) if name.endswith(".log")]
+    with open(tmp_path / log, "r+b") as handle:
+        handle.truncate(os.path.getsize(tmp_path / log) - 10)
+
+    store = LogStore(str(tmp_path), sync=False)
+    assert store.keys() == ["kept"]
+    store.put("after", b"3")  # Appends after the last valid record
+    store.close()
+    assert LogStore(str(tmp_path)).get("after") == b"3"
+
+
+def test_compaction_keeps_only_live_records(tmp_path):
+    store = LogStore(str(tmp_path), sync=False, max_segment_size=256, compact_ratio=2)  # No auto compaction
+    for round_ in range(20):
+        for key in ("a", "b", "c"):
+            store.put(key, f"{key}{round_}".encode() * 4)
+    store.delete("b")
+    sealed = [name for name in os.listdir(tmp_path) if name.endswith(".log")]
+    assert len(sealed) > 3
+
+    store.compact()
+    assert store.get("a") == b"a19" * 4 and store.get("b") is None and store.get("c") == b"c19" * 4
+    logs = [name for name in os.listdir(tmp_path) if name.endswith(".log")]
+    assert len(logs) == 2  # One compacted segment plus the active one
+    store.close()
+
+    reopened = LogStore(str(tmp_path))
+    assert sorted(reopened.keys()) == ["a", "c"]
+    assert reopened.get("c") == b"c19" * 4
+    reopened.close()
+
+
+def test_readers_outlive_compaction_of_their_segment(tmp_path):
+    store = LogStore(str(tmp_path), sync=False, max_segment_size=64, compact_ratio=2)
+    for i in range(6):
+        store.put("k", str(i).encode() * 40)
+    store.put("other", b"x" * 80)
+    segment, offset, length = store._index["k"]  # A reader mid-get
+    store.put("k", b"new")
+    store.compact()
+    store.put("more", b"y" * 80)
+    store.compact()  # Used to close the previous run's inputs
+    assert segment.read(offset, length) == b"5" * 40
+    assert store.get("k") == b"new"
+    store.close()
+
+
+def test_interrupted_compaction_inputs_are_removed(tmp_path):
+    store = LogStore(str(tmp_path), sync=False, max_segment_size=64, compact_ratio=2)
+    for i in range(10):
+        store.put("k", str(i).encode() * 40)
+    store.delete("k")
+    store.put("other", b"x" * 80)
+    inputs = sorted(name for name in os.listdir(tmp_path) if name.endswith(".log"))[:-1]
+    leftover = {name: (tmp_path / name).read_bytes() for name in inputs[:-1]}
+    store.compact()
+    store.close()
+    # Simulate a crash after the compacted segment replaced its last input
+    # but before the older inputs were deleted
+    for name, data in leftover.items():
+        (tmp_path / name).write_bytes(data)
+
+    reopened = LogStore(str(tmp_path))
+    assert "k" not in reopened  # The tombstone's effect survives the stale inputs
+    assert reopened.get("other") == b"x" * 80
+    reopened.close()
+    assert not any(name in os.listdir(tmp_path) for name in leftover)
+
+
+def test_compaction_runs_are_bounded(tmp_path):
+    store = LogStore(str(tmp_path), sync=False, max_segment_size=128, compact_ratio=2, max_compact_bytes=400)
+    store.put("old", b"o" * 100)
+    store.put("k", b"k" * 100)
+    for i in range(12):
+        store.put("hot", str(i).encode() * 100)
+        if i == 6:
+            store.delete("k")
+    runs = []
+    pick = store._pick_run
+
+    def spy(force=False):
+        run = pick(force)
+        if run:
+            runs.append((sum(segment.size for segment in run), run[0] is store._sealed[0]))
+        return run
+
+    store._pick_run = spy
+    store.compact()
+    # Every run reads at most the budget; runs that don't start at the oldest
+    # segment keep the tombstone hiding its older "k"
+    assert len(runs) > 1 and all(size <= 400 for size, _ in runs) and not runs[0][1]
+    assert all(segment.dead == 0 for segment in store._sealed)
+    store.close()
+
+    reopened = LogStore(str(tmp_path))
+    assert sorted(reopened.keys()) == ["hot", "old"] and reopened.get("hot") == b"11" * 100
+    reopened.close()
+
+
+def test_old_hint_files_are_rebuilt(tmp_path):
+    store = LogStore(str(tmp_path), sync=False, max_segment_size=64)
+    for i in range(4):
+        store.put(f"k{i}", b"v" * 60)
+    store.close()
+    hints = sorted(tmp_path.glob("*.hint"))
+    for hint in hints:
+        hint.write_bytes(b"\0" * 13)  # 32-bit offsets, no magic
+
+    reopened = LogStore(str(tmp_path))
+    assert [reopened.get(f"k{i}") for i in range(4)] == [b"v" * 60] * 4
+    reopened.close()
+    assert all(hint.read_bytes().startswith(b"LMHINT2") for hint in hints)
+
+
+def test_writers_never_build_hint_files(tmp_path):
+    store = LogStore(str(tmp_path), sync=True, max_segment_size=64, compact_ratio=2)
+    threads = []
+    write_hint = store._write_hint
+    store._write_hint = lambda segment: threads.append(threading.current_thread()) or write_hint(segment)
+    for i in range(10):
+        store.put(f"k{i}", b"v" * 60)  # Every put fills a segment
+    compactor = store._compactor
+    if compactor is not None:
+        compactor.join()
+    assert len(threads) == 10 and threading.current_thread() not in threads
+    assert len(list(tmp_path.glob("*.hint"))) == 10
+    store.close()
+    reopened = LogStore(str(tmp_path))
+    assert [reopened.get(f"k{i}") for i in range(10)] == [b"v" * 60] * 10
+    reopened.close()
+
+
+def test_concurrent_saves_share_fsyncs(tmp_path, monkeypatch):
+    calls = []
+    real_fsync = os.fsync
+
+    def counting_fsync(fd):
+        calls.append(fd)
+        real_fsync(fd)
+
+    store = LogStore(str(tmp_path))
+    monkeypatch.setattr(os, "fsync", counting_fsync)
+
+    def writer(n):
+        for i in range(50):
+            store.put(f"{n}:{i}", b"v")
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(store) == 400
+    assert len(calls) < 400  # Waiting writers ride on the leader's fsync
+    store.close()
+
+
+def test_legacy_json_files_are_imported(tmp_path):
+    with open(tmp_path / "user_1.json", "w") as f:
+        json.dump({"name": "x"}, f)
+    storage = DataStorage(str(tmp_path))
+    assert storage.list_keys() == ["user_1"]
+    assert storage.load("user_1") == {"name": "x"}
+    assert os.path.exists(tmp_path / "legacy" / "user_1.json")
+    storage.close()
@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+import pytest
+
+from monitoring.tracing import FileExporter, Tracer
+
+
+@pytest.mark.asyncio
+async def test_tail_sampling_keeps_slow_and_failed_traces():
+    tracer = Tracer(sample_rate=0.0, slow_threshold=0.05)
+    with tracer.span("fast"):
+        pass
+    with tracer.span("slow"):
+        await asyncio.sleep(0.06)
+    with pytest.raises(RuntimeError):
+        with tracer.span("failed"):
+            raise RuntimeError("boom")
+    kept = [trace.spans[-1] for trace in tracer.traces()]
+    assert [span.name for span in kept] == ["slow", "failed"]
+    assert kept[1].error == "RuntimeError"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_children_and_self_time():
+    tracer = Tracer(sample_rate=1.0)
+
+    async def child(name):
+        with tracer.span(name):
+            await asyncio.sleep(0.05)
+
+    with tracer.span("root"):
+        await asyncio.gather(child("a"), child("b"))  # Tasks inherit the current span
+
+    (trace,) = tracer.traces()
+    root = next(span for span in trace.spans if span.name == "root")
+    assert {span.parent_id for span in trace.spans if span.name != "root"} == {root.span_id}
+    stages = {stage["name"]: stage for stage in tracer.breakdown()}
+    # The children overlap, so they cover the root's time only once
+    assert stages["root"]["self_ms"] < 20
+    assert stages["a"]["self_ms"] >= 45
+
+
+def test_file_exporter_writes_otlp_json(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(sample_rate=1.0, exporter=FileExporter(str(path), flush_interval=10))
+    with tracer.span("request", path="/x"):
+        with tracer.span("tool.call", tool="t"):
+            pass
+    tracer.shutdown()
+
+    (line,) = path.read_text().splitlines()
+    spans = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [span["name"] for span in spans] == ["tool.call", "request"]
+    assert spans[0]["parentSpanId"] == spans[1]["spanId"]
+    assert spans[0]["traceId"] == spans[1]["traceId"]
+    assert spans[1]["attributes"] == [{"key": "path", "value": {"stringValue": "/x"}}]